@@ -0,0 +1,82 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Node throughput of the backtracking search on the problem files of
+core/tests/, with the state of every unassigned domain pushed at each
+node ("push") and with the trail-based undo ("trail").
+
+Run from the src/ directory:
+    python -m Examples_Tree.benchmark [-n SOLUTIONS] [problem ...]
+"""
+
+import os, time, argparse
+
+from core.solver import init_problem, parse_problemfile
+from core.batch import find_problemfiles
+from constraint.constraint import BacktrackingSolver, Problem
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "..", "core", "tests")
+
+def problem_names():
+    """ Returns the sorted names of the problem files of core/tests/. """
+    return [os.path.basename(path) for path in find_problemfiles(TESTS_DIR)]
+
+def make_problem(name):
+    """ Returns the Problem of the problem file NAME of core/tests/. """
+    chords, figures = parse_problemfile(os.path.join(TESTS_DIR, name))
+    return init_problem(Problem(), chords, figures)
+
+def run(name, trail, max_solutions):
+    """ Searches problem NAME for at most MAX_SOLUTIONS solutions.
+    Output:
+        (int solutions, int nodes, float seconds)
+    """
+    problem = make_problem(name)
+    solver = BacktrackingSolver(trail=trail)
+    problem.setSolver(solver)
+    solutions = 0
+    start = time.time()
+    for solution in problem.getSolutionIter():
+        solutions += 1
+        if solutions == max_solutions:
+            break
+    return solutions, solver.nodes, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Node throughput of the \
+backtracking search on the problem files of core/tests/.")
+    parser.add_argument("problems", nargs="*",
+                        help="Problem files to run (default: all)")
+    parser.add_argument("-n", type=int, default=500,
+                        help="Stop each search after N solutions")
+    args = parser.parse_args()
+    names = args.problems or problem_names()
+    print "%-16s %9s %9s %12s %12s" % ("problem", "solutions", "nodes",
+                                       "push nodes/s", "trail nodes/s")
+    for name in names:
+        rates = []
+        for trail in (False, True):
+            solutions, nodes, seconds = run(name, trail, args.n)
+            rates.append(nodes / max(seconds, 1e-6))
+        print "%-16s %9d %9d %12.0f %12.0f" % ((name, solutions, nodes) +
+                                                tuple(rates))
+
+if __name__ == '__main__':
+    main()
@@ -26,8 +26,9 @@ def myComparator(x, y):
     y1= __voiceToNum__(y)
     if x1 > y1: return 1
     if x1 == y1:
-        x_num = int(x[1:])
-        y_num = int(y[1:])
+        # Vars are either "s3" (HarmonySolver) or "s_3" (init_problem())
+        x_num = int(x[1:].lstrip("_"))
+        y_num = int(y[1:].lstrip("_"))
         return x_num.__cmp__(y_num)
     # x1 < y1
     return -1
@@ -157,6 +158,103 @@ def grade(solution, chords, harmonies):
         utility += feature_weights[key] * feature_counts[key]
     return utility
 
+# grade() is a sum of terms looking at a single time step (doubled roots)
+# or at two consecutive ones (contrary motion, leaps to tendency tones).
+# The two functions below return those terms as functions of voicings,
+# i.e (s, a, t, b) tuples of pitches, so that:
+#   grade(solution) == sum of voicing_grader(chords.get(t))(voicing_t)
+#                    + sum of transition_grader(chords.get(t+1),
+#                        harmonies.get(t+1))(voicing_t, voicing_t+1)
+# Chord tones are computed once, when the function is created.
+
+# Contrary motion tags, for each pair of voices (index, index2)
+_motion_weights = [((index, index2), feature_weights["cm_" + _numToVoice(index) + "_" + _numToVoice(index2)])
+                   for index in range(4) for index2 in range(index + 1, 4)]
+
+def voicing_grader(chord):
+    """ Returns a function grading a voicing of CHORD on its own. """
+    weight = 0
+    if chord.getSeventh__() == None:
+        root = chord.getChordTones_nums()[0]
+        weight = feature_weights["doubled_root"]
+    def grade_voicing(voicing):
+        if weight and [note % 12 for note in voicing].count(root) >= 2:
+            return weight
+        return 0
+    return grade_voicing
+
+def transition_grader(chord_2, harmony_2):
+    """ Returns a function grading the motion from a voicing to a
+    voicing of CHORD_2, whose harmony is HARMONY_2.
+    """
+    leading_tone = None
+    if harmony_2 != None and harmony_2[0] == "V":
+        leading_tone = chord_2.getChordTones_nums()[1]
+    has_seventh = chord_2.getSeventh__() != None
+    weight_1 = feature_weights["leap_type1"]
+    weight_2 = feature_weights["leap_type2"]
+    def grade_transition(voicing_1, voicing_2):
+        utility = 0
+        for (index, index2), weight in _motion_weights:
+            dist_a = voicing_1[index] - voicing_2[index]
+            dist_b = voicing_1[index2] - voicing_2[index2]
+            if (dist_a > 0 and dist_b < 0) or (dist_a < 0 and dist_b > 0):
+                utility += weight
+        for note1, note2 in zip(voicing_1, voicing_2):
+            dist = note1 - note2
+            if leading_tone != None and (note2 % 12) == leading_tone and dist < -2:
+                utility += weight_1
+            if has_seventh and dist > 2:
+                utility += weight_2
+        return utility
+    return grade_transition
+
+# The same terms, split further for searches that need to bound the grade
+# of partial solutions: each term only looks at a few voices. A term is
+# (function, tuple VOICES, float BEST), where VOICES are indices in
+# (s, a, t, b), the function takes the pitches of those voices in order,
+# and BEST is a value it can never exceed.
+def voicing_terms(chord):
+    """ Splits voicing_grader(CHORD) into terms. """
+    grade_voicing = voicing_grader(chord)
+    best = max(feature_weights["doubled_root"], 0)
+    if chord.getSeventh__() != None:
+        best = 0
+    return [(lambda s, a, t, b: grade_voicing((s, a, t, b)), (0, 1, 2, 3), best)]
+
+def transition_terms(chord_2, harmony_2):
+    """ Splits transition_grader(CHORD_2, HARMONY_2) into terms. The
+    functions take the pitches of each voice at t and t+1, i.e
+    (x_t, x_t+1, y_t, y_t+1) for two voices x and y.
+    """
+    terms = []
+    for (index, index2), weight in _motion_weights:
+        def contrary_motion(a_0, a_1, b_0, b_1, weight=weight):
+            dist_a = a_0 - a_1
+            dist_b = b_0 - b_1
+            if (dist_a > 0 and dist_b < 0) or (dist_a < 0 and dist_b > 0):
+                return weight
+            return 0
+        terms.append((contrary_motion, (index, index2), max(weight, 0)))
+    leading_tone = None
+    if harmony_2 != None and harmony_2[0] == "V":
+        leading_tone = chord_2.getChordTones_nums()[1]
+    has_seventh = chord_2.getSeventh__() != None
+    if leading_tone != None or has_seventh:
+        weight_1 = feature_weights["leap_type1"]
+        weight_2 = feature_weights["leap_type2"]
+        def leap(note1, note2):
+            utility = 0
+            dist = note1 - note2
+            if leading_tone != None and (note2 % 12) == leading_tone and dist < -2:
+                utility += weight_1
+            if has_seventh and dist > 2:
+                utility += weight_2
+            return utility
+        for index in range(4):
+            terms.append((leap, (index,), max(weight_1, weight_2, 0)))
+    return terms
+
 def grade_debug(solution, chords, harmonies):
 
     _init_counts()
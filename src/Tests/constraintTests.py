@@ -0,0 +1,455 @@
+"""
+Unit tests for the CSP library in constraint/constraint.py.
+
+Run from the src/ directory:
+    python -m unittest Tests.constraintTests
+"""
+import random
+import unittest
+
+from constraint.constraint import Problem, BacktrackingSolver, \
+     CompiledProblem, ArrayAssignments, Unassigned, Domain, BitsetDomain, \
+     FunctionConstraint, TableConstraint, doArc2001, _VariableSelector, Trail, \
+     BranchAndBoundSolver, Budget
+
+def make_problem():
+    """ A small problem with unary, binary and ternary constraints. """
+    problem = Problem()
+    problem.addVariables(["x", "y", "z", "w"], range(6))
+    problem.addConstraint(lambda x: x != 3, ["x"])
+    problem.addConstraint(lambda x, y: x < y, ["x", "y"])
+    problem.addConstraint(lambda y, z: abs(y - z) <= 2, ["y", "z"])
+    problem.addConstraint(lambda x, z, w: x + z == w, ["x", "z", "w"])
+    return problem
+
+def solutions_by_dicts(problem):
+    """ Runs the dictionary-based search directly on PROBLEM. """
+    domains, constraints, vconstraints = problem._getArgs()
+    solver = BacktrackingSolver()
+    return list(solver.getSolutionIter(domains, constraints, vconstraints))
+
+class CompiledProblemTester(unittest.TestCase):
+
+    def testIds(self):
+        compiled = make_problem().compile()
+        self.assertTrue(isinstance(compiled, CompiledProblem))
+        self.assertEqual(compiled.variables, ["w", "x", "y", "z"])
+        self.assertEqual(compiled.ids["x"], 1)
+        self.assertEqual(len(compiled), 4)
+        # The unary constraint was consumed by preProcess()
+        self.assertEqual(len(compiled.constraints), 3)
+        self.assertEqual(compiled.constraints[0][1], (1, 2))
+        self.assertEqual(len(compiled.vconstraints[1]), 2)
+
+    def testSameSolutionsSameOrder(self):
+        expected = solutions_by_dicts(make_problem())
+        self.assertTrue(expected)
+        self.assertEqual(list(make_problem().getSolutionIter()), expected)
+        self.assertEqual(make_problem().getSolutions(), expected)
+        self.assertEqual(make_problem().getSolution(), expected[0])
+
+    def testBitsetsSameSolutions(self):
+        expected = sorted(solutions_by_dicts(make_problem()))
+        problem = make_problem()
+        problem.setBitsets(True)
+        self.assertEqual(sorted(problem.getSolutionIter()), expected)
+        self.assertEqual(sorted(problem.getSolutions()), expected)
+        self.assertTrue(problem.getSolution() in expected)
+
+    def testNoForwardCheck(self):
+        problem = make_problem()
+        problem.setSolver(BacktrackingSolver(forwardcheck=False))
+        self.assertEqual(sorted(problem.getSolutions()),
+                         sorted(solutions_by_dicts(make_problem())))
+
+    def testEmptyDomain(self):
+        problem = Problem()
+        problem.addVariable("a", [3])
+        problem.addConstraint(lambda a: a != 3, ["a"])
+        self.assertTrue(problem.compile() is None)
+        self.assertEqual(problem.getSolutions(), [])
+        self.assertTrue(problem.getSolution() is None)
+
+    def testArrayAssignments(self):
+        assignments = ArrayAssignments(3)
+        self.assertEqual(assignments.keys(), [])
+        assignments[2] = "v"
+        self.assertTrue(2 in assignments)
+        self.assertFalse(0 in assignments)
+        self.assertEqual(assignments.get(0, Unassigned), Unassigned)
+        self.assertEqual(assignments.items(), [(2, "v")])
+        copied = assignments.copy()
+        del assignments[2]
+        self.assertEqual(assignments.values(), [])
+        self.assertEqual(copied.values(), ["v"])
+
+class BitsetDomainTester(unittest.TestCase):
+
+    def testStates(self):
+        domain = BitsetDomain([67, 60, 64, 72])
+        self.assertEqual(len(domain), 4)
+        domain.pushState()
+        domain.hideValue(64)
+        domain.pushState()
+        domain.hideValue(72)
+        self.assertEqual(domain[:], [67, 60])
+        self.assertFalse(72 in domain)
+        domain.popState()
+        self.assertEqual(len(domain), 3)
+        domain.popState()
+        # Restored values keep their place
+        self.assertEqual(domain[:], [67, 60, 64, 72])
+        domain.hideValue(60)
+        domain.resetState()
+        self.assertEqual(len(domain), 4)
+
+    def testRemove(self):
+        domain = BitsetDomain(range(5))
+        domain.remove(2)
+        domain.hideValue(3)
+        domain.resetState()
+        self.assertEqual(domain[:], [0, 1, 3, 4])
+        self.assertRaises(ValueError, domain.remove, 2)
+
+    def testMembership(self):
+        domain = BitsetDomain([0, 127])
+        self.assertTrue(127 in domain)
+        self.assertFalse(-1 in domain)
+        self.assertFalse(None in domain)
+        self.assertFalse(128 in domain)
+        self.assertRaises(ValueError, BitsetDomain, [128])
+
+    def testCompiledDomains(self):
+        problem = Problem()
+        problem.addVariable("p", [60, 64, 67])
+        problem.addVariable("q", ["c", "e"])
+        compiled = problem.compile()
+        self.assertTrue(isinstance(compiled.domains[0], Domain))
+        compiled = problem.compile(bitsets=True)
+        self.assertTrue(isinstance(compiled.domains[0], BitsetDomain))
+        self.assertTrue(isinstance(compiled.domains[1], Domain))
+        problem.setBitsets(True)
+        self.assertTrue(isinstance(problem.compile().domains[0], BitsetDomain))
+        self.assertTrue(isinstance(problem.compile(bitsets=False).domains[0],
+                                   Domain))
+
+    def testAddVariable(self):
+        problem = Problem()
+        problem.addVariable("p", BitsetDomain([1, 2]))
+        self.assertEqual(sorted(problem.getSolutions()), [{"p": 1}, {"p": 2}])
+
+def make_table_problem(constraint_class, **kwargs):
+    """ The same problem with every constraint of CONSTRAINT_CLASS. """
+    problem = Problem()
+    problem.addVariables(["a", "b", "c", "d"], range(5))
+    problem.addConstraint(constraint_class(lambda a, b, c, d: a + b == c + d,
+                                           **kwargs),
+                          ["a", "b", "c", "d"])
+    problem.addConstraint(constraint_class(lambda a, c: a > c, **kwargs),
+                          ["a", "c"])
+    problem.addConstraint(constraint_class(lambda d: d != 2, **kwargs), ["d"])
+    return problem
+
+class TableConstraintTester(unittest.TestCase):
+
+    def testSameSolutions(self):
+        expected = sorted(make_table_problem(FunctionConstraint).getSolutions())
+        self.assertTrue(expected)
+        solutions = make_table_problem(TableConstraint).getSolutions()
+        self.assertEqual(sorted(solutions), expected)
+        solutions = make_table_problem(TableConstraint, maxtuples=10).getSolutions()
+        self.assertEqual(sorted(solutions), expected)
+
+    def testPreProcessPrunes(self):
+        problem = Problem()
+        problem.addVariables(["a", "b"], range(5))
+        problem.addConstraint(TableConstraint(lambda a, b: a + 3 < b), ["a", "b"])
+        compiled = problem.compile()
+        self.assertEqual(compiled.domains[0][:], [0])
+        self.assertEqual(compiled.domains[1][:], [4])
+        # The problem's own domains are left alone
+        self.assertEqual(problem._variables["a"], range(5))
+
+    def testForwardCheck(self):
+        constraint = TableConstraint(lambda a, b, c: a + b + c == 3)
+        domains = {"a": Domain(range(4)), "b": Domain(range(4)),
+                   "c": Domain(range(4))}
+        variables = ["a", "b", "c"]
+        constraint.preProcess(variables, domains, [(constraint, variables)],
+                              dict((v, [(constraint, variables)])
+                                   for v in variables))
+        # Two variables unassigned: both are pruned
+        self.assertTrue(constraint(variables, domains, {"a": 2}, True))
+        self.assertEqual(sorted(domains["b"]), [0, 1])
+        self.assertEqual(sorted(domains["c"]), [0, 1])
+        self.assertTrue(constraint(variables, domains, {"a": 2, "b": 0}, True))
+        self.assertEqual(domains["c"][:], [1])
+        self.assertFalse(constraint(variables, domains, {"a": 2, "b": 0, "c": 0}))
+
+    def testUnknownValues(self):
+        constraint = TableConstraint(lambda a, b: a < b)
+        domains = {"a": Domain([1, 2]), "b": Domain([1, 2])}
+        variables = ["a", "b"]
+        constraint.preProcess(variables, domains, [(constraint, variables)],
+                              dict((v, [(constraint, variables)])
+                                   for v in variables))
+        # Values the table was not built on are handed to the function
+        self.assertTrue(constraint(variables, domains, {"a": 1, "b": 7}))
+        self.assertFalse(constraint(variables, domains, {"a": 9, "b": 7}))
+
+class ArcConsistencyTester(unittest.TestCase):
+
+    def testSameSolutions(self):
+        expected = sorted(make_problem().getSolutions())
+        problem = make_problem()
+        problem.setArcConsistency(True)
+        self.assertEqual(sorted(problem.getSolutions()), expected)
+        problem = make_table_problem(TableConstraint)
+        problem.setArcConsistency(True)
+        self.assertEqual(sorted(problem.getSolutions()),
+                         sorted(make_table_problem(FunctionConstraint).getSolutions()))
+
+    def testPrunesNary(self):
+        domains = dict((v, Domain(range(4))) for v in "abcd")
+        constraints = [(FunctionConstraint(lambda a, b, c: a + b + c == 8),
+                        ["a", "b", "c"]),
+                       (FunctionConstraint(lambda c, d: c < d), ["c", "d"])]
+        # c < d leaves c <= 2, so a and b are 3 and c is 2
+        self.assertTrue(doArc2001(domains, constraints))
+        self.assertEqual(sorted(domains["a"]), [3])
+        self.assertEqual(sorted(domains["b"]), [3])
+        self.assertEqual(sorted(domains["c"]), [2])
+        self.assertEqual(sorted(domains["d"]), [3])
+        # With a sum of 9, c must be 3 and d has no value left
+        domains = dict((v, Domain(range(4))) for v in "abcd")
+        constraints[0] = (FunctionConstraint(lambda a, b, c: a + b + c == 9),
+                          ["a", "b", "c"])
+        self.assertFalse(doArc2001(domains, constraints))
+
+    def testWipeOut(self):
+        problem = Problem(arcconsistency=True)
+        problem.addVariables(["a", "b", "c"], [1, 2])
+        problem.addConstraint(lambda a, b: a != b, ["a", "b"])
+        problem.addConstraint(lambda b, c: b != c, ["b", "c"])
+        problem.addConstraint(lambda a, c: a != c, ["a", "c"])
+        domains = problem._getArgs()[0]
+        self.assertTrue(domains is not None)
+        problem.addConstraint(lambda a, b, c: a + b + c == 6, ["a", "b", "c"])
+        self.assertTrue(problem._getArgs()[0] is None)
+        self.assertTrue(problem.compile() is None)
+        self.assertEqual(problem.getSolutions(), [])
+
+    def testMaxTuples(self):
+        domains = {"a": Domain(range(3)), "b": Domain(range(3))}
+        constraints = [(FunctionConstraint(lambda a, b: a > b), ["a", "b"])]
+        self.assertTrue(doArc2001(domains, constraints, maxtuples=8))
+        self.assertEqual(len(domains["a"]), 3)
+        self.assertTrue(doArc2001(domains, constraints, maxtuples=9))
+        self.assertEqual(sorted(domains["a"]), [1, 2])
+
+class GACFunctionConstraintTester(unittest.TestCase):
+
+    def setUp(self):
+        self.variables = ["a", "b", "c"]
+        self.domains = dict((v, Domain(range(4))) for v in self.variables)
+        for domain in self.domains.values():
+            domain.pushState()
+
+    def testPrunesAllUnassigned(self):
+        constraint = FunctionConstraint(lambda a, b, c: a + b + c == 8,
+                                        gac=True)
+        self.assertTrue(constraint(self.variables, self.domains,
+                                   {"a": 3}, True))
+        self.assertEqual(sorted(self.domains["b"]), [2, 3])
+        self.assertEqual(sorted(self.domains["c"]), [2, 3])
+        self.assertFalse(constraint(self.variables, self.domains,
+                                    {"a": 0}, True))
+
+    def testWithoutGAC(self):
+        constraint = FunctionConstraint(lambda a, b, c: a + b + c == 8)
+        self.assertTrue(constraint(self.variables, self.domains,
+                                   {"a": 3}, True))
+        self.assertEqual(len(self.domains["b"]), 4)
+
+    def testBudget(self):
+        constraint = FunctionConstraint(lambda a, b, c: a + b + c == 8,
+                                        gac=True, maxchecks=0)
+        self.assertTrue(constraint(self.variables, self.domains,
+                                   {"a": 0}, True))
+        self.assertEqual(len(self.domains["b"]), 4)
+
+    def testSetGAC(self):
+        constraint = FunctionConstraint(lambda a, b, c: a + b + c == 8)
+        constraint.setGAC(True, 0)
+        self.assertTrue(constraint(self.variables, self.domains,
+                                   {"a": 3}, True))
+        self.assertEqual(len(self.domains["b"]), 4)
+        constraint.setGAC(True, 1000)
+        self.assertTrue(constraint(self.variables, self.domains,
+                                   {"a": 3}, True))
+        self.assertEqual(sorted(self.domains["b"]), [2, 3])
+        constraint.setGAC(False)
+        self.assertFalse(constraint._gac)
+        self.assertEqual(constraint._maxchecks, 1000)
+
+    def testSameSolutions(self):
+        expected = sorted(make_table_problem(FunctionConstraint).getSolutions())
+        for maxchecks in (0, 5, 1000):
+            problem = make_table_problem(FunctionConstraint, gac=True,
+                                         maxchecks=maxchecks)
+            self.assertEqual(sorted(problem.getSolutions()), expected)
+
+class VariableSelectorTester(unittest.TestCase):
+
+    def testSortedOrder(self):
+        rand = random.Random(7)
+        domains = [Domain(range(rand.randint(1, 6))) for i in range(30)]
+        degrees = [-rand.randint(1, 4) for domain in domains]
+        selector = _VariableSelector(domains, degrees)
+        queued = set(range(len(domains)))
+        for step in range(200):
+            variable = rand.randrange(len(domains))
+            domain = domains[variable]
+            if rand.random() < 0.5 and len(domain) > 1:
+                domain.hideValue(domain[0])
+            else:
+                domain.resetState()
+            selector.update(variable)
+            if rand.random() < 0.3:
+                expected = min([(degrees[x], len(domains[x]), x)
+                                for x in queued] or [(None, None, None)])[-1]
+                self.assertEqual(selector.pop(), expected)
+                queued.discard(expected)
+            elif rand.random() < 0.3 and variable not in queued:
+                selector.add(variable)
+                queued.add(variable)
+
+class TrailTester(unittest.TestCase):
+
+    def search(self, problem, trail):
+        compiled = problem.compile()
+        solver = BacktrackingSolver(trail=trail)
+        solutions = list(solver.getCompiledSolutionIter(compiled))
+        return solutions, solver.nodes
+
+    def testSameSearch(self):
+        for problem in (make_problem, lambda: make_table_problem(TableConstraint),
+                        lambda: make_table_problem(FunctionConstraint, gac=True)):
+            expected, nodes = self.search(problem(), False)
+            self.assertTrue(expected)
+            self.assertEqual(self.search(problem(), True), (expected, nodes))
+
+    def testOnlyChangedDomains(self):
+        trail = Trail()
+        domains = [Domain(range(3)) for i in range(3)]
+        for domain in domains:
+            domain.setTrail(trail)
+        trail.pushState()
+        domains[1].hideValue(0)
+        domains[1].hideValue(1)
+        self.assertEqual(len(trail._entries), 1)
+        trail.pushState()
+        domains[1].hideValue(2)
+        domains[2].hideValue(2)
+        self.assertEqual(len(trail._entries), 3)
+        trail.popState()
+        self.assertEqual([len(domain) for domain in domains], [3, 1, 3])
+        trail.popState()
+        self.assertEqual([len(domain) for domain in domains], [3, 3, 3])
+
+def make_objective_problem(solver):
+    """ make_problem() with a cost favouring spread out values. """
+    problem = make_problem()
+    problem.setSolver(solver)
+    problem.addObjective(lambda x, y: -abs(x - y), ["x", "y"], -5)
+    problem.addObjective(lambda z, w: (z - 2 * w) ** 2 % 7, ["z", "w"])
+    problem.addObjective(lambda w: w, ["w"])
+    return problem
+
+def solution_cost(solution):
+    return (-abs(solution["x"] - solution["y"]) +
+            (solution["z"] - 2 * solution["w"]) ** 2 % 7 + solution["w"])
+
+class BranchAndBoundSolverTester(unittest.TestCase):
+
+    def testBestSolutions(self):
+        costs = sorted(solution_cost(solution)
+                       for solution in make_problem().getSolutions())
+        for forwardcheck in (True, False):
+            solver = BranchAndBoundSolver(k=4, forwardcheck=forwardcheck)
+            solutions = make_objective_problem(solver).getSolutions()
+            self.assertTrue(solver.optimal)
+            self.assertEqual(solver.costs, costs[:4])
+            self.assertEqual([solution_cost(solution) for solution in solutions],
+                             costs[:4])
+
+    def testMoreThanAll(self):
+        expected = len(make_problem().getSolutions())
+        solver = BranchAndBoundSolver(k=1000)
+        self.assertEqual(len(make_objective_problem(solver).getSolutions()),
+                         expected)
+        self.assertEqual(solver.costs, sorted(solver.costs))
+
+    def testNodeBudget(self):
+        solver = BranchAndBoundSolver(k=2, maxnodes=5)
+        solutions = make_objective_problem(solver).getSolutions()
+        self.assertFalse(solver.optimal)
+        self.assertEqual(solver.nodes, 5)
+        self.assertEqual([solution_cost(solution) for solution in solutions],
+                         solver.costs)
+
+    def testRemoveVariable(self):
+        problem = make_objective_problem(BranchAndBoundSolver())
+        problem.removeVariable("w")
+        self.assertEqual(len(problem._objectives), 1)
+
+class BudgetTester(unittest.TestCase):
+
+    def testNodes(self):
+        expected = solutions_by_dicts(make_problem())
+        for budget in (Budget(nodes=10), Budget(nodes=10, interval=1)):
+            problem = make_problem()
+            problem.setSolver(BacktrackingSolver(budget=budget))
+            solutions = problem.getSolutions()
+            self.assertEqual(budget.spent, "nodes")
+            self.assertEqual(budget.nodes, 11)
+            self.assertTrue(len(solutions) < len(expected))
+            self.assertEqual(solutions, expected[:len(solutions)])
+        budget = Budget(nodes=10000)
+        problem = make_problem()
+        problem.setSolver(BacktrackingSolver(budget=budget))
+        self.assertEqual(len(problem.getSolutions()), len(expected))
+        self.assertEqual(budget.spent, None)
+
+    def testTimeAndHalted(self):
+        problem = Problem(BacktrackingSolver(budget=Budget(seconds=0)))
+        problem.addVariables(range(20), range(10))
+        self.assertEqual(problem.getSolutions(), [])
+        self.assertEqual(problem.getSolver().budget.spent, "time")
+        budget = Budget(halted=lambda: True, interval=4)
+        problem.setSolver(BacktrackingSolver(budget=budget))
+        self.assertEqual(problem.getSolutions(), [])
+        self.assertEqual((budget.spent, budget.nodes), ("halted", 4))
+
+    def testMemory(self):
+        # A peak reached before the search doesn't count
+        data = "x" * (64 * 1024 * 1024)
+        del data
+        expected = solutions_by_dicts(make_problem())
+        budget = Budget(memory=16 * 1024 * 1024, interval=1)
+        problem = make_problem()
+        problem.setSolver(BacktrackingSolver(budget=budget))
+        self.assertEqual(problem.getSolutions(), expected)
+        self.assertEqual(budget.spent, None)
+
+    def testBranchAndBound(self):
+        budget = Budget(nodes=5)
+        solver = BranchAndBoundSolver(k=2, budget=budget)
+        solutions = make_objective_problem(solver).getSolutions()
+        self.assertFalse(solver.optimal)
+        self.assertEqual(budget.spent, "nodes")
+        self.assertEqual([solution_cost(solution) for solution in solutions],
+                         solver.costs)
+
+if __name__ == '__main__':
+    unittest.main()
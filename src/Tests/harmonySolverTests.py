@@ -0,0 +1,1403 @@
+"""
+Unit tests for the harmonization problems built by core/solver.py.
+
+Run from the src/ directory:
+    python -m unittest Tests.harmonySolverTests
+"""
+import sys, os, json, shutil, tempfile, hashlib, subprocess, itertools, \
+       signal
+import unittest
+
+from core.solver import init_problem, parse_problemfile, make_timelists, \
+     HarmonySolver, solve_bnb, add_figure_constraints
+from core.harmony_rules import propagate_constraints
+from core.voicings import VoicingCache, chord_voicings, tabulate_voicings, \
+     VoicingTableConstraint
+from core import config, voicings, transitions, parallel, batch, anytime, \
+     solution_cache, online, diverse, kbest, beam
+from Data_Structures.dataStructs import TimeList
+from core.chain import VoicingChain, viterbi, count_solutions, \
+     forward_counts, backward_counts, iter_paths, IncrementalChain, \
+     ChainSampler, sample_solutions, GradedChain, solution_marginals, \
+     feasible_pitches
+from core.Note import Chord
+from constraint import constraint
+from Grader import grader
+from Grader.grader import grade, voicing_grader, transition_grader
+from mxm_Python_MIDI.MidiOutFile import MidiOutFile
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "..", "core", "tests")
+
+def load(name):
+    """ Returns (chords, figures) of a problem file in core/tests/. """
+    return parse_problemfile(os.path.join(TESTS_DIR, name))
+
+def grader_solution(solution):
+    """ Renames the "s_0" vars of init_problem() to the "s0" of grade(). """
+    return dict((var.replace("_", ""), pitch) for var, pitch in solution.items())
+
+def make_harmony_solver():
+    """ ii6 V7 I, as in Examples_Tree/harmonytests.py. """
+    harm = HarmonySolver()
+    for t, (root, modifiers, bass, harmony) in enumerate(
+            [("D", ["min"], "F", "ii6"), ("G", ["7"], "G", "V7"),
+             ("C", None, "C", "I")]):
+        harm.addChord(Chord(root, modifiers, t, bass), t)
+        harm.addHarmony(harmony, t)
+    harm.addHarmonyRules()
+    return harm
+
+def solution_set(problem):
+    return set(tuple(sorted(s.items())) for s in problem.getSolutionIter())
+
+class TableConstraintsTester(unittest.TestCase):
+
+    def testSameSolutions(self):
+        for name in ("dom_1a", "ex_1b", "ex_fig_1b"):
+            chords, figures = load(name)
+            expected = solution_set(init_problem(constraint.Problem(), chords,
+                                                 figures, tables=False))
+            self.assertTrue(expected)
+            problem = init_problem(constraint.Problem(), chords, figures,
+                                   tables=True)
+            self.assertEqual(solution_set(problem), expected)
+
+class ArcConsistencyTester(unittest.TestCase):
+
+    def testSameSolutions(self):
+        for name in ("dim_1a", "ex_fig_1b"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            expected = solution_set(problem)
+            before = sum(map(len, problem._getArgs()[0].values()))
+            problem.setArcConsistency(True)
+            self.assertEqual(solution_set(problem), expected)
+            after = sum(map(len, problem._getArgs()[0].values()))
+            self.assertTrue(after < before)
+
+class BitsetDomainsTester(unittest.TestCase):
+
+    def testHarmonySearch(self):
+        chords, figures = load("dim_1a")
+        expected = solution_set(init_problem(constraint.Problem(), chords,
+                                             figures))
+        config.bitset_domains = True
+        try:
+            problem = init_problem(constraint.Problem(), chords, figures)
+            harm = make_harmony_solver()
+        finally:
+            config.bitset_domains = False
+        for searched in (problem, harm.problem):
+            for domain in searched.compile().domains:
+                self.assertEqual(type(domain), constraint.BitsetDomain)
+        self.assertEqual(solution_set(problem), expected)
+        self.assertEqual(solution_set(harm.problem),
+                         solution_set(make_harmony_solver().problem))
+
+class PropagateConstraintsTester(unittest.TestCase):
+
+    def testSameSolutions(self):
+        for name in ("dom_1a", "ex_fig_1b"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            expected = solution_set(problem)
+            for maxchecks in (20, 1000):
+                problem = propagate_constraints(problem, maxchecks)
+                self.assertEqual(solution_set(problem), expected)
+
+class ViterbiTester(unittest.TestCase):
+
+    def testGraderDecomposition(self):
+        chords, figures = load("dim_1a")
+        chords_tl, harmonies_tl = make_timelists(chords)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chain = VoicingChain(problem)
+        for solution in problem.getSolutions()[:50]:
+            voicings = [tuple(solution[var] for var in vars_)
+                        for vars_ in chain.variables]
+            total = sum(voicing_grader(chords_tl.get(t))(voicing)
+                        for t, voicing in enumerate(voicings))
+            for t in range(1, len(voicings)):
+                grade_transition = transition_grader(chords_tl.get(t),
+                                                     harmonies_tl.get(t))
+                total += grade_transition(voicings[t-1], voicings[t])
+            self.assertAlmostEqual(total, grade(grader_solution(solution),
+                                                chords_tl, harmonies_tl))
+
+    def testBestGrade(self):
+        for name in ("dim_1a", "ex_1b", "ex_fig_1a"):
+            chords, figures = load(name)
+            chords_tl, harmonies_tl = make_timelists(chords)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            solutions = problem.getSolutions()
+            best = max(grade(grader_solution(solution), chords_tl,
+                             harmonies_tl) for solution in solutions)
+            dp_grade, dp_solution = viterbi(VoicingChain(problem), chords_tl,
+                                            harmonies_tl)
+            self.assertAlmostEqual(dp_grade, best)
+            self.assertTrue(dp_solution in solutions)
+
+    def testNoSolution(self):
+        chords, figures = load("TEMPLATE")
+        chords_tl, harmonies_tl = make_timelists(chords)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        self.assertEqual(viterbi(VoicingChain(problem), chords_tl,
+                                 harmonies_tl), None)
+
+    def testNotAChain(self):
+        problem = constraint.Problem()
+        problem.addVariables(["s0", "s1", "s2"], [60, 62])
+        problem.addConstraint(lambda x, y: x != y, ["s0", "s2"])
+        self.assertRaises(ValueError, VoicingChain, problem)
+
+    def testHarmonySolverEngine(self):
+        harm = make_harmony_solver()
+        harm.num_solutions = 100000
+        best_csp = harm.solveProblem()[0]
+        harm.engine = "dp"
+        solutions = harm.solveProblem()
+        self.assertEqual(len(solutions), 1)
+        self.assertAlmostEqual(solutions[0][0], best_csp[0])
+
+class CountSolutionsTester(unittest.TestCase):
+
+    def testCounts(self):
+        for name in ("TEMPLATE", "dim_1a", "ex_1a", "ex_fig_1a"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            expected = len(problem.getSolutions())
+            self.assertEqual(count_solutions(problem), expected)
+            chain = VoicingChain(problem)
+            self.assertEqual(count_solutions(chain), expected)
+            if expected:
+                self.assertEqual(sum(forward_counts(chain)[-1]), expected)
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        self.assertEqual(count_solutions(harm.problem),
+                         len(harm.problem.getSolutions()))
+
+    def testPaths(self):
+        chords, figures = load("dim_1a")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chain = VoicingChain(problem)
+        counts = backward_counts(chain)
+        self.assertEqual(sum(counts[0]), count_solutions(chain))
+        solutions = []
+        for first in range(len(chain.voicings[0])):
+            paths = list(iter_paths(chain, first, counts))
+            self.assertEqual(len(paths), counts[0][first])
+            self.assertEqual(paths, sorted(paths))
+            solutions.extend(tuple(sorted(chain.solution(path).items()))
+                             for path in paths)
+        self.assertEqual(len(solutions), len(set(solutions)))
+        self.assertEqual(set(solutions), solution_set(problem))
+
+    def testSpecifiedOutOfRange(self):
+        # test8 of Examples_Tree/harmonytests.py, starting above the range
+        harm = HarmonySolver()
+        for t, (root, modifiers, harmony) in enumerate(
+                [("A", None, "I"), ("F#", ["min"], "vi"), ("E", None, "V"),
+                 ("A", None, "I")]):
+            harm.addChord(Chord(root, modifiers, t), t)
+            harm.addHarmony(harmony, t)
+        harm.addHarmonyRules()
+        notes = TimeList()
+        for t, pitch in enumerate([85, 81, 83, 81]):
+            notes.add(t, pitch)
+        harm.specify_voice("soprano", notes)
+        expected = len(harm.problem.getSolutions())
+        self.assertTrue(expected)
+        self.assertEqual(count_solutions(harm.problem), expected)
+
+class BranchAndBoundTester(unittest.TestCase):
+
+    def testBestGrades(self):
+        for name in ("dim_1a", "ex_fig_1b"):
+            chords, figures = load(name)
+            chords_tl, harmonies_tl = make_timelists(chords)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            grades = sorted([grade(grader_solution(solution), chords_tl,
+                                   harmonies_tl)
+                             for solution in problem.getSolutions()],
+                            reverse=True)
+            solutions, bnb_grades, optimal = solve_bnb(problem, chords_tl,
+                                                       harmonies_tl, k=5)
+            self.assertTrue(optimal)
+            self.assertEqual(len(bnb_grades), 5)
+            for bnb_grade, solution, expected in zip(bnb_grades, solutions,
+                                                     grades):
+                self.assertAlmostEqual(bnb_grade, expected)
+                self.assertAlmostEqual(grade(grader_solution(solution),
+                                             chords_tl, harmonies_tl),
+                                       expected)
+            self.assertTrue(isinstance(problem.getSolver(),
+                                       constraint.BacktrackingSolver))
+
+    def testHarmonySolverEngine(self):
+        harm = make_harmony_solver()
+        harm.engine = "dp"
+        best = harm.solveProblem()[0][0]
+        harm.engine = "bnb"
+        solutions = harm.solveProblem()
+        self.assertAlmostEqual(solutions[0][0], best)
+        self.assertEqual([g for g, solution in solutions],
+                         sorted([g for g, solution in solutions], reverse=True))
+
+class VoicingCacheTester(unittest.TestCase):
+
+    def testVoicings(self):
+        for chord in (Chord("G", ["7"], 0, "B", "V65"), Chord("C", None, 0),
+                      Chord("C", None, 0, role="I")):
+            problem = constraint.Problem()
+            harm = HarmonySolver()
+            harm.problem = problem
+            harm.addChord(chord, chord.time)
+            harm.addHarmonyRules()
+            expected = sorted(tuple(solution[voice + str(chord.time)]
+                                    for voice in "satb")
+                              for solution in problem.getSolutionIter())
+            self.assertEqual(list(chord_voicings(chord)), expected)
+
+    def testLeastRecentlyUsed(self):
+        cache = VoicingCache(2)
+        chords = [Chord("C", None, 0), Chord("F", None, 1),
+                  Chord("C", None, 2), Chord("G", None, 3)]
+        for chord in chords:
+            cache.get(chord)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 3, 2))
+        cache.get(chords[1])
+        self.assertEqual(cache.misses, 4)
+        cache.get(chords[3])
+        self.assertEqual(cache.hits, 2)
+
+    def testTranspositions(self):
+        names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#",
+                 "B"]
+        for transpose in (True, False):
+            cache = VoicingCache(256, transpose)
+            for k in (7, 0, 6, 1, 11, 5, 2, 10, 3, 9, 4, 8):
+                # ii6 of the key of names[k]
+                chord = Chord(names[(k + 2) % 12], ["min", "7"], 0,
+                              names[(k + 5) % 12], "ii6")
+                self.assertEqual(cache.get(chord),
+                                 voicings.enumerate_voicings(chord))
+            self.assertEqual((cache.misses, cache.transposed),
+                             (12, 11 if transpose else 0))
+
+    def testChain(self):
+        chords, figures = load("ex_fig_1a")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chain = VoicingChain(problem)
+        tabulated = VoicingChain(tabulate_voicings(problem))
+        self.assertEqual(chain.voicings, tabulated.voicings)
+        for k, voicings in enumerate(chain.voicings):
+            self.assertTrue(voicings)
+            self.assertTrue(set(voicings) <= set(chord_voicings(chords[k])))
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        voicings.cache.clear()
+        chain = VoicingChain(harm.problem)
+        self.assertEqual(voicings.cache.misses, 3)
+        for k, voicings_ in enumerate(chain.voicings):
+            self.assertTrue(set(voicings_) <=
+                            set(chord_voicings(harm.chords.get(k))))
+        self.assertEqual(count_solutions(chain),
+                         len(harm.problem.getSolutions()))
+
+    def testVoicingTables(self):
+        for name in ("dim_1a", "ex_fig_1b"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            expected = solution_set(problem)
+            problem = tabulate_voicings(problem)
+            self.assertEqual(len([1 for rule, variables in problem._constraints
+                                  if isinstance(rule, VoicingTableConstraint)]),
+                             len(chords))
+            self.assertEqual(solution_set(problem), expected)
+
+def make_chains(problem):
+    """ Returns the VoicingChain of PROBLEM, built with and without
+    transitions.transition_matrix().
+    """
+    chains = []
+    for vectorized in (True, False):
+        config.vectorized_transitions = vectorized
+        try:
+            chains.append(VoicingChain(problem))
+        finally:
+            config.vectorized_transitions = True
+    return chains
+
+@unittest.skipUnless(transitions.canVectorize, "NumPy isn't installed")
+class TransitionMatrixTester(unittest.TestCase):
+
+    def testSameTransitions(self):
+        for name in ("dimfull_1a", "ex_1c", "ex_fig_1a"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            vectorized, looped = make_chains(problem)
+            self.assertEqual(vectorized.successors, looped.successors)
+        vectorized, looped = make_chains(make_harmony_solver().problem)
+        self.assertEqual(vectorized.successors, looped.successors)
+
+    def testOtherRules(self):
+        harm = make_harmony_solver()
+        harm.problem.addConstraint(lambda s0, s1: s0 != s1, ["s0", "s1"])
+        vectorized, looped = make_chains(harm.problem)
+        self.assertEqual(vectorized.successors, looped.successors)
+        for i, valid in enumerate(vectorized.successors[0]):
+            for j in valid:
+                self.assertNotEqual(vectorized.voicings[0][i][0],
+                                    vectorized.voicings[1][j][0])
+
+    def testCsrAdjacency(self):
+        matrix = transitions.numpy.array([[True, False, True],
+                                          [False, False, False],
+                                          [False, True, False]])
+        indptr, indices = transitions.csr_adjacency(matrix)
+        self.assertEqual(indptr.tolist(), [0, 2, 2, 3])
+        self.assertEqual(indices.tolist(), [0, 2, 1])
+
+class ParallelTester(unittest.TestCase):
+
+    def graded(self, problem, chords, harmonies):
+        return sorted([(grade(solution, chords, harmonies),
+                        tuple(sorted(solution.items())))
+                       for solution in problem.getSolutionIter()],
+                      key=lambda (g, items): (-g, items))
+
+    def testAllSolutions(self):
+        harm = make_harmony_solver()
+        expected = self.graded(harm.problem, harm.chords, harm.harmonies)
+        for workers, chunksize in ((1, 4), (2, 1), (3, 5)):
+            solutions = parallel.solve_parallel(harm.problem, harm.chords,
+                                                harm.harmonies, 1000,
+                                                workers, chunksize)
+            self.assertEqual([(g, tuple(sorted(solution.items())))
+                              for g, solution in solutions], expected)
+
+    def testDeterministic(self):
+        chords, figures = load("ex_1c")
+        chords_tl, harmonies_tl = make_timelists(chords)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        results = [parallel.solve_parallel(problem, chords_tl, harmonies_tl,
+                                           50, workers, chunksize)
+                   for workers, chunksize in ((1, 4), (2, 3), (4, 1))]
+        self.assertEqual(len(results[0]), 50)
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+        grades = [g for g, solution in results[0]]
+        self.assertEqual(grades, sorted(grades, reverse=True))
+
+    def testNotAChain(self):
+        harm = make_harmony_solver()
+        harm.problem.addConstraint(lambda s0, s2: s0 != s2, ["s0", "s2"])
+        expected = self.graded(harm.problem, harm.chords, harm.harmonies)
+        for workers in (1, 2):
+            solutions = parallel.solve_parallel(harm.problem, harm.chords,
+                                                harm.harmonies, 1000,
+                                                workers, 2)
+            self.assertEqual([(g, tuple(sorted(solution.items())))
+                              for g, solution in solutions], expected)
+        self.assertEqual(len(harm.problem.getSolutions()), len(expected))
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        harm.engine = "parallel"
+        workers = config.parallel_workers
+        config.parallel_workers = 2
+        try:
+            solutions = harm.solveProblem()
+            # The workers don't change the "csp" engine
+            harm.engine = "csp"
+            harm.num_solutions = 20
+            serial = make_harmony_solver()
+            serial.num_solutions = 20
+            self.assertEqual(harm.solveProblem(), serial.solveProblem())
+        finally:
+            config.parallel_workers = workers
+        self.assertEqual(len(solutions), len(harm.problem.getSolutions()))
+        self.assertEqual([var for var, pitch in solutions[0][1]][:2],
+                         ["s0", "s1"])
+
+PROGRESSION = [("C", None, "C", "I"), ("A", ["min"], "A", "vi"),
+               ("D", ["min"], "F", "ii6"), ("G", ["7"], "G", "V7")] * 3
+
+def make_progression_solver(progression):
+    harm = HarmonySolver()
+    harm.engine = "dp"
+    for t, (root, modifiers, bass, harmony) in enumerate(progression):
+        harm.addChord(Chord(root, modifiers and list(modifiers), t, bass), t)
+        harm.addHarmony(harmony, t)
+    harm.addHarmonyRules()
+    return harm
+
+class IncrementalChainTester(unittest.TestCase):
+
+    def testEditChord(self):
+        harm = make_progression_solver(PROGRESSION)
+        harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (12, 11))
+        harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (0, 0))
+        harm.removeChord(5)
+        harm.removeHarmony(5)
+        harm.addChord(Chord("F", None, 5, "F"), 5)
+        harm.addHarmony("IV", 5)
+        harm.addHarmonyRules()
+        solutions = harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (1, 2))
+        progression = list(PROGRESSION)
+        progression[5] = ("F", None, "F", "IV")
+        fresh = make_progression_solver(progression)
+        self.assertEqual(solutions, fresh.solveProblem())
+        self.assertEqual(len(harm.problem._constraints),
+                         len(fresh.problem._constraints))
+        self.assertEqual(harm.chain.backward_counts(),
+                         backward_counts(VoicingChain(fresh.problem)))
+
+    def testResolve(self):
+        # The GUI solves with the "csp" engine, then along the chain
+        harm = make_progression_solver(PROGRESSION[:4])
+        harm.engine = harm.resolveEngine()
+        self.assertEqual(harm.engine, "csp")
+        harm.num_solutions = 20
+        harm.solveProblem()
+        voicings = list(harm.chain.voicings)
+        harm.removeChord(2)
+        harm.removeHarmony(2)
+        harm.addChord(Chord("F", None, 2, "F"), 2)
+        harm.addHarmony("IV", 2)
+        harm.addHarmonyRules()
+        harm.engine = harm.resolveEngine()
+        self.assertEqual(harm.engine, "dp")
+        solutions = harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (1, 2))
+        for t in (0, 1, 3):
+            self.assertTrue(harm.chain.voicings[t] is voicings[t])
+        progression = list(PROGRESSION[:4])
+        progression[2] = ("F", None, "F", "IV")
+        self.assertEqual(solutions,
+                         make_progression_solver(progression).solveProblem())
+        harm.removeAll()
+        self.assertEqual(harm.resolveEngine(), "csp")
+
+    def testSpecifyVoice(self):
+        harm = make_progression_solver(PROGRESSION)
+        sol_grade, solution = harm.solveProblem()[0]
+        notes = TimeList()
+        notes.add(7, dict(solution)["s7"])
+        harm.specify_voice("soprano", notes)
+        self.assertEqual(harm.solveProblem(), [(sol_grade, solution)])
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (1, 2))
+        harm.specify_voice("soprano", TimeList())
+        harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (1, 2))
+        harm.specify_voice("soprano", TimeList())
+        harm.solveProblem()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (0, 0))
+
+    def testHarmonyRules(self):
+        harm = make_progression_solver(PROGRESSION)
+        count = len(harm.problem._constraints)
+        harm.addHarmonyRules()
+        self.assertEqual(len(harm.problem._constraints), count)
+        # The leading tone rules of a dominant go with its harmony
+        harm.addHarmony("I", 3)
+        harm.addHarmonyRules()
+        self.assertEqual(len(harm.problem._constraints), count - 4)
+        harm.addHarmony("V7", 3)
+        harm.addHarmonyRules()
+        self.assertEqual(len(harm.problem._constraints), count)
+
+    def testParallel(self):
+        harm = make_progression_solver(PROGRESSION[:4])
+        harm.engine = "parallel"
+        harm.num_solutions = 20
+        workers = config.parallel_workers
+        config.parallel_workers = 2
+        try:
+            solutions = harm.solveProblem()
+            self.assertEqual(harm.chain.built_steps, 4)
+            self.assertEqual(harm.solveProblem(), solutions)
+            self.assertEqual(harm.chain.built_steps, 0)
+        finally:
+            config.parallel_workers = workers
+
+class AnytimeTester(unittest.TestCase):
+
+    def setUp(self):
+        chords, figures = load("dim_1a")
+        self.problem = init_problem(constraint.Problem(), chords, figures)
+        self.chords, self.harmonies = make_timelists(chords)
+        self.best = viterbi(VoicingChain(self.problem), self.chords,
+                            self.harmonies)[0]
+
+    def testStrictlyImproving(self):
+        for engine in config.ENGINES:
+            grades = []
+            for sol_grade, solution, stats in anytime.iter_improving(
+                    self.problem, self.chords, self.harmonies, engine):
+                self.assertAlmostEqual(grade(solution, self.chords,
+                                             self.harmonies), sol_grade)
+                self.assertEqual(stats.improvements, len(grades) + 1)
+                grades.append(sol_grade)
+            self.assertEqual(grades, sorted(set(grades)))
+            self.assertAlmostEqual(grades[-1], self.best)
+            self.assertTrue(stats.optimal)
+        self.assertEqual(stats.solutions, len(grades))
+        self.assertTrue(stats.nodes > 0)
+        self.assertEqual(type(self.problem.getSolver()),
+                         constraint.BacktrackingSolver)
+
+    def testStop(self):
+        stats = None
+        seen = []
+        for sol_grade, solution, stats in anytime.iter_improving(
+                self.problem, self.chords, self.harmonies, "csp", limit=5,
+                seen=seen):
+            pass
+        self.assertEqual((stats.solutions, len(seen)), (5, 5))
+        self.assertFalse(stats.optimal)
+        calls = []
+        best = anytime.solve_anytime(self.problem, self.chords,
+                                     self.harmonies,
+                                     lambda *args: calls.append(args),
+                                     "bnb")
+        self.assertAlmostEqual(best[0], self.best)
+        self.assertEqual(len(calls), best[2].improvements)
+        best = anytime.solve_anytime(self.problem, self.chords,
+                                     self.harmonies, lambda *args: True,
+                                     "bnb")
+        self.assertEqual(best[2].improvements, 1)
+        self.assertEqual(type(self.problem.getSolver()),
+                         constraint.BacktrackingSolver)
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        harm.num_solutions = 50
+        solutions = harm.solveProblem()
+        improving = list(harm.solveProblem_anytime())
+        self.assertEqual(harm.solutions, solutions)
+        self.assertEqual(improving[-1][:2], solutions[0])
+        harm.engine = "dp"
+        improving = list(harm.solveProblem_anytime())
+        self.assertEqual([item[:2] for item in improving], harm.solveProblem())
+
+    def testBudget(self):
+        for engine in ("csp", "bnb"):
+            sol_grade, solution, stats = anytime.solve_within(
+                self.problem, self.chords, self.harmonies, nodes=300,
+                engine=engine)
+            self.assertEqual(stats.spent, "nodes")
+            self.assertFalse(stats.optimal)
+            self.assertAlmostEqual(grade(solution, self.chords,
+                                         self.harmonies), sol_grade)
+            self.assertTrue(sol_grade <= self.best)
+        self.assertEqual(anytime.solve_within(self.problem, self.chords,
+                                              self.harmonies, seconds=0), None)
+        sol_grade, solution, stats = anytime.solve_within(
+            self.problem, self.chords, self.harmonies, seconds=60,
+            engine="bnb")
+        self.assertEqual(stats.spent, None)
+        self.assertAlmostEqual(sol_grade, self.best)
+        self.assertEqual(type(self.problem.getSolver()),
+                         constraint.BacktrackingSolver)
+
+    def testHarmonySolverBudget(self):
+        harm = make_harmony_solver()
+        saved = config.node_budget
+        config.node_budget = 300
+        try:
+            solutions = harm.solveProblem()
+            self.assertEqual(harm.spent, "nodes")
+            self.assertTrue(solutions)
+            harm.engine = "bnb"
+            harm.solveProblem()
+            self.assertEqual(harm.spent, "nodes")
+        finally:
+            config.node_budget = saved
+        harm.engine = "csp"
+        harm.solveProblem()
+        self.assertEqual(harm.spent, None)
+
+    def testChainEngineBudgets(self):
+        harm = make_harmony_solver()
+        harm.num_solutions = None
+        harm.engine = "parallel"
+        expected = harm.solveProblem()
+        saved = config.node_budget
+        try:
+            # The chain has 24, 9 and 46 voicings: the budget runs out
+            # before the last time step
+            config.node_budget = 30
+            for engine in ("dp", "beam"):
+                harm = make_harmony_solver()
+                harm.engine = engine
+                self.assertEqual(harm.solveProblem(), None)
+                self.assertEqual(harm.spent, "nodes")
+            # ... or once the chain is built, after some subtrees
+            config.node_budget = 140
+            harm = make_harmony_solver()
+            harm.num_solutions = 50
+            harm.engine = "parallel"
+            solutions = harm.solveProblem()
+            self.assertEqual(harm.spent, "nodes")
+            self.assertTrue(0 < len(solutions) < 50)
+            for solution in solutions:
+                self.assertTrue(solution in expected)
+            config.node_budget = 300
+            config.diverse_solutions = True
+            try:
+                harm = make_harmony_solver()
+                solutions = harm.solveProblem()
+            finally:
+                config.diverse_solutions = False
+            self.assertEqual(harm.spent, "nodes")
+            harm.engine = "dp"
+            self.assertEqual(solutions[:1], harm.solveProblem())
+        finally:
+            config.node_budget = saved
+        for engine in ("dp", "beam"):
+            sol_grade, solution, stats = anytime.solve_within(
+                self.problem, self.chords, self.harmonies, seconds=60,
+                engine=engine)
+            self.assertEqual(stats.spent, None)
+            self.assertAlmostEqual(sol_grade, self.best)
+        for engine in ("dp", "beam"):
+            self.assertEqual(anytime.solve_within(
+                self.problem, self.chords, self.harmonies, seconds=0,
+                engine=engine), None)
+        # The first subtree is searched before the budget is checked
+        sol_grade, solution, stats = anytime.solve_within(
+            self.problem, self.chords, self.harmonies, seconds=0,
+            engine="parallel")
+        self.assertEqual(stats.spent, "time")
+        self.assertFalse(stats.optimal)
+
+class BatchTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ("dim_1a", "TEMPLATE"):
+            shutil.copy(os.path.join(TESTS_DIR, name), self.dir)
+        # Nine C major chords: far too many solutions to list
+        with open(os.path.join(self.dir, "long"), "w") as f:
+            f.write("[Chords]\n")
+            for t in range(9):
+                f.write("{0}, C, tonic, None, major\n".format(t))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFindProblemfiles(self):
+        names = ["TEMPLATE", "dim_1a", "long"]
+        self.assertEqual(batch.find_problemfiles(self.dir),
+                         [os.path.join(self.dir, name) for name in names])
+        self.assertEqual(batch.find_problemfiles(os.path.join(self.dir, "d*")),
+                         [os.path.join(self.dir, "dim_1a")])
+
+    def testSolveProblemfile(self):
+        path = os.path.join(self.dir, "dim_1a")
+        chords, figures = parse_problemfile(path)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        best = viterbi(VoicingChain(init_problem(constraint.Problem(), chords,
+                                                 figures)),
+                       chords_tl, harmonies_tl)
+        for engine in ("csp", "dp", "bnb"):
+            record = batch.solve_problemfile(path, engine, 3)
+            self.assertEqual(record["status"], "ok")
+            self.assertEqual(record["count"], 199)
+            self.assertAlmostEqual(record["grade"], best[0])
+            self.assertEqual(len(record["solutions"]),
+                             1 if engine == "dp" else 3)
+            voices = record["solutions"][0]["voices"]
+            self.assertEqual(voices["s"], [best[1]["s_" + str(t)]
+                                           for t in range(3)])
+            self.assertEqual(sorted(record["timings"]),
+                             ["count", "init", "parse", "solve"])
+
+    def testCspCap(self):
+        # Large files keep the best of the first solutions found, instead
+        # of timing out
+        path = os.path.join(TESTS_DIR, "ex_1c")
+        chords, figures = parse_problemfile(path)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        first = [grade(solution, chords_tl, harmonies_tl) for solution in
+                 itertools.islice(problem.getSolutionIter(), 20)]
+        saved = config.num_solutions
+        config.num_solutions = 20
+        try:
+            record = batch.solve_problemfile(path, "csp", 3)
+        finally:
+            config.num_solutions = saved
+        self.assertEqual(record["status"], "ok")
+        self.assertEqual([solution["grade"] for solution in
+                          record["solutions"]],
+                         sorted(first, reverse=True)[:3])
+
+    def testFailures(self):
+        record = batch.solve_problemfile(os.path.join(self.dir, "missing"))
+        self.assertEqual(record["status"], "error")
+        record = batch.solve_problemfile(os.path.join(self.dir, "TEMPLATE"),
+                                         "dp")
+        self.assertEqual(record["status"], "no_solution")
+        self.assertEqual(record["solutions"], [])
+
+    @unittest.skipUnless(batch.canTimeout, "No SIGALRM")
+    def testTimeout(self):
+        record = batch._solve_task((os.path.join(self.dir, "long"), "csp", 1,
+                                    1))
+        self.assertEqual(record["status"], "timeout")
+        self.assertTrue("solve" in record["error"])
+        # An alarm going off once the file is solved is a timeout too
+        saved = batch.solve_problemfile
+        def solve_problemfile(path, engine, k):
+            record = saved(path, engine, k)
+            batch._raise_timeout(signal.SIGALRM, None)
+        batch.solve_problemfile = solve_problemfile
+        try:
+            record = batch._solve_task((os.path.join(self.dir, "TEMPLATE"),
+                                        "dp", 1, 1))
+        finally:
+            batch.solve_problemfile = saved
+        self.assertEqual(record["status"], "timeout")
+        self.assertEqual(signal.alarm(0), 0)
+
+    def testRunBatch(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        for workers in (1, 2):
+            with open(path, "w") as out:
+                statuses = batch.run_batch(self.dir, out, "dp", 2, workers, 0)
+            self.assertEqual(statuses, {"ok": 2, "no_solution": 1})
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([os.path.basename(record["file"])
+                              for record in records],
+                             ["TEMPLATE", "dim_1a", "long"])
+
+@unittest.skipUnless(solution_cache.canCache, "No sqlite3")
+class SolutionCacheTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        saved = config.solution_cache, config.cache_dir
+        def restore():
+            config.solution_cache, config.cache_dir = saved
+        self.addCleanup(restore)
+        config.solution_cache, config.cache_dir = True, self.dir
+
+    def key(self, name, *asked):
+        chords, figures = load(name)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        return solution_cache.problem_key(problem, chords_tl, harmonies_tl,
+                                          *asked)
+
+    def testProblemKey(self):
+        key = self.key("ex_fig_1a", "dp")
+        self.assertEqual(self.key("ex_fig_1a", "dp"), key)
+        self.assertNotEqual(self.key("ex_fig_1a", "csp"), key)
+        self.assertNotEqual(self.key("ex_1a", "dp"), key)
+        # Same chords, without the figures
+        chords, figures = load("ex_fig_1a")
+        problem = init_problem(constraint.Problem(), chords, [])
+        chords_tl, harmonies_tl = make_timelists(chords)
+        self.assertNotEqual(solution_cache.problem_key(problem, chords_tl,
+                                                       harmonies_tl, "dp"),
+                            key)
+        saved = grader.feature_weights["doubled_root"]
+        grader.feature_weights["doubled_root"] = saved + 1
+        try:
+            self.assertNotEqual(self.key("ex_fig_1a", "dp"), key)
+        finally:
+            grader.feature_weights["doubled_root"] = saved
+
+    def testGetPut(self):
+        cache = solution_cache.open_cache()
+        self.addCleanup(cache.close)
+        solutions = [(2.5, {"s_0": 72, "a_0": 67, "t_0": 64, "b_0": 48}),
+                     (1.0, {"s_0": 76, "a_0": 67, "t_0": 60, "b_0": 48})]
+        self.assertEqual(cache.get("key"), None)
+        cache.put("key", solutions)
+        cache.put("key", count=12)
+        self.assertEqual(cache.get("key"), solutions)
+        self.assertEqual(cache.get_count("key"), 12)
+        self.assertEqual(cache.get("key", lambda voice, t: voice+str(t))[0][1],
+                         {"s0": 72, "a0": 67, "t0": 64, "b0": 48})
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        # Another version of the rules drops the entries
+        cache.close()
+        cache = solution_cache.SolutionCache(cache.path, stamp="other")
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def testStamp(self):
+        # The stamp hashes the sources, whether the modules were imported
+        # by the CLI (from core/) or by the GUI (as the core package)
+        core_dir = os.path.join(TESTS_DIR, "..")
+        sources = ""
+        for path in ([os.path.join(core_dir, "harmony_rules.py"),
+                      os.path.join(core_dir, "..", "Grader", "grader.py"),
+                      os.path.join(core_dir, "..", "constraint",
+                                   "constraint.py")] +
+                     [os.path.join(core_dir, name + ".py") for name in
+                      ("voicings", "transitions", "chain", "beam",
+                       "parallel", "diverse", "kbest")]):
+            with open(path, "rb") as f:
+                sources += f.read()
+        self.assertEqual(solution_cache.rules_stamp(),
+                         hashlib.sha1(str(solution_cache.CACHE_VERSION) +
+                                      sources).hexdigest())
+        cli = subprocess.Popen(
+            [sys.executable, "-c",
+             "import solution_cache; print solution_cache.rules_stamp()"],
+            cwd=core_dir, stdout=subprocess.PIPE)
+        self.assertEqual(cli.communicate()[0].strip(),
+                         solution_cache.rules_stamp())
+
+    def testEviction(self):
+        cache = solution_cache.open_cache(maxsize=0)
+        self.addCleanup(cache.close)
+        solution = dict(("s_{0}".format(t), 60) for t in range(20))
+        for i in range(10):
+            cache.put(str(i), [(0.0, solution)])
+        size = cache.size()
+        cache.get("0")
+        cache.maxsize = size / 2
+        cache.put("new", count=1)
+        self.assertTrue(cache.size() <= size / 2)
+        self.assertTrue(cache.get("0") != None)
+        self.assertEqual(cache.get("1"), None)
+        self.assertEqual(cache.get_count("new"), 1)
+
+    def testHarmonySolver(self):
+        for engine in config.ENGINES:
+            harm = make_harmony_solver()
+            harm.engine = engine
+            harm.num_solutions = 20
+            solutions = harm.solveProblem()
+            cache = solution_cache.open_cache()
+            size = len(cache)
+            cache.close()
+            harm = make_harmony_solver()
+            harm.engine = engine
+            harm.num_solutions = 20
+            self.assertEqual(harm.solveProblem(), solutions)
+            cache = solution_cache.open_cache()
+            self.assertEqual((len(cache), cache.misses), (size, 0))
+            cache.close()
+
+    def testSearchSettings(self):
+        # The first solutions found depend on the order of the search
+        harm = make_harmony_solver()
+        harm.num_solutions = 20
+        solutions = harm.solveProblem()
+        config.bitset_domains = True
+        try:
+            harm = make_harmony_solver()
+            harm.num_solutions = 20
+            self.assertNotEqual(harm.solveProblem(), solutions)
+        finally:
+            config.bitset_domains = False
+        cache = solution_cache.open_cache()
+        self.assertEqual(len(cache), 2)
+        cache.close()
+
+    def testAnytime(self):
+        # The GUI solves through solveProblem_anytime()
+        def solver(engine):
+            harm = make_harmony_solver()
+            harm.engine = engine
+            harm.num_solutions = 20
+            return harm
+        for engine in config.ENGINES:
+            harm = solver(engine)
+            improving = list(harm.solveProblem_anytime())
+            solutions = harm.solutions
+            harm = solver(engine)
+            cached = list(harm.solveProblem_anytime())
+            if engine == "bnb":
+                # Its improving solutions aren't the best graded ones cached
+                self.assertEqual([item[:2] for item in cached],
+                                 [item[:2] for item in improving])
+                continue
+            self.assertEqual(len(cached), 1)
+            self.assertEqual(cached[0][:2], improving[-1][:2])
+            self.assertEqual(harm.solutions, solutions)
+            # solveProblem() shares the entry
+            self.assertEqual(solver(engine).solveProblem(), solutions)
+        cache = solution_cache.open_cache()
+        self.assertEqual(len(cache), len(config.ENGINES) - 1)
+        cache.close()
+
+    def testBatch(self):
+        path = os.path.join(TESTS_DIR, "dim_1a")
+        record = batch.solve_problemfile(path, "bnb", 3)
+        self.assertFalse(record["cached"])
+        cached = batch.solve_problemfile(path, "bnb", 3)
+        self.assertTrue(cached["cached"])
+        for field in ("status", "grade", "count", "solutions"):
+            self.assertEqual(cached[field], record[field])
+
+class MarginalsTester(unittest.TestCase):
+
+    def enumerated(self, problem):
+        """ Returns the marginals of PROBLEM, counted on its solutions. """
+        marginals = {}
+        for solution in problem.getSolutionIter():
+            for var, pitch in solution.items():
+                counts = marginals.setdefault(var, {})
+                counts[pitch] = counts.get(pitch, 0) + 1
+        return marginals
+
+    def nonzero(self, marginals):
+        return dict((var, dict((pitch, count) for pitch, count in
+                               counts.items() if count))
+                    for var, counts in marginals.items())
+
+    def testCounts(self):
+        for name in ("ex_fig_1a", "dim_1a"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            marginals = solution_marginals(problem)
+            self.assertEqual(self.nonzero(marginals), self.enumerated(problem))
+            for counts in marginals.values():
+                self.assertEqual(sum(counts.values()), count_solutions(problem))
+            self.assertEqual(feasible_pitches(problem),
+                             dict((var, sorted(counts)) for var, counts in
+                                  self.enumerated(problem).items()))
+
+    def testAddFigure(self):
+        chords, figures = load("ex_1c")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chain = IncrementalChain()
+        chain.update(problem)
+        solution_marginals(chain)
+        add_figure_constraints(problem, [(2, "s", "E", None)], chain)
+        chain.update(problem)
+        self.assertEqual((chain.built_steps, chain.built_links), (1, 1))
+        marginals = solution_marginals(chain)
+        self.assertEqual(marginals, solution_marginals(problem))
+        # The soprano sings an E at time 2
+        self.assertEqual(set(pitch % 12 for pitch in feasible_pitches(chain)["s_2"]),
+                         set([4]))
+        self.assertEqual(self.nonzero(marginals), self.enumerated(problem))
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        pitches = harm.feasible_pitches()
+        marginals = harm.solution_marginals()
+        self.assertEqual(sorted(pitches), sorted(harm.problem._variables))
+        # Which notes can the alto still sing, once the soprano is fixed?
+        soprano = pitches["s1"][0]
+        notes = TimeList()
+        notes.add(1, soprano)
+        harm.specify_voice("soprano", notes)
+        fixed = harm.feasible_pitches()
+        self.assertEqual((harm.chain.built_steps, harm.chain.built_links),
+                         (1, 2))
+        self.assertEqual(fixed["s1"], [soprano])
+        self.assertEqual(harm.solution_marginals()["s1"][soprano],
+                         marginals["s1"][soprano])
+        self.assertTrue(set(fixed["a1"]) <= set(pitches["a1"]))
+        self.assertEqual(fixed, feasible_pitches(harm.problem))
+
+class SamplingTester(unittest.TestCase):
+
+    def problem(self, name):
+        chords, figures = load(name)
+        return init_problem(constraint.Problem(), chords, figures)
+
+    def testUniform(self):
+        problem = self.problem("ex_1b")
+        solutions = set(tuple(sorted(solution.items()))
+                        for solution in problem.getSolutions())
+        draws = {}
+        for solution in sample_solutions(problem, 100 * len(solutions), 1):
+            key = tuple(sorted(solution.items()))
+            draws[key] = draws.get(key, 0) + 1
+        self.assertEqual(set(draws), solutions)
+        # 100 expected draws each: far beyond 5 standard deviations
+        self.assertTrue(min(draws.values()) > 50)
+        self.assertTrue(max(draws.values()) < 150)
+
+    def testSeed(self):
+        problem = self.problem("ex_fig_1a")
+        self.assertEqual(sample_solutions(problem, 20, 7),
+                         sample_solutions(problem, 20, 7))
+        self.assertNotEqual(sample_solutions(problem, 20, 7),
+                            sample_solutions(problem, 20, 8))
+
+    def testSampler(self):
+        problem = self.problem("ex_1c")
+        chain = VoicingChain(problem)
+        sampler = ChainSampler(chain, seed=0)
+        self.assertEqual(sampler.total, count_solutions(chain))
+        path = sampler.sample_path()
+        self.assertEqual(len(path), len(chain))
+        for k in range(1, len(path)):
+            self.assertTrue(path[k] in chain.successors[k - 1][path[k - 1]])
+        # The counts an IncrementalChain keeps give the same draws
+        harm = make_harmony_solver()
+        harm.chain.update(harm.problem)
+        self.assertEqual(sample_solutions(harm.problem, 10, 3, harm.chain),
+                         sample_solutions(harm.problem, 10, 3))
+
+    def testNoSolution(self):
+        problem = self.problem("ex_1c")
+        problem.replaceVariable("s_0", [1])
+        self.assertEqual(sample_solutions(problem, 5), [])
+        self.assertEqual(ChainSampler(VoicingChain(problem)).sample(), None)
+
+class KBestTester(unittest.TestCase):
+
+    def testGradeOrder(self):
+        for name in ("ex_1b", "ex_fig_1a", "dim_1a"):
+            chords, figures = load(name)
+            problem = init_problem(constraint.Problem(), chords, figures)
+            chords_tl, harmonies_tl = make_timelists(chords)
+            ranked = list(kbest.iter_ranked(problem, chords_tl, harmonies_tl))
+            self.assertEqual(ranked[0], viterbi(VoicingChain(problem),
+                                                chords_tl, harmonies_tl))
+            self.assertEqual(len(set(tuple(sorted(solution.items()))
+                                     for sol_grade, solution in ranked)),
+                             count_solutions(problem))
+            expected = sorted([grade(solution, chords_tl, harmonies_tl)
+                               for solution in problem.getSolutionIter()],
+                              reverse=True)
+            for (sol_grade, solution), expected_grade in zip(ranked, expected):
+                self.assertAlmostEqual(sol_grade, expected_grade)
+                self.assertAlmostEqual(sol_grade, grade(solution, chords_tl,
+                                                        harmonies_tl))
+
+    def testLazy(self):
+        chords, figures = load("ex_1c")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        ranking = kbest.KBestPaths(GradedChain(VoicingChain(problem),
+                                               chords_tl, harmonies_tl))
+        self.assertEqual(len(ranking), 1)
+        fifth = ranking.get(4)
+        self.assertEqual(len(ranking), 5)
+        self.assertEqual(ranking.get(4), fifth)
+        self.assertEqual(ranking.get(10 ** 6), None)
+        self.assertEqual(len(ranking), count_solutions(problem))
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        harm.engine = "dp"
+        best = harm.solveProblem()[0]
+        self.assertEqual(harm.ranked_solution(0), best)
+        grades = [harm.ranked_solution(n)[0] for n in range(20)]
+        self.assertEqual(grades, sorted(grades, reverse=True))
+        # The ranking is kept until an edit changes the chain
+        ranking = harm._ranking
+        harm.solveProblem()
+        self.assertEqual(harm.ranked_solution(0), best)
+        self.assertTrue(harm._ranking is ranking)
+        soprano = [dict(harm.ranked_solution(n)[1])["s0"] for n in range(20)]
+        other = [pitch for pitch in soprano if pitch != soprano[0]][0]
+        notes = TimeList()
+        notes.add(0, other)
+        harm.specify_voice("soprano", notes)
+        first = harm.ranked_solution(0)
+        self.assertFalse(harm._ranking is ranking)
+        self.assertEqual(dict(first[1])["s0"], other)
+        self.assertEqual(first, harm.solveProblem()[0])
+
+class DiverseTester(unittest.TestCase):
+
+    def solve(self, name, *args, **kwargs):
+        chords, figures = load(name)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        solutions = diverse.diverse_solutions(problem, chords_tl,
+                                              harmonies_tl, *args, **kwargs)
+        best = viterbi(VoicingChain(problem), chords_tl, harmonies_tl)
+        return solutions, best, chords_tl, harmonies_tl
+
+    def testDistance(self):
+        for distance, metric in ((2, "voicing"), (3, "voicing"),
+                                 (1, "soprano")):
+            solutions, best, chords_tl, harmonies_tl = self.solve(
+                "ex_1c", 8, distance, metric)
+            self.assertEqual(len(solutions), 8)
+            self.assertEqual(solutions[0][0], best[0])
+            grades = [sol_grade for sol_grade, solution in solutions]
+            self.assertEqual(grades, sorted(grades, reverse=True))
+            for i, (sol_grade, solution) in enumerate(solutions):
+                self.assertAlmostEqual(sol_grade, grade(solution, chords_tl,
+                                                        harmonies_tl))
+                for other_grade, other in solutions[:i]:
+                    self.assertTrue(diverse.solution_distance(
+                        solution, other, metric) >= distance)
+
+    def testFewer(self):
+        # A single time step: no two solutions are 2 time steps apart
+        solutions, best, chords_tl, harmonies_tl = self.solve("ex_1a", 5, 2)
+        self.assertEqual(solutions, [best])
+        self.assertTrue(len(self.solve("ex_1a", 20, 1, "soprano")[0]) > 1)
+
+    def testGradedChain(self):
+        chords, figures = load("ex_fig_1a")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        chain = VoicingChain(problem)
+        graded = diverse.GradedChain(chain, chords_tl, harmonies_tl)
+        sol_grade, path = graded.best()
+        self.assertEqual((sol_grade, chain.solution(path)),
+                         viterbi(chain, chords_tl, harmonies_tl))
+        # Penalizing the best voicing of the first time step moves away
+        # from it
+        penalized = graded.best([{path[0]: 1000.0}] + [{}] * (len(chain) - 1))
+        self.assertNotEqual(penalized[1][0], path[0])
+        self.assertTrue(penalized[0] <= sol_grade)
+
+    def testHarmonySolver(self):
+        saved = config.diverse_solutions, config.diverse_k
+        def restore():
+            config.diverse_solutions, config.diverse_k = saved
+        self.addCleanup(restore)
+        config.diverse_solutions, config.diverse_k = True, 4
+        harm = make_harmony_solver()
+        solutions = harm.solveProblem()
+        self.assertEqual(len(solutions), 4)
+        dicts = [dict(solution) for sol_grade, solution in solutions]
+        for i, solution in enumerate(dicts):
+            for other in dicts[:i]:
+                self.assertTrue(diverse.solution_distance(solution, other) >=
+                                config.diverse_distance)
+        harm = make_harmony_solver()
+        self.assertEqual(len(list(harm.solveProblem_anytime())), 1)
+        self.assertEqual(harm.solutions, solutions)
+
+class OnlineTester(unittest.TestCase):
+
+    SYMBOLS = ["D, ii6, F, min", "G, V7, G, 7", "C, I, C", "A, vi, None, min",
+               "D, ii, None, min, 7", "G, V, None, 7", "C, I, C"]
+    SOPRANO = [77, 74, 72, 72, 72, 71, 72]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write_midi(self, events):
+        """ Writes a MIDI file of EVENTS: chord symbols (str) and soprano
+        notes (int, or (int channel, int note)), a quarter note apart.
+        """
+        path = os.path.join(self.dir, "line.mid")
+        midi = MidiOutFile(path)
+        midi.header()
+        midi.start_of_track()
+        for event in events:
+            midi.update_time(0)
+            if isinstance(event, str):
+                midi.text(event)
+                continue
+            channel, note = event if isinstance(event, tuple) else (0, event)
+            midi.note_on(channel, note, 64)
+            midi.update_time(96)
+            midi.note_off(channel, note, 64)
+        midi.update_time(0)
+        midi.end_of_track()
+        midi.eof()
+        return path
+
+    def harmonize(self, lookahead, events=None):
+        if events is None:
+            events = []
+            for symbol, soprano in zip(self.SYMBOLS, self.SOPRANO):
+                events.extend([symbol, soprano])
+        decided = []
+        harmonizer, stream = online.harmonize_midifile(
+            self.write_midi(events),
+            lambda t, chord, voicing: decided.append((t, voicing)),
+            lookahead)
+        return harmonizer, stream, decided
+
+    def offline(self):
+        """ Returns the problem of the line, its soprano fixed, and its best
+        solution.
+        """
+        chords = [online.parse_chord("{0}, {1}".format(t, symbol))
+                  for t, symbol in enumerate(self.SYMBOLS)]
+        problem = init_problem(constraint.Problem(), chords, [])
+        for t, soprano in enumerate(self.SOPRANO):
+            problem.replaceVariable("s_{0}".format(t), [soprano])
+        chords_tl, harmonies_tl = make_timelists(chords)
+        return problem, viterbi(VoicingChain(problem), chords_tl, harmonies_tl)
+
+    def testFullLookahead(self):
+        problem, (best_grade, best) = self.offline()
+        harmonizer, stream, decided = self.harmonize(len(self.SOPRANO))
+        self.assertEqual(decided, [(t, tuple(best["{0}_{1}".format(v, t)]
+                                             for v in "satb"))
+                                   for t in range(len(self.SOPRANO))])
+        self.assertAlmostEqual(harmonizer.grade, best_grade)
+
+    def testLookahead(self):
+        problem = self.offline()[0]
+        for lookahead in (0, 1, 2):
+            harmonizer = online.OnlineHarmonizer(None, lookahead)
+            decided = []
+            def callback(t, chord, voicing):
+                # Decided once LOOKAHEAD more time steps were received
+                self.assertEqual(harmonizer.time, t + lookahead + 1)
+                decided.append(voicing)
+            harmonizer.callback = callback
+            for symbol, soprano in zip(self.SYMBOLS, self.SOPRANO):
+                harmonizer.push(online.parse_chord("0, " + symbol), soprano)
+                self.assertTrue(len(harmonizer._window) <= lookahead)
+            harmonizer.callback = lambda t, chord, voicing: \
+                                  decided.append(voicing)
+            harmonizer.flush()
+            self.assertEqual(len(decided), len(self.SOPRANO))
+            self.assertEqual(harmonizer.breaks, 0)
+            # The voicings follow the rules, and sing the soprano
+            check = self.offline()[0]
+            for t, voicing in enumerate(decided):
+                for voice, pitch in zip("satb", voicing):
+                    check.replaceVariable("{0}_{1}".format(voice, t), [pitch])
+            self.assertTrue(check.getSolution() != None)
+
+    def testNoVoicing(self):
+        # E isn't a tone of the D minor chord
+        harmonizer, stream, decided = self.harmonize(
+            1, ["C, I, C", 72, "D, ii, None, min", 76, 74, "G, V, None, 7", 71])
+        self.assertEqual([t for t, voicing in decided], range(4))
+        self.assertEqual(decided[1][1], None)
+        self.assertEqual([voicing[0] for t, voicing in decided
+                          if voicing is not None], [72, 74, 71])
+
+    def testStream(self):
+        # Notes before any chord symbol, or on another channel, are skipped
+        harmonizer, stream, decided = self.harmonize(
+            2, [72, "C, I, C", 72, (1, 60), "G, V, None, 7", 71, 74])
+        self.assertEqual(stream.skipped, 1)
+        self.assertEqual([voicing[0] for t, voicing in decided], [72, 71, 74])
+
+    def testTracks(self):
+        # A type 1 file, chord symbols in the first track and the soprano
+        # in the second, is harmonized as the same line in one track
+        path = os.path.join(self.dir, "tracks.mid")
+        midi = MidiOutFile(path)
+        midi.header(1, 2)
+        midi.start_of_track(0)
+        for t, symbol in enumerate(self.SYMBOLS):
+            midi.update_time(96 if t else 0)
+            midi.text(symbol)
+        midi.update_time(96)
+        midi.end_of_track()
+        midi.start_of_track(1)
+        for note in self.SOPRANO:
+            midi.update_time(0)
+            midi.note_on(0, note, 64)
+            midi.update_time(96)
+            midi.note_off(0, note, 64)
+        midi.update_time(0)
+        midi.end_of_track()
+        midi.eof()
+        decided = []
+        harmonizer, stream = online.harmonize_midifile(
+            path, lambda t, chord, voicing: decided.append((t, voicing)), 2)
+        self.assertEqual(stream.skipped, 0)
+        self.assertEqual(decided, self.harmonize(2)[2])
+
+class BeamTester(unittest.TestCase):
+
+    def solve(self, name, width, exact=None):
+        chords, figures = load(name)
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        solutions, stats = beam.beam_search(problem, chords_tl, harmonies_tl,
+                                            width, exact)
+        best = viterbi(VoicingChain(problem), chords_tl, harmonies_tl)
+        return problem, chords_tl, harmonies_tl, solutions, stats, best
+
+    def testNeverCut(self):
+        for name in ("ex_1c", "dim_1a"):
+            problem, chords, harmonies, solutions, stats, best = \
+                self.solve(name, 10000)
+            self.assertFalse(stats.pruned)
+            self.assertTrue(stats.optimal())
+            self.assertEqual(solutions[0], best)
+
+    def testNarrow(self):
+        problem, chords, harmonies, solutions, stats, best = \
+            self.solve("ex_1c", 1)
+        self.assertTrue(stats.pruned)
+        self.assertEqual(len(solutions), 1)
+        sol_grade, solution = solutions[0]
+        self.assertTrue(tuple(sorted(solution.items())) in
+                        solution_set(problem))
+        self.assertAlmostEqual(sol_grade, grade(solution, chords, harmonies))
+        self.assertEqual(stats.exact, best[0])
+        self.assertAlmostEqual(stats.gap, best[0] - sol_grade)
+        self.assertTrue(stats.gap > 0)
+        # Wider beams are kept as wide, best first
+        solutions = self.solve("ex_1c", 4, exact=False)[3]
+        self.assertEqual(len(solutions), 4)
+        self.assertEqual([g for g, solution in solutions],
+                         sorted([g for g, solution in solutions],
+                                reverse=True))
+        self.assertTrue(self.solve("ex_1c", 4, exact=False)[4].exact is None)
+
+    def testLazy(self):
+        # Each time step is enumerated once the beam reaches it, and the
+        # best grade is found on the same chain
+        chains = []
+        class Chain(VoicingChain):
+            def __init__(self, problem, linked=True):
+                self.enumerated = []
+                chains.append(self)
+                VoicingChain.__init__(self, problem, linked)
+            def step_voicings(self, k):
+                self.enumerated.append(k)
+                return VoicingChain.step_voicings(self, k)
+        saved = beam.VoicingChain
+        beam.VoicingChain = Chain
+        try:
+            stats = self.solve("ex_1c", 4, exact=False)[4]
+            chain = chains.pop()
+            self.assertEqual(chain.voicings, [])
+            self.assertEqual(chain.enumerated, range(len(chain)))
+            stats, best = self.solve("ex_1c", 4, exact=True)[4:]
+        finally:
+            beam.VoicingChain = saved
+        self.assertEqual(len(chains), 1)
+        self.assertEqual(len(chains[0].voicings), len(chains[0]))
+        self.assertEqual(stats.exact, best[0])
+
+    def testDiedOut(self):
+        # The voicings kept at the first time steps of dim_1a lead nowhere
+        problem, chords, harmonies, solutions, stats, best = \
+            self.solve("dim_1a", 1)
+        self.assertEqual(solutions, [])
+        self.assertEqual((stats.grade, stats.gap), (None, None))
+        self.assertEqual(stats.exact, best[0])
+
+    def testHarmonySolver(self):
+        harm = make_harmony_solver()
+        harm.engine = "dp"
+        best = harm.solveProblem()[0]
+        harm.engine = "beam"
+        self.assertEqual(harm.solveProblem()[0], best)
+        self.assertEqual(harm.spent, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,13 +20,16 @@
 """
 @var Unassigned: Helper object instance representing unassigned values
 
-@sort: Problem, Variable, Domain
+@sort: Problem, CompiledProblem, Variable, Domain, BitsetDomain, Trail,
+       ArrayAssignments
 @group Solvers: Solver,
                 BacktrackingSolver,
+                BranchAndBoundSolver,
                 RecursiveBacktrackingSolver,
                 MinConflictsSolver
 @group Constraints: Constraint,
                     FunctionConstraint,
+                    TableConstraint,
                     AllDifferentConstraint,
                     AllEqualConstraint,
                     MaxSumConstraint,
@@ -37,12 +40,24 @@
                     SomeInSetConstraint,
                     SomeNotInSetConstraint
 """
+import sys
+import time
 import random
 import copy
-
-__all__ = ["Problem", "Variable", "Domain", "Unassigned",
-           "Solver", "BacktrackingSolver", "RecursiveBacktrackingSolver",
+import heapq
+from itertools import izip, product
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ["Problem", "CompiledProblem", "Variable", "Domain",
+           "BitsetDomain", "Trail", "Budget", "ArrayAssignments",
+           "Unassigned",
+           "Solver", "BacktrackingSolver", "BranchAndBoundSolver",
+           "RecursiveBacktrackingSolver",
            "MinConflictsSolver", "Constraint", "FunctionConstraint",
+           "TableConstraint", "doArc2001",
            "AllDifferentConstraint", "AllEqualConstraint", "MaxSumConstraint",
            "ExactSumConstraint", "MinSumConstraint", "InSetConstraint",
            "NotInSetConstraint", "SomeInSetConstraint",
@@ -53,14 +68,25 @@ class Problem(object):
     Class used to define a problem and retrieve solutions
     """
 
-    def __init__(self, solver=None):
+    def __init__(self, solver=None, arcconsistency=False, bitsets=False):
         """
         @param solver: Problem solver used to find solutions
                        (default is L{BacktrackingSolver})
         @type solver:  instance of a L{Solver} subclass
+        @param arcconsistency: Whether domains should be pruned with
+                               L{doArc2001()} before searching
+                               (default is false)
+        @type arcconsistency:  bool
+        @param bitsets: Whether domains of small non-negative integers
+                        should be searched as L{BitsetDomain}s
+                        (default is false)
+        @type bitsets:  bool
         """
         self._solver = solver or BacktrackingSolver()
+        self._arcconsistency = arcconsistency
+        self._bitsets = bitsets
         self._constraints = []
+        self._objectives = []
         self._variables = {}
 
     def reset(self):
@@ -76,6 +102,7 @@ class Problem(object):
         >>>
         """
         del self._constraints[:]
+        del self._objectives[:]
         self._variables.clear()
 
     def setSolver(self, solver):
@@ -94,6 +121,52 @@ class Problem(object):
         """
         self._solver = solver
 
+    def setArcConsistency(self, arcconsistency):
+        """
+        Enable or disable arc consistency preprocessing
+
+        Values that can't be part of any solution are then removed from
+        the domains before the solver is called.
+
+        Example:
+
+        >>> problem = Problem()
+        >>> problem.addVariables(["a", "b"], [1, 2, 3])
+        >>> problem.addConstraint(lambda a, b: a > b + 1, ["a", "b"])
+        >>> problem.setArcConsistency(True)
+        >>> problem.compile().domains
+        [[3], [1]]
+
+        @param arcconsistency: Whether domains should be pruned with
+                               L{doArc2001()} before searching
+        @type  arcconsistency: bool
+        """
+        self._arcconsistency = arcconsistency
+
+    def setBitsets(self, bitsets):
+        """
+        Enable or disable searching domains as bitsets
+
+        Domains holding only small non-negative integers, such as
+        pitches, are then converted to L{BitsetDomain}s when the problem
+        is compiled. The solutions are the same, but they may come in
+        another order: a L{Domain} lists the values it restores after
+        the others, a L{BitsetDomain} always in their original order.
+
+        Example:
+
+        >>> problem = Problem()
+        >>> problem.addVariables(["a", "b"], [2, 1])
+        >>> problem.setBitsets(True)
+        >>> problem.compile().domains
+        [BitsetDomain([2, 1]), BitsetDomain([2, 1])]
+
+        @param bitsets: Whether domains of small non-negative integers
+                        should be searched as L{BitsetDomain}s
+        @type  bitsets: bool
+        """
+        self._bitsets = bitsets
+
     def getSolver(self):
         """
         Obtain the problem solver currently in use
@@ -121,6 +194,8 @@ class Problem(object):
                 constName, constVars = constraint
                 if variable in constVars:
                     constraints.remove(constraint)
+            self._objectives = [objective for objective in self._objectives
+                                if variable not in objective[1]]
 
     def replaceVariable(self, variable, domain):
         """
@@ -144,7 +219,7 @@ class Problem(object):
                               repr(variable)
         if type(domain) in (list, tuple):
             domain = Domain(domain)
-        elif isinstance(domain, Domain):
+        elif isinstance(domain, (Domain, BitsetDomain)):
             domain = copy.copy(domain)
         else:
             print variable, domain
@@ -178,7 +253,7 @@ class Problem(object):
                               repr(variable)
         if type(domain) in (list, tuple):
             domain = Domain(domain)
-        elif isinstance(domain, Domain):
+        elif isinstance(domain, (Domain, BitsetDomain)):
             domain = copy.copy(domain)
         else:
             raise TypeError, "Domains must be instances of subclasses of "\
@@ -239,6 +314,36 @@ class Problem(object):
                                   "subclasses of the Constraint class"
         self._constraints.append((constraint, variables))
 
+    def addObjective(self, func, variables, bound=0):
+        """
+        Add a term to the cost of the solutions of the problem
+
+        The cost of a solution is the sum of all its terms. Solvers
+        which don't optimize, such as L{BacktrackingSolver}, ignore it.
+
+        Example:
+
+        >>> problem = Problem(BranchAndBoundSolver())
+        >>> problem.addVariables(["a", "b"], [1, 2, 3])
+        >>> problem.addConstraint(lambda a, b: a != b, ["a", "b"])
+        >>> problem.addObjective(lambda a, b: abs(a - b - 1), ["a", "b"])
+        >>> problem.addObjective(lambda b: -b, ["b"], -3)
+        >>> problem.getSolution()
+        {'a': 3, 'b': 2}
+
+        @param func: Function returning the cost of the values of the
+                     given variables
+        @type  func: callable object
+        @param variables: Variables the term depends on, in the order
+                          C{func} expects them
+        @type  variables: sequence of variables
+        @param bound: Value never above the cost returned by C{func},
+                      used to bound the cost of partial solutions
+                      (default is 0)
+        @type  bound: number
+        """
+        self._objectives.append((func, variables, bound))
+
     def getSolution(self):
         """
         Find and return a solution to the problem
@@ -255,6 +360,13 @@ class Problem(object):
         @return: Solution for the problem
         @rtype: dictionary mapping variables to values
         """
+        if hasattr(self._solver, "getCompiledSolutionIter"):
+            compiled = self.compile()
+            if compiled is None:
+                return None
+            for values in self._solver.getCompiledSolutionIter(compiled):
+                return compiled.translate(values)
+            return None
         domains, constraints, vconstraints = self._getArgs()
         if not domains:
             return None
@@ -276,6 +388,8 @@ class Problem(object):
         @return: All solutions for the problem
         @rtype: list of dictionaries mapping variables to values
         """
+        if hasattr(self._solver, "getCompiledSolutionIter"):
+            return list(self.getSolutionIter())
         domains, constraints, vconstraints = self._getArgs()
         if not domains:
             return []
@@ -299,14 +413,60 @@ class Problem(object):
           File "<stdin>", line 1, in ?
         StopIteration
         """
+        if hasattr(self._solver, "getCompiledSolutionIter"):
+            compiled = self.compile()
+            if compiled is None:
+                return iter(())
+            return compiled.translateIter(
+                self._solver.getCompiledSolutionIter(compiled))
         domains, constraints, vconstraints = self._getArgs()
         if not domains:
             return iter(())
         return self._solver.getSolutionIter(domains, constraints,
                                             vconstraints)
 
+    def compile(self, bitsets=None):
+        """
+        Return the problem in compiled form, ready to be searched
+
+        Solvers providing a C{getCompiledSolutionIter()} method are handed
+        this form instead of the dictionaries built by the other methods.
+
+        Example:
+
+        >>> problem = Problem()
+        >>> problem.addVariables(["b", "a"], [1, 2])
+        >>> problem.addConstraint(lambda a, b: b > a, ["a", "b"])
+        >>> compiled = problem.compile()
+        >>> compiled.variables
+        ['a', 'b']
+        >>> compiled.constraints[0][1]
+        (0, 1)
+
+        @param bitsets: Whether domains of small non-negative integers
+                        should be converted to L{BitsetDomain}
+                        (default is the setting of L{setBitsets()})
+        @type  bitsets: bool
+        @return: Compiled problem, or None if some variable has no
+                 possible value left after preprocessing
+        @rtype: instance of L{CompiledProblem}
+        """
+        if bitsets is None:
+            bitsets = self._bitsets
+        domains, constraints, vconstraints = self._getArgs()
+        if not domains:
+            return None
+        return CompiledProblem(domains, constraints, vconstraints, bitsets,
+                               self._objectives)
+
     def _getArgs(self):
-        domains = self._variables.copy()
+        # Preprocessing prunes domains according to the other domains,
+        # so it works on copies: the problem's own domains must survive
+        # a later replaceVariable() of a neighbour.
+        domains = {}
+        for variable, domain in self._variables.iteritems():
+            domain.resetState()
+            domains[variable] = copy.copy(domain)
         allvariables = domains.keys()
         constraints = []
         for constraint, variables in self._constraints:
@@ -326,77 +486,237 @@ class Problem(object):
             domain.resetState()
             if not domain:
                 return None, None, None
-        #doArc8(getArcs(domains, constraints), domains, {})
+        if self._arcconsistency and not doArc2001(domains, constraints):
+            return None, None, None
         return domains, constraints, vconstraints
 
+class CompiledProblem(object):
+    """
+    Problem representation using dense integer variable identifiers
+
+    Variables are numbered from 0 to n-1 following the sorted order of
+    their original names, so heuristics breaking ties on the variable
+    behave as they do on the named problem. Domains and per-variable
+    constraint lists are stored in lists indexed by those identifiers,
+    and every constraint is bound to a tuple of identifiers instead of
+    a sequence of names. Names only come back in L{translate()}.
+    With C{bitsets}, domains holding only small non-negative integers,
+    such as pitches, become L{BitsetDomain}s.
+
+    Example:
+
+    >>> problem = Problem()
+    >>> problem.addVariables(["a", "b"], [1, 2])
+    >>> problem.addConstraint(lambda a, b: b > a, ["a", "b"])
+    >>> compiled = problem.compile()
+    >>> compiled.translate([1, 2]) == {'a': 1, 'b': 2}
+    True
+    """
+
+    def __init__(self, domains, constraints, vconstraints, bitsets=False,
+                 objectives=()):
+        """
+        @param domains: Dictionary mapping variables to their domains
+        @type  domains: dict
+        @param constraints: List of pairs of (constraint, variables)
+        @type  constraints: list
+        @param vconstraints: Dictionary mapping variables to a list of
+                             constraints affecting the given variables.
+        @type  vconstraints: dict
+        @param bitsets: Whether domains of small non-negative integers
+                        should be converted to L{BitsetDomain}
+                        (default is false)
+        @type  bitsets: bool
+        @param objectives: List of (func, variables, bound) cost terms,
+                           as given to L{Problem.addObjective()}
+        @type  objectives: list
+        """
+        variables = sorted(domains)
+        ids = dict((variable, i) for i, variable in enumerate(variables))
+        self.variables = variables
+        self.ids = ids
+        self.domains = []
+        for variable in variables:
+            domain = domains[variable]
+            if bitsets and isinstance(domain, Domain) and \
+               BitsetDomain.accepts(domain):
+                domain = BitsetDomain(domain)
+            self.domains.append(domain)
+        self.constraints = [(constraint,
+                             tuple([ids[variable] for variable in cvars]))
+                            for constraint, cvars in constraints]
+        self.vconstraints = [[] for variable in variables]
+        for constraint, cvars in self.constraints:
+            for variable in cvars:
+                self.vconstraints[variable].append((constraint, cvars))
+        self.objectives = [(func,
+                            tuple([ids[variable] for variable in ovars]),
+                            bound)
+                           for func, ovars, bound in objectives]
+
+    def __len__(self):
+        return len(self.variables)
+
+    def translate(self, values):
+        """
+        Map a list of values indexed by variable identifier back to names
+
+        @param values: Values of all variables, in identifier order
+        @type  values: sequence
+        @rtype: dictionary mapping variables to values
+        """
+        return dict(izip(self.variables, values))
+
+    def translateIter(self, valuesiter):
+        """
+        Translate every value list produced by the given iterator
+
+        @param valuesiter: Iterator over complete value lists
+        @type  valuesiter: iterator
+        @rtype: iterator over dictionaries mapping variables to values
+        """
+        variables = self.variables
+        for values in valuesiter:
+            yield dict(izip(variables, values))
+
 # ----------------------------------------------------------------------
 # Solvers
 # ----------------------------------------------------------------------
 
-def getArcs(domains, constraints):
+def doArc2001(domains, constraints, maxtuples=None):
     """
-    Return a dictionary mapping pairs (arcs) of constrained variables
+    Enforce generalized arc consistency with the AC-2001 algorithm
+
+    Every value of every variable must have a support in each constraint
+    on two or more variables affecting it, that is a combination of
+    values of the other variables accepted by the constraint. Values
+    without a support are removed from their domain for good, and the
+    constraints of their variable are revised again. The last support
+    found for each value is remembered: a later revision only checks
+    that it is still alive, and otherwise resumes the search right
+    where it stopped, since every combination before it was already
+    rejected.
 
-    @attention: Currently unused.
-    """
-    arcs = {}
-    for x in constraints:
-        constraint, variables = x
-        if len(variables) == 2:
-            variable1, variable2 = variables
-            arcs.setdefault(variable1, {})\
-                .setdefault(variable2, [])\
-                .append(x)
-            arcs.setdefault(variable2, {})\
-                .setdefault(variable1, [])\
-                .append(x)
-    return arcs
-
-def doArc8(arcs, domains, assignments):
-    """
-    Perform the ARC-8 arc checking algorithm and prune domains
+    Example:
 
-    @attention: Currently unused.
+    >>> domains = {"a": Domain(range(5)), "b": Domain(range(5)),
+    ...            "c": Domain(range(5))}
+    >>> constraints = [(FunctionConstraint(lambda a, b: a + 2 < b),
+    ...                 ["a", "b"]),
+    ...                (FunctionConstraint(lambda a, b, c: a + b == c),
+    ...                 ["a", "b", "c"])]
+    >>> doArc2001(domains, constraints)
+    True
+    >>> domains["a"], domains["b"], domains["c"]
+    ([0, 1], [3, 4], [3, 4])
+
+    @param domains: Dictionary mapping variables to their domains
+    @type  domains: dict
+    @param constraints: List of pairs of (constraint, variables)
+    @type  constraints: list
+    @param maxtuples: Constraints whose domains have more combinations
+                      of values are left alone (default is no limit)
+    @type  maxtuples: int
+    @return: False if some domain was emptied, True otherwise
+    @rtype: bool
     """
-    check = dict.fromkeys(domains, True)
-    while check:
-        variable, _ = check.popitem()
-        if variable not in arcs or variable in assignments:
+    # Values are numbered by their position in the initial domains, so
+    # combinations are always searched in the same lexicographic order.
+    values = {}
+    alive = {}
+    for variable, domain in domains.iteritems():
+        values[variable] = list(domain)
+        alive[variable] = dict.fromkeys(values[variable])
+    arcs = []
+    watch = dict((variable, []) for variable in domains)
+    for constraint, variables in constraints:
+        if len(variables) < 2 or len(set(variables)) != len(variables):
             continue
-        domain = domains[variable]
-        arcsvariable = arcs[variable]
-        for othervariable in arcsvariable:
-            arcconstraints = arcsvariable[othervariable]
-            if othervariable in assignments:
-                otherdomain = [assignments[othervariable]]
+        if maxtuples is not None:
+            size = 1
+            for variable in variables:
+                size *= len(values[variable])
+            if size > maxtuples:
+                continue
+        first = len(arcs)
+        for position in range(len(variables)):
+            arcs.append((constraint, variables, position))
+        # Pruning a variable requires revising the other variables of
+        # its constraints.
+        for position, variable in enumerate(variables):
+            watch[variable].extend([first+i for i in range(len(variables))
+                                    if i != position])
+    queue = range(len(arcs))
+    queued = dict.fromkeys(queue)
+    lastsupport = {}
+    while queue:
+        arc = queue.pop()
+        del queued[arc]
+        constraint, variables, position = arcs[arc]
+        variable = variables[position]
+        others = variables[:position] + variables[position+1:]
+        choices = []
+        for other in others:
+            otheralive = alive[other]
+            choices.append([i for i, value in enumerate(values[other])
+                            if value in otheralive])
+        assignments = {}
+        removed = False
+        for value in values[variable]:
+            if value not in alive[variable]:
+                continue
+            last = lastsupport.get((arc, value))
+            if last is None:
+                start = [0]*len(others)
             else:
-                otherdomain = domains[othervariable]
-            if domain:
-                changed = False
-                for value in domain[:]:
-                    assignments[variable] = value
-                    if otherdomain:
-                        for othervalue in otherdomain:
-                            assignments[othervariable] = othervalue
-                            for constraint, variables in arcconstraints:
-                                if not constraint(variables, domains,
-                                                  assignments, True):
-                                    break
-                            else:
-                                # All constraints passed. Value is safe.
-                                break
-                        else:
-                            # All othervalues failed. Kill value.
-                            domain.hideValue(value)
-                            changed = True
-                        del assignments[othervariable]
-                del assignments[variable]
-                #if changed:
-                #    check.update(dict.fromkeys(arcsvariable))
-            if not domain:
+                for other, i in izip(others, last):
+                    if values[other][i] not in alive[other]:
+                        break
+                else:
+                    # Last support is still alive.
+                    continue
+                start = last
+            assignments[variable] = value
+            for indices in _iterTuplesFrom(choices, start):
+                for other, i in izip(others, indices):
+                    assignments[other] = values[other][i]
+                if constraint(variables, domains, assignments):
+                    lastsupport[(arc, value)] = indices
+                    break
+            else:
+                del alive[variable][value]
+                domains[variable].remove(value)
+                removed = True
+        if removed:
+            if not domains[variable]:
                 return False
+            for other in watch[variable]:
+                if other not in queued:
+                    queued[other] = None
+                    queue.append(other)
     return True
 
+def _iterTuplesFrom(choices, start, depth=0):
+    """
+    Iterate over the index tuples of C{product(*choices)} not before C{start}
+
+    Tuples are produced in lexicographic order. As long as the prefix is
+    equal to the one of C{start}, indices smaller than it are skipped.
+    """
+    if depth == len(choices):
+        yield []
+        return
+    low = start[depth]
+    for i in choices[depth]:
+        if i < low:
+            continue
+        if i == low:
+            rest = _iterTuplesFrom(choices, start, depth+1)
+        else:
+            rest = product(*choices[depth+1:])
+        for tail in rest:
+            yield [i] + list(tail)
+
 class Solver(object):
     """
     Abstract base class for solvers
@@ -449,6 +769,98 @@ class Solver(object):
         raise NotImplementedError, \
               "%s doesn't provide iteration" % self.__class__.__name__
 
+class _VariableSelector(object):
+    """
+    Unassigned variables of a compiled problem, by degree and domain size
+
+    L{pop()} returns the variable with the smallest
+    C{(degree, len(domain), variable)}, as sorting them all would. The
+    degree is given once, and variables of the same degree are kept in
+    buckets indexed by their domain size, so a domain which shrinks or
+    grows only moves its variable from one bucket to another through
+    L{update()}.
+    """
+
+    def __init__(self, domains, degrees):
+        """
+        @param domains: Domains indexed by variable identifier
+        @type  domains: list
+        @param degrees: Sort key of every variable, compared before the
+                        size of its domain
+        @type  degrees: list
+        """
+        order = sorted(set(degrees))
+        groups = dict((degree, i) for i, degree in enumerate(order))
+        maxsize = max([len(domain) for domain in domains] or [0])
+        self._domains = domains
+        self._group = [groups[degree] for degree in degrees]
+        self._buckets = [[set() for size in xrange(maxsize+1)]
+                         for degree in order]
+        self._counts = [0]*len(order)
+        self._low = [0]*len(order)
+        self._sizes = [None]*len(domains)
+        for variable in xrange(len(domains)):
+            self.add(variable)
+
+    def add(self, variable):
+        size = len(self._domains[variable])
+        group = self._group[variable]
+        self._buckets[group][size].add(variable)
+        self._sizes[variable] = size
+        self._counts[group] += 1
+        if size < self._low[group]:
+            self._low[group] = size
+
+    def update(self, variable):
+        """
+        Move the variable to the bucket of its current domain size
+
+        Variables which aren't queued are ignored.
+        """
+        oldsize = self._sizes[variable]
+        if oldsize is not None:
+            size = len(self._domains[variable])
+            if size != oldsize:
+                group = self._group[variable]
+                buckets = self._buckets[group]
+                buckets[oldsize].remove(variable)
+                buckets[size].add(variable)
+                self._sizes[variable] = size
+                if size < self._low[group]:
+                    self._low[group] = size
+
+    def pop(self):
+        """
+        Remove and return the next variable to assign, or None
+        """
+        for group, count in enumerate(self._counts):
+            if count:
+                buckets = self._buckets[group]
+                low = self._low[group]
+                while not buckets[low]:
+                    low += 1
+                self._low[group] = low
+                variable = min(buckets[low])
+                buckets[low].remove(variable)
+                self._sizes[variable] = None
+                self._counts[group] -= 1
+                return variable
+        return None
+
+def _getNeighbours(compiled):
+    """
+    Return the list of the variables sharing a constraint with each
+    variable of a compiled problem
+    """
+    neighbours = [set() for x in compiled.domains]
+    for constraint, cvars in compiled.constraints:
+        for x in cvars:
+            neighbours[x].update(cvars)
+    for x, xneighbours in enumerate(neighbours):
+        xneighbours.discard(x)
+        neighbours[x] = list(xneighbours)
+    return neighbours
+
 class BacktrackingSolver(Solver):
     """
     Problem solver with backtracking capabilities
@@ -480,17 +892,33 @@ class BacktrackingSolver(Solver):
     True
     """#"""
 
-    def __init__(self, forwardcheck=True):
+    def __init__(self, forwardcheck=True, trail=True, budget=None):
         """
         @param forwardcheck: If false forward checking will not be requested
                              to constraints while looking for solutions
                              (default is true)
         @type  forwardcheck: bool
+        @param trail: If true compiled problems are searched undoing only
+                      the domains changed by forward checking, logged on
+                      a L{Trail}, instead of saving the state of every
+                      unassigned domain at each node (default is true)
+        @type  trail: bool
+        @param budget: Limits of each search, which stops with the
+                       solutions found so far once it is spent (default
+                       is no limit)
+        @type  budget: instance of L{Budget}
         """
         self._forwardcheck = forwardcheck
+        self._trail = trail
+        self.budget = budget
+        # Values tried by the last compiled search
+        self.nodes = 0
 
     def getSolutionIter(self, domains, constraints, vconstraints):
         forwardcheck = self._forwardcheck
+        budget = self.budget
+        if budget is not None:
+            budget.start()
         assignments = {}
 
 
@@ -541,6 +969,9 @@ class BacktrackingSolver(Solver):
                     else:
                         return
 
+                if budget is not None and budget.check():
+                    return
+
                 # Got a value. Check it.
                 assignments[variable] = values.pop()
 
@@ -565,6 +996,127 @@ class BacktrackingSolver(Solver):
 
         raise RuntimeError, "Can't happen"
 
+    def getCompiledSolutionIter(self, compiled):
+        """
+        Return an iterator for the solutions of a compiled problem
+
+        This is the same search as L{getSolutionIter()}, run on integer
+        variable identifiers with list-backed domains and assignments.
+        The number of values tried so far is kept in C{nodes}.
+
+        @param compiled: Problem to be solved
+        @type  compiled: instance of L{CompiledProblem}
+        @return: Iterator over lists holding the value of every variable,
+                 indexed by variable identifier
+        """
+        forwardcheck = self._forwardcheck
+        _unassigned = Unassigned
+        domains = compiled.domains
+        vconstraints = compiled.vconstraints
+        variables = range(len(domains))
+        assignments = ArrayAssignments(len(domains))
+        # Forward checking only hides values of the variables sharing a
+        # constraint with the one assigned, so only their domain sizes
+        # need to be looked at again.
+        neighbours = _getNeighbours(compiled)
+        # Mix the Degree and Minimum Remaing Values (MRV) heuristics
+        selector = _VariableSelector(domains,
+                                     [-len(x) for x in vconstraints])
+        update = selector.update
+        if forwardcheck and self._trail:
+            # The trail stands for all the domains
+            trail = Trail()
+            pushdomains = [trail]
+        else:
+            trail = None
+        for domain in domains:
+            domain.setTrail(trail)
+        self.nodes = 0
+        budget = self.budget
+        if budget is not None:
+            budget.start()
+
+        queue = []
+
+        while True:
+
+            variable = selector.pop()
+            if variable is not None:
+                # Found unassigned variable
+                values = domains[variable][:]
+                if trail is not None:
+                    pushdomains = [trail]
+                elif forwardcheck:
+                    pushdomains = [domains[x] for x in variables
+                                               if assignments[x] is _unassigned and
+                                                  x != variable]
+                else:
+                    pushdomains = None
+            else:
+                # No unassigned variables. We've got a solution. Go back
+                # to last variable, if there's one.
+                yield assignments[:]
+                if not queue:
+                    return
+                variable, values, pushdomains = queue.pop()
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+                    for x in neighbours[variable]:
+                        update(x)
+
+            while True:
+                # We have a variable. Do we have any values left?
+                if not values:
+                    # No. Go back to last variable, if there's one.
+                    assignments[variable] = _unassigned
+                    selector.add(variable)
+                    while queue:
+                        variable, values, pushdomains = queue.pop()
+                        if pushdomains:
+                            for domain in pushdomains:
+                                domain.popState()
+                            for x in neighbours[variable]:
+                                update(x)
+                        if values:
+                            break
+                        assignments[variable] = _unassigned
+                        selector.add(variable)
+                    else:
+                        return
+
+                if budget is not None and budget.check():
+                    return
+
+                # Got a value. Check it.
+                assignments[variable] = values.pop()
+                self.nodes += 1
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.pushState()
+
+                for constraint, cvars in vconstraints[variable]:
+                    if not constraint(cvars, domains, assignments,
+                                      pushdomains):
+                        # Value is not good.
+                        break
+                else:
+                    break
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+
+            if pushdomains:
+                for x in neighbours[variable]:
+                    update(x)
+
+            # Push state before looking for next variable.
+            queue.append((variable, values, pushdomains))
+
+        raise RuntimeError, "Can't happen"
+
     def getSolution(self, domains, constraints, vconstraints):
         iter = self.getSolutionIter(domains, constraints, vconstraints)
         try:
@@ -576,6 +1128,213 @@ class BacktrackingSolver(Solver):
         return list(self.getSolutionIter(domains, constraints, vconstraints))
 
 
+class BranchAndBoundSolver(BacktrackingSolver):
+    """
+    Problem solver looking for the solutions of lowest cost
+
+    The cost of a solution is the sum of the terms added with
+    L{Problem.addObjective()}. The search is the compiled search of
+    L{BacktrackingSolver}, keeping the C{k} cheapest solutions found so
+    far in a heap. The cost of a partial assignment is bounded from below
+    by the cost of its complete terms plus the bounds of the others, and
+    values pushing that bound to the cost of the k-th solution or above
+    are not searched further.
+
+    Solutions are only produced once the search is over, by increasing
+    cost. Their costs are then in C{costs}, and C{optimal} tells whether
+    they are the k cheapest ones, which is true unless the search was
+    stopped by the C{maxnodes} limit or by its L{Budget}. With C{improving}, solutions are
+    instead produced as soon as they are found, each one cheaper than all
+    the ones before, and C{costs} grows with them.
+
+    Examples:
+
+    >>> problem = Problem(BranchAndBoundSolver(k=2))
+    >>> problem.addVariables(["a", "b", "c"], range(10))
+    >>> problem.addConstraint(lambda a, b, c: a + b + c == 15)
+    >>> problem.addObjective(lambda a, b: (a - 2 * b) ** 2, ["a", "b"])
+    >>> problem.addObjective(lambda c: -c, ["c"], -9)
+    >>> solutions = problem.getSolutions()
+    >>> [sorted(solution.items()) for solution in solutions]
+    [[('a', 4), ('b', 2), ('c', 9)], [('a', 5), ('b', 2), ('c', 8)]]
+    >>> solver = problem.getSolver()
+    >>> solver.costs, solver.optimal
+    ([-9, -7], True)
+    >>> problem.setSolver(BranchAndBoundSolver(improving=True))
+    >>> solutions = problem.getSolutionIter()
+    >>> [problem.getSolver().costs[-1] for solution in solutions]
+    [9, 0, -1, -3, -4, -6, -7, -9]
+    >>> sorted(solution.items())
+    [('a', 4), ('b', 2), ('c', 9)]
+    """#"""
+
+    def __init__(self, k=1, maxnodes=None, forwardcheck=True,
+                 improving=False, budget=None):
+        """
+        @param k: Number of solutions to look for (default is 1)
+        @type  k: int
+        @param maxnodes: Number of values tried after which the search
+                         stops and returns the best solutions found so
+                         far (default is no limit)
+        @type  maxnodes: int
+        @param forwardcheck: If false forward checking will not be requested
+                             to constraints while looking for solutions
+                             (default is true)
+        @type  forwardcheck: bool
+        @param improving: If true, every solution cheaper than the ones
+                          found before is produced as soon as it is found
+                          (default is false)
+        @type  improving: bool
+        @param budget: Limits of each search, which stops like when
+                       C{maxnodes} is reached once it is spent (default is
+                       no limit)
+        @type  budget: instance of L{Budget}
+        """
+        BacktrackingSolver.__init__(self, forwardcheck, budget=budget)
+        self._k = k
+        self._maxnodes = maxnodes
+        self._improving = improving
+        self.costs = []
+        self.optimal = False
+
+    def getSolutionIter(self, domains, constraints, vconstraints):
+        raise NotImplementedError, \
+              "%s only solves compiled problems" % self.__class__.__name__
+
+    def getCompiledSolutionIter(self, compiled):
+        forwardcheck = self._forwardcheck
+        _unassigned = Unassigned
+        domains = compiled.domains
+        vconstraints = compiled.vconstraints
+        assignments = ArrayAssignments(len(domains))
+        neighbours = _getNeighbours(compiled)
+        selector = _VariableSelector(domains,
+                                     [-len(x) for x in vconstraints])
+        update = selector.update
+        if forwardcheck:
+            trail = Trail()
+            pushdomains = [trail]
+        else:
+            trail = pushdomains = None
+        for domain in domains:
+            domain.setTrail(trail)
+
+        # A term's bound is replaced by its cost once all its variables
+        # are assigned.
+        objectives = compiled.objectives
+        vobjectives = [[] for domain in domains]
+        missing = []
+        for term, (func, ovars, bound) in enumerate(objectives):
+            for x in ovars:
+                vobjectives[x].append(term)
+            missing.append(len(ovars))
+        lower = sum([bound for func, ovars, bound in objectives])
+
+        k = self._k
+        maxnodes = self._maxnodes
+        improving = self._improving
+        budget = self.budget
+        if budget is not None:
+            budget.start()
+        best = []
+        threshold = float("inf")
+        found = 0
+        self.nodes = 0
+        self.optimal = False
+        self.costs = []
+
+        queue = []
+        variable = selector.pop()
+        values = domains[variable][:]
+
+        while True:
+            if not values:
+                # No values left. Go back to last variable, if there's one.
+                assignments[variable] = _unassigned
+                selector.add(variable)
+                if not queue:
+                    self.optimal = True
+                    break
+                variable, values, lower = queue.pop()
+                for term in vobjectives[variable]:
+                    missing[term] += 1
+                if trail:
+                    trail.popState()
+                    for x in neighbours[variable]:
+                        update(x)
+                continue
+
+            if maxnodes is not None and self.nodes == maxnodes:
+                break
+            if budget is not None and budget.check():
+                break
+            self.nodes += 1
+
+            # Got a value. Bound the cost, then check it.
+            assignments[variable] = values.pop()
+            delta = 0
+            for term in vobjectives[variable]:
+                missing[term] -= 1
+                if not missing[term]:
+                    func, ovars, bound = objectives[term]
+                    delta += func(*[assignments[x] for x in ovars]) - bound
+            good = lower + delta < threshold
+            if good:
+                if trail:
+                    trail.pushState()
+                for constraint, cvars in vconstraints[variable]:
+                    if not constraint(cvars, domains, assignments,
+                                      pushdomains):
+                        # Value is not good.
+                        good = False
+                        break
+                if not good and trail:
+                    trail.popState()
+            if not good:
+                for term in vobjectives[variable]:
+                    missing[term] += 1
+                continue
+
+            # Saving the bound instead of subtracting delta later keeps
+            # rounding errors from piling up.
+            queue.append((variable, values, lower))
+            lower += delta
+            if trail:
+                for x in neighbours[variable]:
+                    update(x)
+            variable = selector.pop()
+            if variable is not None:
+                values = domains[variable][:]
+                continue
+
+            # No unassigned variables. We've got a solution, which costs
+            # exactly its bound.
+            found += 1
+            if improving and (not self.costs or lower < self.costs[-1]):
+                self.costs.append(lower)
+                yield assignments[:]
+            heapq.heappush(best, (-lower, -found, assignments[:]))
+            if len(best) > k:
+                heapq.heappop(best)
+            if len(best) == k:
+                threshold = -best[0][0]
+            # Go back to last variable.
+            variable, values, lower = queue.pop()
+            for term in vobjectives[variable]:
+                missing[term] += 1
+            if trail:
+                trail.popState()
+                for x in neighbours[variable]:
+                    update(x)
+
+        if improving:
+            return
+        best = [(-cost, -order, values) for cost, order, values in best]
+        best.sort()
+        self.costs = [cost for cost, order, values in best]
+        for cost, order, values in best:
+            yield values
+
 class RecursiveBacktrackingSolver(Solver):
     """
     Recursive problem solver with backtracking capabilities
@@ -771,6 +1530,66 @@ class Variable(object):
 
 Unassigned = Variable("Unassigned")
 
+# ----------------------------------------------------------------------
+# Assignments
+# ----------------------------------------------------------------------
+
+class ArrayAssignments(list):
+    """
+    List-backed assignments used when solving a L{CompiledProblem}
+
+    Slot i holds the value assigned to variable i, or L{Unassigned}.
+    The dictionary methods constraints rely on (C{get()}, C{in},
+    C{del}, C{keys()}, C{values()} and C{items()}) are provided, so any
+    constraint works unmodified on compiled problems.
+
+    Example:
+
+    >>> assignments = ArrayAssignments(3)
+    >>> assignments[1] = 42
+    >>> 1 in assignments, 0 in assignments
+    (True, False)
+    >>> assignments.items()
+    [(1, 42)]
+    >>> del assignments[1]
+    >>> assignments.get(1, None) is None
+    True
+    """
+
+    def __init__(self, size):
+        """
+        @param size: Number of variables of the compiled problem
+        @type  size: int
+        """
+        list.__init__(self, [Unassigned]*size)
+
+    def __contains__(self, variable):
+        return self[variable] is not Unassigned
+
+    def __delitem__(self, variable):
+        self[variable] = Unassigned
+
+    def get(self, variable, default=None):
+        value = self[variable]
+        if value is Unassigned:
+            return default
+        return value
+
+    def keys(self):
+        return [i for i, value in enumerate(self) if value is not Unassigned]
+
+    def values(self):
+        return [value for value in self if value is not Unassigned]
+
+    def items(self):
+        return [(i, value) for i, value in enumerate(self)
+                if value is not Unassigned]
+
+    def copy(self):
+        assignments = ArrayAssignments(0)
+        assignments.extend(self)
+        return assignments
+
 # ----------------------------------------------------------------------
 # Domains
 # ----------------------------------------------------------------------
@@ -791,6 +1610,16 @@ class Domain(list):
         list.__init__(self, set)
         self._hidden = []
         self._states = []
+        self._trail = None
+        self._stamp = None
+
+    def __copy__(self):
+        domain = list.__new__(self.__class__)
+        list.__init__(domain, self)
+        domain.__dict__.update(self.__dict__)
+        domain._hidden = self._hidden[:]
+        domain._states = self._states[:]
+        return domain
 
     def resetState(self):
         """
@@ -831,9 +1660,398 @@ class Domain(list):
 
         @param value: Object currently available in the domain
         """
+        trail = self._trail
+        if trail is not None and self._stamp != trail.stamp:
+            self._stamp = trail.stamp
+            trail.record(self, len(self._hidden))
         list.remove(self, value)
         self._hidden.append(value)
 
+    def setTrail(self, trail):
+        """
+        Record the state of the domain on the given trail before it's
+        first changed after each L{Trail.pushState()}
+
+        @param trail: Trail to record changes on, or None
+        @type  trail: instance of L{Trail}
+        """
+        self._trail = trail
+        self._stamp = None
+
+    def restoreState(self, state):
+        """
+        Restore a state recorded on a L{Trail}
+        """
+        hidden = self._hidden
+        self.extend(hidden[state:])
+        del hidden[state:]
+
+class BitsetDomain(object):
+    """
+    Domain of small non-negative integers backed by a bitmask
+
+    Value v is available when bit v of the mask is set, so membership,
+    L{hideValue()}, L{pushState()} and L{popState()} take constant time
+    and the size is kept as a counter instead of being recounted.
+    Values are always listed in the order they were given, restored
+    ones included, where a L{Domain} lists the values it restores after
+    the others. It behaves as a L{Domain} everywhere the solvers and
+    constraints use one.
+
+    L{CompiledProblem} switches domains holding only integers in
+    C{range(BitsetDomain.MAXVALUE)} to this class when asked to (see
+    L{Problem.setBitsets()}).
+
+    Example:
+
+    >>> domain = BitsetDomain([64, 60, 67])
+    >>> domain[:], len(domain)
+    ([64, 60, 67], 3)
+    >>> domain.pushState()
+    >>> domain.hideValue(64)
+    >>> 64 in domain, len(domain)
+    (False, 2)
+    >>> domain.popState()
+    >>> domain[:]
+    [64, 60, 67]
+    """
+
+    MAXVALUE = 128
+
+    def __init__(self, set):
+        """
+        @param set: Set of values that the given variables may assume
+        @type  set: set of integers in C{range(BitsetDomain.MAXVALUE)}
+        """
+        mask = 0
+        order = []
+        for value in set:
+            if not BitsetDomain.accepts((value,)):
+                raise ValueError, "Value out of bitset range: %s" % \
+                                  repr(value)
+            if not mask >> value & 1:
+                order.append(value)
+            mask |= 1 << value
+        self._order = order
+        self._base = mask
+        self._mask = mask
+        self._size = bin(mask).count("1")
+        self._states = []
+        self._trail = None
+        self._stamp = None
+
+    def accepts(values):
+        """
+        Tell if all the given values can be stored in a bitset domain
+
+        @param values: Values to be checked
+        @type  values: sequence
+        @rtype: bool
+        """
+        maxvalue = BitsetDomain.MAXVALUE
+        for value in values:
+            if type(value) not in (int, long) or not 0 <= value < maxvalue:
+                return False
+        return True
+    accepts = staticmethod(accepts)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, value):
+        return (type(value) in (int, long) and
+                0 <= value < BitsetDomain.MAXVALUE and
+                bool(self._mask >> value & 1))
+
+    def __iter__(self):
+        mask = self._mask
+        for value in self._order:
+            if mask >> value & 1:
+                yield value
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "BitsetDomain(%s)" % repr(list(self))
+
+    def __copy__(self):
+        domain = BitsetDomain(())
+        domain._order = self._order
+        domain._base = self._base
+        domain._mask = self._mask
+        domain._size = self._size
+        domain._states = self._states[:]
+        domain._trail = self._trail
+        return domain
+
+    def resetState(self):
+        """
+        Reset to the original domain state, including all possible values
+        """
+        self._mask = self._base
+        self._size = bin(self._base).count("1")
+        del self._states[:]
+
+    def pushState(self):
+        """
+        Save current domain state
+
+        Variables hidden after that call are restored when that state
+        is popped from the stack.
+        """
+        self._states.append((self._mask, self._size))
+
+    def popState(self):
+        """
+        Restore domain state from the top of the stack
+
+        Variables hidden since the last popped state are then available
+        again.
+        """
+        self._mask, self._size = self._states.pop()
+
+    def hideValue(self, value):
+        """
+        Hide the given value from the domain
+
+        After that call the given value won't be seen as a possible value
+        on that domain anymore. The hidden value will be restored when the
+        previous saved state is popped.
+
+        @param value: Object currently available in the domain
+        """
+        bit = 1 << value
+        if not self._mask & bit:
+            raise ValueError, "Value not in domain: %s" % repr(value)
+        trail = self._trail
+        if trail is not None and self._stamp != trail.stamp:
+            self._stamp = trail.stamp
+            trail.record(self, (self._mask, self._size))
+        self._mask ^= bit
+        self._size -= 1
+
+    def setTrail(self, trail):
+        """
+        Record the state of the domain on the given trail before it's
+        first changed after each L{Trail.pushState()}
+
+        @param trail: Trail to record changes on, or None
+        @type  trail: instance of L{Trail}
+        """
+        self._trail = trail
+        self._stamp = None
+
+    def restoreState(self, state):
+        """
+        Restore a state recorded on a L{Trail}
+        """
+        self._mask, self._size = state
+
+    def remove(self, value):
+        """
+        Remove the given value from the domain for good
+
+        Unlike L{hideValue()}, the value is not restored by L{popState()}
+        or L{resetState()}.
+
+        @param value: Object currently available in the domain
+        """
+        self.hideValue(value)
+        self._base &= ~(1 << value)
+
+class Trail(object):
+    """
+    Undo log of the changes made to domains while searching
+
+    Domains given a trail with C{setTrail()} record their state on it
+    the first time they hide a value after each L{pushState()}, and
+    L{popState()} restores only the domains recorded since. The trail
+    thus replaces pushing and popping the state of every domain which
+    might be changed.
+
+    Example:
+
+    >>> trail = Trail()
+    >>> domains = [Domain([1, 2, 3]), BitsetDomain([1, 2, 3])]
+    >>> for domain in domains:
+    ...     domain.setTrail(trail)
+    >>> trail.pushState()
+    >>> domains[0].hideValue(2)
+    >>> domains[0].hideValue(3)
+    >>> trail.pushState()
+    >>> domains[1].hideValue(1)
+    >>> domains
+    [[1], BitsetDomain([2, 3])]
+    >>> trail.popState()
+    >>> domains
+    [[1], BitsetDomain([1, 2, 3])]
+    >>> trail.popState()
+    >>> domains
+    [[1, 2, 3], BitsetDomain([1, 2, 3])]
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._marks = []
+        self._levels = 0
+        self.stamp = 0
+
+    def record(self, domain, state):
+        """
+        Save the state a domain must get back on the next L{popState()}
+        """
+        self._entries.append((domain, state))
+
+    def pushState(self):
+        """
+        Start recording changes made to domains
+        """
+        self._marks.append(len(self._entries))
+        self._levels += 1
+        self.stamp = self._levels
+
+    def popState(self):
+        """
+        Undo the changes made to domains since the last L{pushState()}
+        """
+        entries = self._entries
+        mark = self._marks.pop()
+        while len(entries) > mark:
+            domain, state = entries.pop()
+            domain.restoreState(state)
+        self._levels += 1
+        self.stamp = self._levels
+
+class Budget(object):
+    """
+    Limits on the resources a search may use
+
+    Solvers given a budget call L{check()} for every value they try, and
+    end the search as if it was over once the budget is spent. C{spent}
+    then tells which limit was reached: C{"time"}, C{"nodes"},
+    C{"memory"} or C{"halted"}.
+
+    Example:
+
+    >>> budget = Budget(nodes=5)
+    >>> problem = Problem(BacktrackingSolver(budget=budget))
+    >>> problem.addVariables(["a", "b"], range(10))
+    >>> len(problem.getSolutions()), budget.spent
+    (4, 'nodes')
+    """
+
+    def __init__(self, seconds=None, nodes=None, memory=None, halted=None,
+                 interval=256):
+        """
+        @param seconds: Wall-clock time the search may take, in seconds
+                        (default is no limit)
+        @type  seconds: number
+        @param nodes: Number of values the search may try (default is no
+                      limit)
+        @type  nodes: int
+        @param memory: Resident memory the process may grow by during
+                       the search, in bytes (default is no limit).
+                       Measured from C{/proc/self/statm}, or from the
+                       peak resident memory where the C{resource} module
+                       is available, otherwise not enforced.
+        @type  memory: int
+        @param halted: Function called while searching, which stops the
+                       search by returning true (default is none)
+        @type  halted: callable object
+        @param interval: Values tried between two measures of the memory
+                         and calls to C{halted} (default is 256)
+        @type  interval: int
+        """
+        self.seconds = seconds
+        self.maxnodes = nodes
+        self.memory = memory
+        self.halted = halted
+        self.interval = interval
+        self.start()
+
+    def start(self):
+        """
+        Start spending the budget, as solvers do when a search starts
+        """
+        self.nodes = 0
+        self.spent = None
+        self.started = time.time()
+        self._measured = 0
+        if self.memory is None:
+            self._memory = 0
+        else:
+            self._memory = _residentMemory()
+        if self.seconds is None:
+            self._deadline = None
+        else:
+            self._deadline = self.started + self.seconds
+
+    def elapsed(self):
+        """
+        Return the seconds spent since L{start()}
+        """
+        return time.time() - self.started
+
+    def check(self, count=1):
+        """
+        Count values tried, and tell whether the budget is spent
+
+        Searches which don't try values one at a time, such as dynamic
+        programming over the time steps of a problem, count the values
+        of a whole step at once.
+
+        >>> budget = Budget(nodes=100, interval=10)
+        >>> budget.check(60), budget.check(60), budget.spent
+        (False, True, 'nodes')
+
+        @param count: Number of values tried (default is 1)
+        @type  count: int
+        @return: True if the search must stop
+        @rtype: bool
+        """
+        if self.spent is not None:
+            return True
+        self.nodes += count
+        if self.maxnodes is not None and self.nodes > self.maxnodes:
+            self.spent = "nodes"
+        elif self._deadline is not None and time.time() >= self._deadline:
+            self.spent = "time"
+        elif self.nodes >= self._measured + self.interval:
+            self._measured = self.nodes
+            if self.halted is not None and self.halted():
+                self.spent = "halted"
+            elif self.memory is not None and \
+                     _residentMemory() - self._memory > self.memory:
+                self.spent = "memory"
+        return self.spent is not None
+
+def _residentMemory():
+    """
+    Return the resident memory of the process in bytes, or its peak
+    where the current one can't be read, or 0 if neither can be measured
+
+    The peak never goes down: in a long-lived process, it only grows
+    once a search uses more than any search before it.
+    """
+    if resource is None:
+        return 0
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, ValueError, IndexError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
 # ----------------------------------------------------------------------
 # Constraints
 # ----------------------------------------------------------------------
@@ -963,29 +2181,321 @@ class FunctionConstraint(Constraint):
     >>> problem.addConstraint(FunctionConstraint(func), ["a", "b"])
     >>> problem.getSolution()
     {'a': 1, 'b': 2}
+
+    With C{gac} set, forward checking also prunes when several variables
+    are unassigned:
+
+    >>> constraint = FunctionConstraint(lambda a, b, c: a + b + c == 3,
+    ...                                 gac=True)
+    >>> domains = {"a": Domain([0, 1, 2]), "b": Domain([0, 1, 2]),
+    ...            "c": Domain([0, 1, 2])}
+    >>> constraint(["a", "b", "c"], domains, {"a": 2}, True)
+    True
+    >>> domains["b"], domains["c"]
+    ([0, 1], [0, 1])
     """#"""
 
-    def __init__(self, func, assigned=True):
+    def __init__(self, func, assigned=True, gac=False, maxchecks=1000):
         """
         @param func: Function wrapped and queried for constraint logic
         @type  func: callable object
         @param assigned: Whether the function may receive unassigned
                          variables or not
         @type  assigned: bool
+        @param gac: Whether forward checking should remove unsupported
+                    values from all unassigned variables, and not only
+                    when a single one is left (default is false)
+        @type  gac: bool
+        @param maxchecks: Maximum number of function calls made by each
+                          of those L{gacCheck()}s (default is 1000)
+        @type  maxchecks: int
         """
         self._func = func
         self._assigned = assigned
+        self._gac = gac
+        self._maxchecks = maxchecks
+
+    def setGAC(self, gac, maxchecks=None):
+        """
+        Enable or disable pruning all unassigned variables when forward
+        checking
+
+        Example:
+
+        >>> constraint = FunctionConstraint(lambda a, b, c: a + b + c == 3)
+        >>> constraint.setGAC(True, 100)
+        >>> domains = {"a": Domain([0, 1, 2]), "b": Domain([0, 1, 2]),
+        ...            "c": Domain([0, 1, 2])}
+        >>> constraint(["a", "b", "c"], domains, {"a": 2}, True)
+        True
+        >>> domains["b"], domains["c"]
+        ([0, 1], [0, 1])
+
+        @param gac: Whether forward checking should remove unsupported
+                    values from all unassigned variables, and not only
+                    when a single one is left
+        @type  gac: bool
+        @param maxchecks: Maximum number of function calls made by each
+                          of those L{gacCheck()}s (default is to keep
+                          the current one)
+        @type  maxchecks: int
+        """
+        self._gac = gac
+        if maxchecks is not None:
+            self._maxchecks = maxchecks
 
     def __call__(self, variables, domains, assignments, forwardcheck=False,
                  _unassigned=Unassigned):
-        parms = [assignments.get(x, _unassigned) for x in variables]
+        if type(assignments) is ArrayAssignments:
+            # Unassigned slots already hold _unassigned
+            parms = [assignments[x] for x in variables]
+        else:
+            parms = [assignments.get(x, _unassigned) for x in variables]
         missing = parms.count(_unassigned)
         if missing:
-            return ((self._assigned or self._func(*parms)) and
-                    (not forwardcheck or missing != 1 or
-                     self.forwardCheck(variables, domains, assignments)))
+            if not (self._assigned or self._func(*parms)):
+                return False
+            if not forwardcheck:
+                return True
+            if missing == 1:
+                return self.forwardCheck(variables, domains, assignments)
+            return not self._gac or self.gacCheck(variables, domains, parms)
         return self._func(*parms)
 
+    def gacCheck(self, variables, domains, parms, _unassigned=Unassigned):
+        """
+        Hide the values of unassigned variables lacking a support
+
+        A support of a value is a combination of values of the other
+        unassigned variables which, together with the assigned ones,
+        satisfies the function. Every support found also supports the
+        values it gives to the other variables, so they are not searched
+        again. Once C{maxchecks} combinations were tried the remaining
+        values are left alone, which is always safe.
+
+        @param variables: Variables affected by that constraint, in the
+                          same order provided by the user
+        @type  variables: sequence
+        @param domains: Dictionary mapping variables to their domains
+        @type  domains: dict
+        @param parms: Values of the variables, with C{Unassigned} for
+                      the unassigned ones
+        @type  parms: list
+        @return: Boolean value stating if this constraint is currently
+                 broken or not
+        @rtype: bool
+        """#"""
+        positions = [i for i, value in enumerate(parms)
+                     if value is _unassigned]
+        pdomains = [domains[variables[i]] for i in positions]
+        supported = [{} for i in positions]
+        func = self._func
+        checks = self._maxchecks
+        parms = parms[:]
+        for k, position in enumerate(positions):
+            domain = pdomains[k]
+            others = positions[:k] + positions[k+1:]
+            otherdomains = pdomains[:k] + pdomains[k+1:]
+            othersupported = supported[:k] + supported[k+1:]
+            for value in domain[:]:
+                if value in supported[k]:
+                    continue
+                parms[position] = value
+                for othervalues in product(*otherdomains):
+                    if not checks:
+                        return True
+                    checks -= 1
+                    for i, othervalue in izip(others, othervalues):
+                        parms[i] = othervalue
+                    if func(*parms):
+                        supported[k][value] = True
+                        for found, othervalue in izip(othersupported,
+                                                      othervalues):
+                            found[othervalue] = True
+                        break
+                else:
+                    domain.hideValue(value)
+            if not domain:
+                return False
+        return True
+
+class TableConstraint(FunctionConstraint):
+    """
+    Constraint defined by the table of value tuples it allows
+
+    The wrapped function is called once per combination of the domains
+    seen in L{preProcess()}, and the allowed tuples are indexed by the
+    value each one gives to every position. Checks are then answered by
+    lookups, and forward checking removes from every unassigned variable
+    the values no tuple agreeing with the assigned ones supports, even
+    when more than one variable is still unassigned. Values without any
+    support at all are removed during preprocessing.
+
+    When the domains have more than C{maxtuples} combinations no table
+    is built, and the constraint behaves as a L{FunctionConstraint}. So
+    it does for values outside the domains the table was built on.
+
+    Example:
+
+    >>> problem = Problem()
+    >>> problem.addVariables(["a", "b", "c"], [1, 2, 3])
+    >>> problem.addConstraint(TableConstraint(lambda a, b, c: a < b < c),
+    ...                       ["a", "b", "c"])
+    >>> problem.getSolutions()
+    [{'a': 1, 'c': 3, 'b': 2}]
+    """#"""
+
+    def __init__(self, func, maxtuples=10000):
+        """
+        @param func: Function wrapped and queried for constraint logic
+        @type  func: callable object
+        @param maxtuples: Largest number of combinations enumerated to
+                          build the table (default is 10000)
+        @type  maxtuples: int
+        """
+        FunctionConstraint.__init__(self, func)
+        self._maxtuples = maxtuples
+        self._tuples = None
+        self._supports = None
+        self._residues = None
+        self._known = None
+
+    def preProcess(self, variables, domains, constraints, vconstraints):
+        Constraint.preProcess(self, variables, domains,
+                              constraints, vconstraints)
+        if len(variables) == 1:
+            return
+        size = 1
+        for variable in variables:
+            size *= len(domains[variable])
+        if size > self._maxtuples:
+            self._tuples = None
+            return
+        func = self._func
+        known = [domains[variable][:] for variable in variables]
+        self.setTable(variables, domains, known,
+                      (values for values in product(*known) if func(*values)))
+
+    def setTable(self, variables, domains, known, allowed):
+        """
+        Install the table of allowed value tuples, and remove from the
+        domains the values no tuple supports
+
+        Subclasses knowing their allowed tuples without calling the
+        wrapped function on every combination may call this from their
+        own L{preProcess()}.
+
+        @param variables: Variables affected by that constraint, in the
+                          same order provided by the user
+        @type  variables: sequence
+        @param domains: Dictionary mapping variables to their domains
+        @type  domains: dict
+        @param known: Sequence with the values of each variable the table
+                      covers. Other values are checked by calling the
+                      wrapped function.
+        @type  known: sequence of sequences
+        @param allowed: Allowed tuples, each within C{known}
+        @type  allowed: iterable of tuples
+        """
+        positions = range(len(variables))
+        tuples = set()
+        supports = [{} for variable in variables]
+        residues = [{} for variable in variables]
+        for values in allowed:
+            tuples.add(values)
+            for i in positions:
+                supports[i].setdefault(values[i], []).append(values)
+                residue = values[:i]+values[i+1:]
+                residues[i].setdefault(residue, set()).add(values[i])
+        self._tuples = tuples
+        self._supports = supports
+        self._residues = residues
+        self._known = [set(values) for values in known]
+        for variable, support in izip(variables, supports):
+            domain = domains[variable]
+            for value in domain[:]:
+                if value not in support:
+                    domain.remove(value)
+
+    def __call__(self, variables, domains, assignments, forwardcheck=False,
+                 _unassigned=Unassigned):
+        tuples = self._tuples
+        if tuples is None:
+            return FunctionConstraint.__call__(self, variables, domains,
+                                               assignments, forwardcheck)
+        if type(assignments) is ArrayAssignments:
+            parms = [assignments[x] for x in variables]
+        else:
+            parms = [assignments.get(x, _unassigned) for x in variables]
+        missing = parms.count(_unassigned)
+        if not missing:
+            values = tuple(parms)
+            if values in tuples:
+                return True
+            for value, knownvalues in izip(values, self._known):
+                if value not in knownvalues:
+                    # Outside the table, ask the function itself.
+                    return self._func(*parms)
+            return False
+        known = self._known
+        if missing == 1:
+            # The values supported for the last variable are indexed by
+            # the values of all the others.
+            i = parms.index(_unassigned)
+            residue = tuple(parms[:i]+parms[i+1:])
+            supported = self._residues[i].get(residue)
+            if supported is None:
+                for j, value in enumerate(parms):
+                    if j != i and value not in known[j]:
+                        return FunctionConstraint.__call__(
+                            self, variables, domains, assignments,
+                            forwardcheck)
+                return False
+            if forwardcheck:
+                domain = domains[variables[i]]
+                knownvalues = known[i]
+                for value in domain[:]:
+                    if value not in supported and value in knownvalues:
+                        domain.hideValue(value)
+                if not domain:
+                    return False
+            return True
+        if not forwardcheck:
+            return True
+        # Gather the tuples agreeing with the assigned values, starting
+        # from the shortest support list among them.
+        candidates = None
+        assigned = []
+        for i, value in enumerate(parms):
+            if value is not _unassigned:
+                if value not in known[i]:
+                    return FunctionConstraint.__call__(self, variables,
+                                                       domains, assignments,
+                                                       forwardcheck)
+                support = self._supports[i].get(value, ())
+                if candidates is None or len(support) < len(candidates):
+                    candidates = support
+                assigned.append((i, value))
+        if candidates is None:
+            return True
+        if len(assigned) > 1:
+            candidates = [values for values in candidates
+                          if not [1 for i, value in assigned
+                                  if values[i] != value]]
+        if not candidates:
+            return False
+        for i, variable in enumerate(variables):
+            if parms[i] is _unassigned:
+                supported = set([values[i] for values in candidates])
+                domain = domains[variable]
+                knownvalues = known[i]
+                for value in domain[:]:
+                    if value not in supported and value in knownvalues:
+                        domain.hideValue(value)
+                if not domain:
+                    return False
+        return True
+
 class AllDifferentConstraint(Constraint):
     """
     Constraint enforcing that values of all given variables are different
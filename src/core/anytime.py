@@ -0,0 +1,261 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/anytime.py
+
+Anytime solving: the search reports each solution graded better than
+all the ones it found before, as soon as it finds it, so that a first
+harmonization can be shown at once and replaced by better ones until
+the search is over or stopped.
+
+  "csp": every solution is graded as it is enumerated.
+  "parallel": the best solution of the split search is the only one
+         reported, once it's over (see parallel.py).
+  "dp":  the best graded solution is the only one reported.
+  "bnb": branch and bound reports the solutions it improves its bound
+         with (see constraint.BranchAndBoundSolver, with improving).
+  "beam": the best solution of the beam search is the only one
+         reported (see beam.py).
+
+The searches may be given a budget of time, values tried and memory
+(see solver.make_budget()): once it is spent, the best solution found
+so far is the answer (see solve_within()). The "csp" and "bnb" searches
+check it at every value tried, the "dp" and "beam" ones once per time
+step, counting its voicings, and the "parallel" one once per subtree,
+counting its solutions. The "dp" and "beam" searches have no solution
+until they reach the last time step.
+
+Main functions:
+  iter_improving()
+  solve_anytime()
+  solve_within()
+'''
+
+import sys, time
+
+import config
+from solver import add_grade_objectives, make_budget, set_budget
+from chain import VoicingChain, IncrementalChain, viterbi
+from beam import beam_search
+from parallel import solve_parallel
+
+sys.path.append("..")
+from constraint import constraint
+from Grader.grader import grade
+
+class SearchStats(object):
+    """ Statistics of an anytime search, kept up to date while it runs.
+
+    Attributes:
+        str ENGINE:
+        float ELAPSED: Seconds from the start of the search to the last
+            solution reported, or to its end once it is over.
+        int SOLUTIONS: Solutions found ("csp": all the ones graded).
+        int NODES: Values tried by branch and bound, None for the other
+            engines.
+        int IMPROVEMENTS: Solutions reported.
+        bool OPTIMAL: True once the last solution reported is known to be
+            the best graded one.
+        str SPENT: The budget which stopped the search ("time", "nodes",
+            "memory" or "halted"), or None.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.elapsed = 0.0
+        self.solutions = 0
+        self.nodes = None
+        self.improvements = 0
+        self.optimal = False
+        self.spent = None
+
+    def __str__(self):
+        text = "{0} solutions".format(self.solutions)
+        if self.nodes is not None:
+            text += ", {0} nodes".format(self.nodes)
+        return text + " in {0:.4f}s".format(self.elapsed)
+
+def iter_improving(problem, chords, harmonies, engine=None, halted=None,
+                   limit=None, seen=None, chain=None, budget=None):
+    """ Yields the solutions of PROBLEM graded better than all the ones
+    found before them, as soon as they are found.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        str ENGINE: Defaults to config.engine.
+        function HALTED: Called after each solution found, and by the
+            "beam" search after each time step. If it returns True, the
+            search stops.
+        int LIMIT: With "csp", number of solutions after which the search
+            stops, and with "parallel", number of solutions it returns.
+            None searches all the solutions. Branch and bound stops after
+            config.bnb_max_nodes values tried.
+        list SEEN: If given, the (float grade, dict solution) of every
+            solution found are appended to it.
+        VoicingChain CHAIN: With "dp", the chain of PROBLEM if already
+            built. An IncrementalChain resumes from its cached scores.
+        Budget BUDGET: Limits of the search (see the documentation of
+            this module, and solver.make_budget()).
+    Output:
+        Yields (float GRADE, dict SOLUTION, SearchStats STATS). STATS is
+        the same object every time, and is updated until the search is
+        over.
+    """
+    engine = engine or config.engine
+    stats = SearchStats(engine)
+    start = time.time()
+    if engine == "dp":
+        if chain is None:
+            chain = VoicingChain(problem, linked=False)
+            chain.link(budget)
+        if budget is not None and budget.spent:
+            result = None
+        elif isinstance(chain, IncrementalChain):
+            result = chain.best(chords, harmonies, budget)
+        else:
+            result = viterbi(chain, chords, harmonies, budget)
+        stats.elapsed = time.time() - start
+        stats.spent = budget and budget.spent
+        stats.optimal = not stats.spent
+        if result is not None:
+            stats.solutions = stats.improvements = 1
+            if seen is not None:
+                seen.append(result)
+            yield result[0], result[1], stats
+        return
+    if engine == "parallel":
+        solutions = solve_parallel(problem, chords, harmonies, limit,
+                                   halted=halted, budget=budget)
+        stats.elapsed = time.time() - start
+        stats.spent = budget and budget.spent
+        if solutions is None:
+            stats.spent = "halted"
+        elif solutions:
+            stats.optimal = limit is None and not stats.spent
+            stats.solutions = len(solutions)
+            stats.improvements = 1
+            if seen is not None:
+                seen.extend(solutions)
+            yield solutions[0][0], solutions[0][1], stats
+        return
+    if engine == "beam":
+        solutions, beam_stats = beam_search(problem, chords, harmonies,
+                                            halted=halted, budget=budget)
+        stats.elapsed = time.time() - start
+        stats.optimal = beam_stats.optimal()
+        stats.spent = (budget and budget.spent) or \
+                      ("halted" if halted and halted() else None)
+        if solutions:
+            stats.solutions = len(solutions)
+            stats.improvements = 1
+            if seen is not None:
+                seen.extend(solutions)
+            yield solutions[0][0], solutions[0][1], stats
+        return
+    if engine == "bnb":
+        add_grade_objectives(problem, chords, harmonies)
+        solver = problem.getSolver()
+        bnb = constraint.BranchAndBoundSolver(maxnodes=config.bnb_max_nodes,
+                                              improving=True, budget=budget)
+        problem.setSolver(bnb)
+        stats.nodes = 0
+        try:
+            for solution in problem.getSolutionIter():
+                stats.elapsed = time.time() - start
+                stats.solutions += 1
+                stats.improvements += 1
+                stats.nodes = bnb.nodes
+                sol_grade = -bnb.costs[-1]
+                if seen is not None:
+                    seen.append((sol_grade, solution))
+                yield sol_grade, solution, stats
+                if halted and halted():
+                    break
+            else:
+                stats.optimal = bnb.optimal
+        finally:
+            problem.setSolver(solver)
+        stats.nodes = bnb.nodes
+        stats.spent = budget and budget.spent
+        stats.elapsed = time.time() - start
+        return
+    best = None
+    solver = set_budget(problem, budget)
+    try:
+        for solution in problem.getSolutionIter():
+            stats.solutions += 1
+            sol_grade = grade(solution, chords, harmonies)
+            if seen is not None:
+                seen.append((sol_grade, solution))
+            if best is None or sol_grade > best:
+                best = sol_grade
+                stats.elapsed = time.time() - start
+                stats.improvements += 1
+                yield sol_grade, solution, stats
+            if (halted and halted()) or stats.solutions == limit:
+                break
+        else:
+            stats.spent = budget and budget.spent
+            stats.optimal = not stats.spent
+    finally:
+        problem.setSolver(solver)
+    stats.elapsed = time.time() - start
+
+def solve_anytime(problem, chords, harmonies, callback, engine=None,
+                  halted=None, limit=None):
+    """ Calls CALLBACK with each solution of PROBLEM graded better than
+    the ones found before it (see iter_improving()).
+    Input:
+        function CALLBACK: Called as CALLBACK(float grade, dict solution,
+            SearchStats stats). If it returns True, the search stops.
+    Output:
+        (float GRADE, dict SOLUTION, SearchStats STATS): The best
+        solution found, or None if there is none.
+    """
+    best = None
+    for sol_grade, solution, stats in iter_improving(problem, chords,
+                                                     harmonies, engine,
+                                                     halted, limit):
+        best = (sol_grade, solution, stats)
+        if callback(sol_grade, solution, stats):
+            break
+    return best
+
+def solve_within(problem, chords, harmonies, seconds=None, nodes=None,
+                 memory=None, engine=None, halted=None):
+    """ Finds the best graded solution of PROBLEM the search can reach
+    within a budget (see solver.make_budget(), whose defaults are the
+    ones of config).
+    Input:
+        float SECONDS: Wall-clock time of the search.
+        int NODES: Values tried.
+        int MEMORY: Megabytes the resident memory may grow by.
+    Output:
+        (float GRADE, dict SOLUTION, SearchStats STATS), or None if there
+        is no solution, or none was found in time. STATS.SPENT tells
+        which budget ran out, if any: SOLUTION is then the best found so
+        far.
+    """
+    budget = make_budget(halted, seconds, nodes, memory)
+    best = None
+    for sol_grade, solution, stats in iter_improving(problem, chords,
+                                                     harmonies, engine,
+                                                     budget=budget):
+        best = (sol_grade, solution, stats)
+    return best
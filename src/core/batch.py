@@ -0,0 +1,266 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/batch.py
+
+Solves many problem files without prompting (the --batch option of the
+CLI). Files are solved by a multiprocessing.Pool, and each one gives a
+JSON record, written on its own line (NDJSON) in the order of the
+files:
+
+  {"file": str, "status": "ok" | "no_solution" | "error" | "timeout",
+   "engine": str, "grade": float, "count": int,
+   "solutions": [{"grade": float, "voices": {"s": [int pitch, ...],
+                                             "a": [...], ...}}, ...],
+   "timings": {"parse": float, "init": float, "solve": float,
+               "count": float},
+   "cached": bool, "error": str}
+
+"grade" is the one of the best solution, "solutions" are the best graded
+ones, best first, and "error" is only there on failures. A failing or
+timed out file doesn't stop the others. With config.solution_cache,
+the solutions and counts of problems solved before come from the cache
+(see solution_cache.py), and "cached" tells whether they all did.
+
+Main functions:
+  find_problemfiles()
+  solve_problemfile()
+  run_batch()
+'''
+
+import sys, os, glob, time, json, signal, heapq, multiprocessing
+from itertools import islice
+
+import config
+import solution_cache
+from solver import init_problem, parse_problemfile, make_timelists, \
+     solve_bnb, solve_cached
+from chain import VoicingChain, viterbi, count_solutions, split_var
+from beam import beam_search
+from parallel import solve_parallel
+
+sys.path.append("..")
+from constraint import constraint
+from Grader.grader import grade
+from util.constants import *
+
+canTimeout = hasattr(signal, "SIGALRM")
+
+class BatchTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise BatchTimeout()
+
+def find_problemfiles(pattern):
+    """ Returns the sorted paths of the problem files of PATTERN: the
+    files of a directory, or the files matching a glob pattern.
+    """
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                 if not name.startswith(".")]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def best_solutions(problem, chords, harmonies, engine, k):
+    """ Returns the (at most) K best graded solutions of PROBLEM, found
+    with ENGINE (see config.ENGINES). The "dp" engine only finds the
+    best one, the "beam" engine the ones of its last beam, and the "csp"
+    engine the best of the first config.num_solutions it finds.
+    Output:
+        list SOLUTIONS: [(float grade, dict solution), ...], best first.
+    """
+    if engine == "dp":
+        result = viterbi(VoicingChain(problem), chords, harmonies)
+        return [result] if result != None else []
+    if engine == "bnb":
+        solutions, grades, optimal = solve_bnb(problem, chords, harmonies, k=k)
+        return zip(grades, solutions)
+    if engine == "beam":
+        return beam_search(problem, chords, harmonies)[0][:k]
+    if engine == "parallel":
+        # Pool workers are daemonic, and can't start pools of their own
+        return solve_parallel(problem, chords, harmonies,
+                              config.num_solutions, workers=1)[:k]
+    graded = ((grade(solution, chords, harmonies), sorted(solution.items()))
+              for solution in islice(problem.getSolutionIter(),
+                                     config.num_solutions))
+    return [(sol_grade, dict(items)) for sol_grade, items in
+            heapq.nlargest(k, graded, key=lambda (g, items): (g, items))]
+
+def cache_asked(engine, k):
+    """ Returns what the solutions of best_solutions() depend on, besides
+    the problem (see solution_cache.problem_key()).
+    """
+    if engine == "dp":
+        return ("dp",)
+    if engine == "bnb":
+        return ("bnb", k, config.bnb_max_nodes,
+                solution_cache.search_settings())
+    if engine == "beam":
+        return ("beam", k, config.beam_width)
+    if engine == "parallel":
+        return ("parallel", k, config.num_solutions,
+                solution_cache.search_settings())
+    return ("csp", "best", k, config.num_solutions,
+            solution_cache.search_settings())
+
+def _voices(solution):
+    """ Returns the pitches of each voice of SOLUTION, in time order. """
+    voices = dict((voice, {}) for voice in VOICE_PREFIXES)
+    for var, pitch in solution.iteritems():
+        voice, t = split_var(var)
+        voices[voice][t] = pitch
+    return dict((voice, [pitches[t] for t in sorted(pitches)])
+                for voice, pitches in voices.iteritems())
+
+def solve_problemfile(path, engine=None, k=None):
+    """ Solves the problem file PATH.
+    Input:
+        str PATH:
+        str ENGINE: Defaults to config.engine.
+        int K: Number of best solutions kept. Defaults to
+            config.batch_solutions.
+    Output:
+        dict RECORD: See the documentation of this module. Exceptions
+            raised while solving are reported in it.
+    """
+    engine = engine or config.engine
+    k = k or config.batch_solutions
+    timings = {}
+    record = {"file": path, "engine": engine, "timings": timings}
+    phase = [None, time.time()]
+    def start(name):
+        now = time.time()
+        if phase[0] is not None:
+            timings[phase[0]] = now - phase[1]
+        phase[:] = [name, now]
+    try:
+        start("parse")
+        pair = parse_problemfile(path)
+        if not pair:
+            raise IOError("Can't open {0}".format(path))
+        chords, figures = pair
+        if not chords:
+            raise ValueError("No chords in {0}".format(path))
+        start("init")
+        problem = init_problem(constraint.Problem(), chords, figures)
+        chords_tl, harmonies_tl = make_timelists(chords)
+        start("solve")
+        solutions, cached = solve_cached(
+            problem, chords_tl, harmonies_tl, cache_asked(engine, k),
+            lambda: (best_solutions(problem, chords_tl, harmonies_tl,
+                                    engine, k), True))
+        start("count")
+        record["count"], counted = solve_cached(
+            problem, chords_tl, harmonies_tl, ("count",),
+            lambda: (count_solutions(problem), True), count=True)
+        record["cached"] = cached and counted
+        start(None)
+        record["solutions"] = [{"grade": sol_grade,
+                                "voices": _voices(solution)}
+                               for sol_grade, solution in solutions]
+        record["grade"] = solutions[0][0] if solutions else None
+        record["status"] = "ok" if solutions else "no_solution"
+    except BatchTimeout:
+        record["status"] = "timeout"
+        record["error"] = "Timed out while in phase {0}".format(phase[0])
+        start(None)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = "{0} (phase {1}): {2}".format(type(e).__name__,
+                                                         phase[0], e)
+        start(None)
+    return record
+
+def _solve_task(task):
+    """ Solves a problem file in a worker, within its time limit. The
+    messages printed while solving go to stderr, since stdout carries
+    the records.
+    Input:
+        tuple TASK: (str path, str engine, int k, int timeout)
+    """
+    path, engine, k, timeout = task
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    alarm = timeout and canTimeout
+    if alarm:
+        handler = signal.signal(signal.SIGALRM, _raise_timeout)
+    try:
+        if alarm:
+            signal.alarm(timeout)
+        record = solve_problemfile(path, engine, k)
+        if alarm:
+            signal.alarm(0)
+    except BatchTimeout:
+        # The alarm went off once solve_problemfile() stopped handling it
+        record = {"file": path, "engine": engine or config.engine,
+                  "timings": {}, "status": "timeout",
+                  "error": "Timed out after solving"}
+    finally:
+        if alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, handler)
+        sys.stdout = stdout
+    return record
+
+def run_batch(pattern, out=None, engine=None, k=None, workers=None,
+              timeout=None):
+    """ Solves every problem file of PATTERN (see find_problemfiles()),
+    writing their records to OUT, one JSON object per line.
+    Input:
+        str PATTERN:
+        file OUT: Defaults to sys.stdout.
+        str ENGINE: Defaults to config.engine.
+        int K: Defaults to config.batch_solutions.
+        int WORKERS: Number of processes, 0 for one per CPU. Defaults to
+            config.batch_workers.
+        int TIMEOUT: Seconds allowed to each file, 0 for no limit.
+            Defaults to config.batch_timeout. Not enforced on platforms
+            without SIGALRM (Windows).
+    Output:
+        dict STATUSES: Maps each status to its number of files.
+    """
+    out = out or sys.stdout
+    if workers is None:
+        workers = config.batch_workers
+    if timeout is None:
+        timeout = config.batch_timeout
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    paths = find_problemfiles(pattern)
+    tasks = [(path, engine, k, timeout) for path in paths]
+    statuses = {}
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        records = pool.imap(_solve_task, tasks)
+    else:
+        records = (_solve_task(task) for task in tasks)
+    try:
+        for record in records:
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            out.write(json.dumps(record, sort_keys=True) + "\n")
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return statuses
@@ -0,0 +1,214 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/beam.py
+
+The "beam" engine: an approximate search for the best graded solution
+of progressions too long for the other engines (hymns and chorales of
+hundreds of chords).
+
+The search moves forward through the time steps, keeping the WIDTH best
+graded harmonizations of the time steps so far (the beam), each ending
+on a different voicing. The voicings of a time step are enumerated once
+the beam reaches it (see VoicingChain.step_voicings()), the transitions
+are only computed from the voicings of the beam (see
+VoicingChain.link_voicings()), and only the voicings the beam keeps are
+remembered, each with the one before it: the search takes O(WIDTH * T +
+V) memory for T time steps and at most V voicings per time step, and
+O(WIDTH * V * T) time, against O(V * T) memory and O(V^2 * T) time for
+the "dp" engine. A beam never cut is the search of the "dp" engine, and
+its solution is the best graded one.
+
+To tune the width, the search reports its gap to the best grade, found
+by the "dp" engine on the same chain when the transitions between all
+the voicings of consecutive time steps are at most
+config.beam_exact_max_pairs.
+
+Main functions:
+  beam_search()
+'''
+
+import sys, time
+
+import config
+from chain import VoicingChain, forward_scores, viterbi
+
+sys.path.append("..")
+from Grader.grader import voicing_grader
+
+class BeamStats(object):
+    """ Statistics of a beam search.
+
+    Attributes:
+        int WIDTH:
+        float GRADE: Grade of the solution found, None if there is none.
+        bool PRUNED: True if the beam was ever cut to WIDTH.
+        int PAIRS: Transitions between the voicings of consecutive time
+            steps the "dp" engine checks.
+        float EXACT: The best grade of the problem, None if it wasn't
+            computed.
+        float GAP: EXACT - GRADE, None if either is None.
+        float ELAPSED, EXACT_ELAPSED: Seconds taken by the beam search,
+            and by the "dp" engine.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.grade = None
+        self.pruned = False
+        self.pairs = 0
+        self.exact = None
+        self.gap = None
+        self.elapsed = 0.0
+        self.exact_elapsed = 0.0
+
+    def optimal(self):
+        """ Returns True if the solution found is known to be the best
+        graded one.
+        """
+        return self.gap is not None and abs(self.gap) < 1e-9
+
+    def __str__(self):
+        text = "width {0}, grade {1} in {2:.4f}s".format(self.width,
+                                                         self.grade,
+                                                         self.elapsed)
+        if not self.pruned:
+            return text + " (never cut: exact)"
+        if self.exact is None:
+            return text + " (best grade not computed: {0} pairs of " \
+                   "voicings)".format(self.pairs)
+        return text + ", best grade {0} in {1:.4f}s (gap {2})".format(
+            self.exact, self.exact_elapsed, self.gap)
+
+def beam_search(problem, chords, harmonies, width=None, exact=None,
+                halted=None, budget=None):
+    """ Searches PROBLEM for its best graded solution with a beam of WIDTH
+    harmonizations (see the documentation of this module).
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        int WIDTH: Defaults to config.beam_width.
+        bool EXACT: Whether to compute the best grade for the gap. Defaults
+            to PAIRS <= config.beam_exact_max_pairs.
+        function HALTED: Called after each time step. If it returns True,
+            the search stops without solutions.
+        Budget BUDGET: Checked once per time step, counting the voicings of
+            the time step it leaves (see constraint.Budget), and by the "dp"
+            engine computing the best grade. If it runs out, the search
+            stops without solutions, or without the best grade.
+    Output:
+        (list SOLUTIONS, BeamStats STATS): SOLUTIONS are the (float grade,
+        dict solution) of the harmonizations of the last beam, best
+        first, [] if the beam died out (no voicing it kept has a next
+        one) or there is no solution.
+    """
+    start = time.time()
+    stats = BeamStats(width or config.beam_width)
+    chain = VoicingChain(problem, linked=False)
+    solutions, reached, size = _search(chain, chords, harmonies, stats,
+                                       halted, budget)
+    stats.elapsed = time.time() - start
+    if solutions:
+        stats.grade = solutions[0][0]
+    if solutions and not stats.pruned:
+        stats.exact = stats.grade
+    elif not (halted and halted()) and not (budget and budget.spent):
+        if exact is None:
+            stats.pairs += _count_pairs(chain, reached, size)
+            exact = stats.pairs <= config.beam_exact_max_pairs
+        if exact:
+            start = time.time()
+            chain.link(budget)
+            result = None
+            if not (budget and budget.spent):
+                result = viterbi(chain, chords, harmonies, budget)
+            stats.exact_elapsed = time.time() - start
+            stats.exact = result and result[0]
+    if stats.grade is not None and stats.exact is not None:
+        stats.gap = stats.exact - stats.grade
+    return solutions, stats
+
+def _search(chain, chords, harmonies, stats, halted, budget):
+    """ Moves the beam through the time steps of CHAIN, an unlinked
+    VoicingChain, counting the PAIRS of STATS of the time steps reached.
+    Output:
+        (list SOLUTIONS, int REACHED, int SIZE): SOLUTIONS as
+        beam_search(), the index of the last time step reached, and its
+        number of voicings.
+    """
+    if not len(chain):
+        return [], 0, 0
+    voicings = chain.step_voicings(0)
+    grade_voicing = voicing_grader(chords.get(chain.times[0]))
+    # beams[k]: [(float score, tuple voicing, int n), ...], best first: the
+    # harmonizations kept ending on VOICING at time step k, coming from
+    # the n-th one of beams[k-1]
+    beams = [_cut(stats, [(grade_voicing(voicing), voicing, None)
+                          for voicing in voicings])]
+    size = len(voicings)
+    for k in range(1, len(chain)):
+        if halted and halted():
+            return [], k - 1, size
+        if budget is not None and budget.check(size):
+            return [], k - 1, size
+        beam = beams[-1]
+        kept = [voicing for score, voicing, n in beam]
+        voicings = chain.step_voicings(k)
+        stats.pairs += size * len(voicings)
+        size = len(voicings)
+        t = chain.times[k]
+        scores, pointers = forward_scores(
+            [score for score, voicing, n in beam], kept, voicings,
+            chain.link_voicings(k - 1, kept, voicings), chords.get(t),
+            harmonies.get(t))
+        beam = _cut(stats, [(score, voicings[j], pointers[j])
+                            for j, score in enumerate(scores)
+                            if score is not None])
+        if not beam:
+            return [], k, size
+        beams.append(beam)
+    solutions = []
+    for sol_grade, voicing, n in beams[-1]:
+        solution = dict(zip(chain.variables[-1], voicing))
+        for k in range(len(beams) - 2, -1, -1):
+            score, voicing, n = beams[k][n]
+            solution.update(zip(chain.variables[k], voicing))
+        solutions.append((sol_grade, solution))
+    return solutions, len(chain) - 1, size
+
+def _count_pairs(chain, k, size):
+    """ Returns the pairs of voicings of consecutive time steps of CHAIN
+    after its time step K, of SIZE voicings.
+    """
+    pairs = 0
+    for k in range(k + 1, len(chain)):
+        voicings = len(chain.step_voicings(k))
+        pairs += size * voicings
+        size = voicings
+    return pairs
+
+def _cut(stats, beam):
+    """ Returns the WIDTH best graded harmonizations of BEAM, best first
+    (ties by voicing, the voicings of a time step being sorted).
+    """
+    beam.sort(key=lambda entry: (-entry[0], entry[1]))
+    if len(beam) > stats.width:
+        stats.pruned = True
+        del beam[stats.width:]
+    return beam
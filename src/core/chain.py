@@ -0,0 +1,824 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/chain.py
+
+Every rule of the harmony problems built by init_problem() and
+HarmonySolver looks at the voices of a single time step, or of two
+consecutive time steps. A problem is thus a chain: at each time step,
+the voicings (s, a, t, b) allowed by the rules of that time step, and
+between consecutive time steps, the pairs of voicings allowed by the
+rules linking them. Since the grader also splits into per-voicing and
+per-transition terms (see Grader.grader.voicing_grader()), the best
+harmonization is found by dynamic programming over the chain, in
+O(T * V^2) for T time steps of at most V voicings each.
+
+Main functions:
+  time_step_voicings()
+  VoicingChain()
+  IncrementalChain()
+  GradedChain()
+  viterbi()
+  forward_counts(), backward_counts()
+  iter_paths()
+  count_solutions()
+  solution_marginals(), feasible_pitches()
+  sample_solutions()
+'''
+
+import sys, random
+from bisect import bisect_right
+
+import config
+
+sys.path.append("..")
+from constraint import constraint
+from voicings import step_voicings
+from transitions import transition_matrix, csr_adjacency
+from Grader.grader import voicing_grader, transition_grader
+from util.constants import *
+
+def split_var(var):
+    """ Returns the (str voice, int time) of a CSP var, of either form
+    "s_0" (init_problem()) or "s0" (HarmonySolver).
+    """
+    return var[0], int(var[1:].lstrip("_"))
+
+def time_step_voicings(vars_, domains, rules):
+    """ Solves the problem restricted to the time step of VARS_,
+    starting from the cached voicings of its chord when its RULES are the
+    ones of a chord (see voicings.step_voicings()).
+    Input:
+        tuple VARS_: The CSP vars of the time step, in (s, a, t, b) order.
+        dict DOMAINS: Maps CSP vars to their domains.
+        list RULES: [(Constraint constraint, list variables), ...], each
+            on vars of VARS_ only.
+    Output:
+        list VOICINGS: Sorted pitch tuples, ordered as VARS_.
+    """
+    voicings = step_voicings(vars_, domains, rules)
+    if voicings is not None:
+        return voicings
+    subproblem = constraint.Problem()
+    for var in vars_:
+        subproblem.addVariable(var, list(domains[var]))
+    for constraint_, cvars in rules:
+        subproblem.addConstraint(constraint_, cvars)
+    return sorted(tuple(solution[var] for var in vars_)
+                  for solution in subproblem.getSolutionIter())
+
+def link_successors(vars_1, vars_2, voicings_1, voicings_2, rules, domains):
+    """ Returns the valid transitions from the VOICINGS_1 of a time step
+    to the VOICINGS_2 of the next one. The rules are checked on all pairs
+    at once with NumPy when possible (see transitions.transition_matrix()).
+    Input:
+        tuple VARS_1, VARS_2: The CSP vars of both time steps, in the
+            order of the pitches of their voicings.
+        list VOICINGS_1, VOICINGS_2: Lists of pitch tuples.
+        list RULES: [(Constraint constraint, list variables), ...], each
+            on vars of VARS_1 and VARS_2.
+        dict DOMAINS: Maps CSP vars to their domains.
+    Output:
+        list SUCCESSORS: SUCCESSORS[i] is the list of the indices j of the
+            voicings VOICINGS_2[j] that may follow VOICINGS_1[i].
+    """
+    if config.vectorized_transitions:
+        matrix = transition_matrix(vars_1, vars_2, voicings_1, voicings_2,
+                                   rules, domains)
+        if matrix is not None:
+            indptr, indices = csr_adjacency(matrix)
+            indptr, indices = indptr.tolist(), indices.tolist()
+            return [indices[indptr[i]:indptr[i + 1]]
+                    for i in range(len(voicings_1))]
+    successors = []
+    assignments = {}
+    for voicing_1 in voicings_1:
+        assignments.update(zip(vars_1, voicing_1))
+        valid = []
+        for j, voicing_2 in enumerate(voicings_2):
+            assignments.update(zip(vars_2, voicing_2))
+            for constraint_, cvars in rules:
+                if not constraint_(cvars, domains, assignments):
+                    break
+            else:
+                valid.append(j)
+        successors.append(valid)
+    return successors
+
+class VoicingChain(object):
+    """ The voicings of each time step of a harmony problem, and the
+    valid transitions between the voicings of consecutive time steps.
+
+    Attributes:
+        list TIMES: Time steps, in order.
+        list VARIABLES: VARIABLES[k] is the tuple of CSP vars of
+            TIMES[k], in (s, a, t, b) order.
+        list VOICINGS: VOICINGS[k] is the sorted list of the pitch tuples
+            allowed at TIMES[k], ordered as VARIABLES[k].
+        list SUCCESSORS: SUCCESSORS[k][i] is the list of the indices j of
+            the voicings VOICINGS[k+1][j] that may follow VOICINGS[k][i].
+    """
+    def __init__(self, problem, linked=True):
+        """
+        Input:
+            Problem PROBLEM: A harmony problem. Its constraints must each
+                involve one time step, or two consecutive ones.
+            bool LINKED: If False, VOICINGS and SUCCESSORS are left
+                empty until link(): the voicings of a time step are
+                enumerated when asked for, by step_voicings(), and the
+                transitions from some of them by link_voicings().
+        """
+        domains, constraints, vconstraints = problem._getArgs()
+        self.times, self.variables = [], []
+        self.voicings, self.successors = [], []
+        if not domains:
+            return
+        steps, links = self._split_rules(domains, constraints)
+        self._step_rules, self._link_rules = steps, links
+        self._domains = domains
+        if linked:
+            self.link()
+
+    def link(self, budget=None):
+        """ Enumerates the voicings of each time step, and the transitions
+        between them, of a chain built unlinked.
+        Input:
+            Budget BUDGET: Checked once per time step, counting its
+                voicings (see constraint.Budget). If it runs out, the
+                chain is left unlinked.
+        """
+        if len(self.voicings) == len(self):
+            return
+        voicings = []
+        for k in range(len(self)):
+            voicings.append(self.step_voicings(k))
+            if budget is not None and budget.check(len(voicings[k])):
+                return
+        self.voicings = voicings
+        successors = []
+        for k, rules in enumerate(self._link_rules):
+            successors.append(self._link(k, rules, self._domains))
+            if budget is not None and budget.check(len(voicings[k])):
+                self.voicings = []
+                return
+        self.successors = successors
+
+    def _split_rules(self, domains, constraints):
+        """ Sets TIMES and VARIABLES from the vars of DOMAINS, and sorts
+        the CONSTRAINTS by the time steps they involve.
+        Output:
+            (list STEPS, list LINKS): STEPS[k] are the rules of TIMES[k]
+                alone, LINKS[k] the ones linking TIMES[k] and TIMES[k+1].
+        """
+        bytime = {}
+        for var in domains:
+            voice, t = split_var(var)
+            bytime.setdefault(t, []).append(var)
+        self.times = sorted(bytime)
+        index = dict((t, k) for k, t in enumerate(self.times))
+        voice_order = lambda var: VOICE_PREFIXES.index(var[0])
+        self.variables = [tuple(sorted(bytime[t], key=voice_order))
+                          for t in self.times]
+        steps = [[] for t in self.times]
+        links = [[] for t in self.times[1:]]
+        for constraint_, vars_ in constraints:
+            ks = sorted(set(index[split_var(var)[1]] for var in vars_))
+            if len(ks) == 1:
+                steps[ks[0]].append((constraint_, vars_))
+            elif len(ks) == 2 and ks[1] == ks[0] + 1:
+                links[ks[0]].append((constraint_, vars_))
+            else:
+                raise ValueError("Constraint {0} on {1} does not follow the chain of time steps".format(constraint_, vars_))
+        return steps, links
+
+    def _link(self, k, rules, domains):
+        """ Returns the valid transitions from VOICINGS[K] to
+        VOICINGS[K+1], given the RULES linking both time steps (see
+        link_successors()).
+        """
+        return link_successors(self.variables[k], self.variables[k + 1],
+                               self.voicings[k], self.voicings[k + 1],
+                               rules, domains)
+
+    def step_voicings(self, k):
+        """ Returns VOICINGS[K], enumerated again if the chain is unlinked
+        (see time_step_voicings()).
+        """
+        if len(self.voicings) == len(self):
+            return self.voicings[k]
+        return time_step_voicings(self.variables[k], self._domains,
+                                  self._step_rules[k])
+
+    def link_voicings(self, k, voicings_1, voicings_2):
+        """ Returns the valid transitions from VOICINGS_1, some voicings of
+        TIMES[K], to VOICINGS_2, some of TIMES[K+1] (see
+        link_successors()).
+        """
+        return link_successors(self.variables[k], self.variables[k + 1],
+                               voicings_1, voicings_2, self._link_rules[k],
+                               self._domains)
+
+    def __len__(self):
+        return len(self.times)
+
+    def solution(self, path):
+        """ Returns the CSP solution (a dict mapping vars to pitches)
+        choosing voicing PATH[k] at each time step k.
+        """
+        solution = {}
+        for vars_, voicings, i in zip(self.variables, self.voicings, path):
+            solution.update(zip(vars_, voicings[i]))
+        return solution
+
+class IncrementalChain(VoicingChain):
+    """ A VoicingChain following the edits of its problem. The voicings
+    of each time step, the transitions between consecutive time steps,
+    and the forward scores of viterbi(), forward_counts() and
+    backward_counts() built on them are kept by update(), until
+    invalidate() drops the ones an edited time step changes: only those
+    are computed again.
+
+    The domains of the problem aren't preprocessed (see
+    Problem._getArgs()), so that a time step only depends on its own
+    vars and rules. Grades are cached for the chords and harmonies the
+    chain is solved with: editing one calls for invalidate() as well.
+
+    Attributes: Those of VoicingChain, and
+        int BUILT_STEPS, BUILT_LINKS: Time steps whose voicings, and
+            pairs of time steps whose transitions, the last update()
+            computed.
+    """
+    def __init__(self):
+        self.times, self.variables = [], []
+        self.voicings, self.successors = [], []
+        self.built_steps = self.built_links = 0
+        self._steps = {}     # t -> (vars, voicings)
+        self._links = {}     # (t1, t2) -> successors
+        self._forward = {}   # t -> (scores, pointers)
+        self._counts = {}    # t -> forward counts
+        self._backward = {}  # t -> counts
+
+    def invalidate(self, t):
+        """ Drops all that depends on the vars or rules of time step T:
+        its voicings, its transitions, the forward scores and counts from
+        T on and the backward counts up to T.
+        """
+        self._steps.pop(t, None)
+        for key in [key for key in self._links if t in key]:
+            del self._links[key]
+        for u in [u for u in self._forward if u >= t]:
+            del self._forward[u]
+        for u in [u for u in self._counts if u >= t]:
+            del self._counts[u]
+        for u in [u for u in self._backward if u <= t]:
+            del self._backward[u]
+
+    def invalidate_link(self, t):
+        """ Drops all that depends on the rules linking time step T to the
+        next one: their transitions, the forward scores and counts after T
+        and the backward counts up to T.
+        """
+        for key in [key for key in self._links if key[0] == t]:
+            del self._links[key]
+        for u in [u for u in self._forward if u > t]:
+            del self._forward[u]
+        for u in [u for u in self._counts if u > t]:
+            del self._counts[u]
+        for u in [u for u in self._backward if u <= t]:
+            del self._backward[u]
+
+    def clear(self):
+        self._steps.clear()
+        self._links.clear()
+        self._forward.clear()
+        self._counts.clear()
+        self._backward.clear()
+
+    def update(self, problem, budget=None):
+        """ Brings the chain up to date with PROBLEM, computing the
+        voicings and transitions invalidate() dropped.
+        Input:
+            Problem PROBLEM: A harmony problem. Its constraints must each
+                involve one time step, or two consecutive ones.
+            Budget BUDGET: Checked once per time step computed, counting
+                its voicings (see constraint.Budget). If it runs out, the
+                chain keeps what it computed so far, and must be updated
+                again before it's used.
+        Output:
+            bool UPDATED: False if BUDGET ran out.
+        """
+        domains = {}
+        for var, domain in problem._variables.iteritems():
+            domain.resetState()
+            domains[var] = domain
+        steps, links = self._split_rules(domains, problem._constraints)
+        self.built_steps = self.built_links = 0
+        self.voicings = []
+        for t, vars_, rules in zip(self.times, self.variables, steps):
+            if self._steps.get(t, (None,))[0] != vars_:
+                self.invalidate(t)
+                self._steps[t] = (vars_, time_step_voicings(vars_, domains,
+                                                            rules))
+                self.built_steps += 1
+                if budget is not None and \
+                       budget.check(len(self._steps[t][1])):
+                    return False
+            self.voicings.append(self._steps[t][1])
+        pairs = zip(self.times, self.times[1:])
+        self.successors = []
+        for k, (pair, rules) in enumerate(zip(pairs, links)):
+            if pair not in self._links:
+                self._links[pair] = self._link(k, rules, domains)
+                self.built_links += 1
+                if budget is not None and \
+                       budget.check(len(self.voicings[k])):
+                    return False
+            self.successors.append(self._links[pair])
+        # Forget the time steps, and pairs of them, that are gone
+        times = set(self.times)
+        for t in [t for t in self._steps if t not in times]:
+            self.invalidate(t)
+        pairs = set(pairs)
+        for pair in [pair for pair in self._links if pair not in pairs]:
+            del self._links[pair]
+        return True
+
+    def best(self, chords, harmonies, budget=None):
+        """ Returns viterbi() of the chain, resuming from the forward
+        scores still cached. The forward scores computed before BUDGET
+        runs out are kept.
+        """
+        if not len(self):
+            return None
+        times, forward = self.times, self._forward
+        k = 0
+        while k < len(times) and times[k] in forward:
+            k += 1
+        if not k:
+            forward[times[0]] = (_first_scores(self, chords), None)
+            k = 1
+        scores = forward[times[k - 1]][0]
+        for k in range(k, len(times)):
+            if budget is not None and budget.check(len(self.voicings[k])):
+                return None
+            scores, pointers = _forward_step(self, k, scores, chords,
+                                             harmonies)
+            forward[times[k]] = (scores, pointers)
+        return _best_path(self, scores,
+                          [forward[t][1] for t in times[1:]])
+
+    def forward_counts(self):
+        """ Returns forward_counts() of the chain, resuming from the counts
+        still cached.
+        """
+        if not len(self):
+            return []
+        times, counts = self.times, self._counts
+        k = 0
+        while k < len(times) and times[k] in counts:
+            k += 1
+        for k in range(k, len(times)):
+            if not k:
+                counts[times[k]] = [1] * len(self.voicings[k])
+            else:
+                counts[times[k]] = _count_step(counts[times[k - 1]],
+                                               self.successors[k - 1],
+                                               len(self.voicings[k]))
+        return [counts[t] for t in times]
+
+    def backward_counts(self):
+        """ Returns backward_counts() of the chain, resuming from the
+        counts still cached.
+        """
+        if not len(self):
+            return []
+        times, backward = self.times, self._backward
+        k = len(times) - 1
+        while k >= 0 and times[k] in backward:
+            k -= 1
+        for k in range(k, -1, -1):
+            if k == len(times) - 1:
+                backward[times[k]] = [1] * len(self.voicings[k])
+            else:
+                backward[times[k]] = _count_back(backward[times[k + 1]],
+                                                 self.successors[k])
+        return [backward[t] for t in times]
+
+class GradedChain(object):
+    """ The grades of the voicings and transitions of a VoicingChain.
+
+    Attributes:
+        VoicingChain CHAIN:
+        list VOICING_GRADES: VOICING_GRADES[k][j] is the grade of
+            CHAIN.VOICINGS[k][j].
+        list TRANSITION_GRADES: TRANSITION_GRADES[k][i][n] is the grade of
+            the transition from CHAIN.VOICINGS[k][i] to its n-th successor
+            CHAIN.SUCCESSORS[k][i][n].
+    """
+    def __init__(self, chain, chords, harmonies):
+        self.chain = chain
+        self.voicing_grades = []
+        for k, t in enumerate(chain.times):
+            grade_voicing = voicing_grader(chords.get(t))
+            self.voicing_grades.append([grade_voicing(voicing)
+                                        for voicing in chain.voicings[k]])
+        self.transition_grades = []
+        for k in range(1, len(chain)):
+            t = chain.times[k]
+            grade_transition = transition_grader(chords.get(t),
+                                                 harmonies.get(t))
+            voicings_1, voicings_2 = chain.voicings[k - 1], chain.voicings[k]
+            self.transition_grades.append(
+                [[grade_transition(voicings_1[i], voicings_2[j])
+                  for j in successors]
+                 for i, successors in enumerate(chain.successors[k - 1])])
+
+    def __len__(self):
+        return len(self.chain)
+
+    def best(self, penalties=None):
+        """ Finds the harmonization with the highest grade, less the
+        PENALTIES of its voicings.
+        Input:
+            list PENALTIES: PENALTIES[k] maps indices of voicings of time
+                step K to their penalty.
+        Output:
+            (float GRADE, list PATH): The grade of the harmonization,
+            without its penalties, and the index of its voicing at each
+            time step. None if there is none.
+        """
+        if not len(self.chain):
+            return None
+        penalties = penalties or [{}] * len(self.chain)
+        scores = [grade - penalties[0].get(j, 0.0)
+                  for j, grade in enumerate(self.voicing_grades[0])]
+        backpointers = []
+        for k in range(1, len(self.chain)):
+            new_scores = [None] * len(self.voicing_grades[k])
+            pointers = [None] * len(new_scores)
+            successors = self.chain.successors[k - 1]
+            for i, score in enumerate(scores):
+                if score is None:
+                    continue
+                for j, grade in zip(successors[i],
+                                    self.transition_grades[k - 1][i]):
+                    s = score + grade
+                    if new_scores[j] is None or s > new_scores[j]:
+                        new_scores[j] = s
+                        pointers[j] = i
+            for j, score in enumerate(new_scores):
+                if score is not None:
+                    new_scores[j] = (score + self.voicing_grades[k][j]
+                                     - penalties[k].get(j, 0.0))
+            scores = new_scores
+            backpointers.append(pointers)
+        reached = [j for j, score in enumerate(scores) if score is not None]
+        if not reached:
+            return None
+        j = max(reached, key=lambda j: scores[j])
+        path = [j]
+        for pointers in reversed(backpointers):
+            j = pointers[j]
+            path.append(j)
+        path.reverse()
+        return self.grade(path), path
+
+    def grade(self, path):
+        """ Returns the grade of the harmonization PATH, summed in the
+        order of viterbi().
+        """
+        total = self.voicing_grades[0][path[0]]
+        for k in range(1, len(path)):
+            n = self.chain.successors[k - 1][path[k - 1]].index(path[k])
+            total += self.transition_grades[k - 1][path[k - 1]][n]
+            total += self.voicing_grades[k][path[k]]
+        return total
+
+def viterbi(chain, chords, harmonies, budget=None):
+    """ Finds the harmonization of CHAIN with the highest grade.
+    Input:
+        VoicingChain CHAIN:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        Budget BUDGET: Checked once per time step, counting its voicings
+            (see constraint.Budget).
+    Output:
+        (float GRADE, dict SOLUTION), or None if there is no solution, or
+        BUDGET ran out before the last time step.
+    """
+    if not len(chain):
+        return None
+    scores = _first_scores(chain, chords)
+    backpointers = []
+    for k in range(1, len(chain)):
+        if budget is not None and budget.check(len(chain.voicings[k])):
+            return None
+        scores, pointers = _forward_step(chain, k, scores, chords, harmonies)
+        backpointers.append(pointers)
+    return _best_path(chain, scores, backpointers)
+
+def _first_scores(chain, chords):
+    """ Returns the grades of the voicings of the first time step. """
+    grade_voicing = voicing_grader(chords.get(chain.times[0]))
+    return [grade_voicing(voicing) for voicing in chain.voicings[0]]
+
+def _forward_step(chain, k, scores, chords, harmonies):
+    """ Extends the best SCORES of the harmonizations ending on each
+    voicing of time step K-1 to time step K.
+    Output:
+        (list SCORES, list POINTERS): SCORES[j] is the best grade of the
+            harmonizations ending on CHAIN.VOICINGS[K][j] (None if there
+            is none), and POINTERS[j] the voicing of time step K-1 they
+            come from.
+    """
+    t = chain.times[k]
+    return forward_scores(scores, chain.voicings[k - 1], chain.voicings[k],
+                          chain.successors[k - 1], chords.get(t),
+                          harmonies.get(t))
+
+def forward_scores(scores, voicings_1, voicings_2, successors, chord_2,
+                   harmony_2):
+    """ Extends the best SCORES of the harmonizations ending on each of
+    VOICINGS_1 to the VOICINGS_2 of the next time step, on CHORD_2 with
+    harmony HARMONY_2, along SUCCESSORS (see link_successors()).
+    Output:
+        (list SCORES, list POINTERS): As _forward_step().
+    """
+    grade_voicing = voicing_grader(chord_2)
+    grade_transition = transition_grader(chord_2, harmony_2)
+    new_scores = [None] * len(voicings_2)
+    pointers = [None] * len(voicings_2)
+    for i, score in enumerate(scores):
+        if score is None:
+            continue
+        voicing_1 = voicings_1[i]
+        for j in successors[i]:
+            s = score + grade_transition(voicing_1, voicings_2[j])
+            if new_scores[j] is None or s > new_scores[j]:
+                new_scores[j] = s
+                pointers[j] = i
+    for j, score in enumerate(new_scores):
+        if score is not None:
+            new_scores[j] = score + grade_voicing(voicings_2[j])
+    return new_scores, pointers
+
+def _best_path(chain, scores, backpointers):
+    """ Follows BACKPOINTERS from the best of the SCORES of the last time
+    step, in the output format of viterbi().
+    """
+    reached = [(score, j) for j, score in enumerate(scores)
+               if score is not None]
+    if not reached:
+        return None
+    best, j = max(reached, key=lambda pair: pair[0])
+    path = [j]
+    for pointers in reversed(backpointers):
+        j = pointers[j]
+        path.append(j)
+    path.reverse()
+    return best, chain.solution(path)
+
+def forward_counts(chain):
+    """ Returns COUNTS, where COUNTS[k][j] is the number of valid
+    harmonizations of CHAIN.TIMES[:k+1] ending on CHAIN.VOICINGS[k][j].
+    """
+    if not len(chain):
+        return []
+    counts = [[1] * len(chain.voicings[0])]
+    for successors in chain.successors:
+        counts.append(_count_step(counts[-1], successors,
+                                  len(chain.voicings[len(counts)])))
+    return counts
+
+def backward_counts(chain):
+    """ Returns COUNTS, where COUNTS[k][i] is the number of valid
+    harmonizations of CHAIN.TIMES[k:] starting on CHAIN.VOICINGS[k][i].
+    """
+    if not len(chain):
+        return []
+    counts = [[1] * len(chain.voicings[-1])]
+    for successors in reversed(chain.successors):
+        counts.append(_count_back(counts[-1], successors))
+    counts.reverse()
+    return counts
+
+def _count_back(following, successors):
+    """ Pulls the counts FOLLOWING of a time step back along SUCCESSORS. """
+    return [sum([following[j] for j in valid]) for valid in successors]
+
+def iter_paths(chain, first, counts=None):
+    """ Yields the paths (lists of voicing indices, see
+    VoicingChain.solution()) of CHAIN starting on CHAIN.VOICINGS[0][FIRST],
+    in lexicographic order. Only voicings with harmonizations left are
+    followed, so no path is ever abandoned.
+    Input:
+        VoicingChain CHAIN:
+        int FIRST:
+        list COUNTS: backward_counts() of CHAIN, if already known.
+    """
+    if counts is None:
+        counts = backward_counts(chain)
+    if not counts[0][first]:
+        return
+    last = len(chain) - 1
+    path = [first]
+    if not last:
+        yield list(path)
+        return
+    stack = [iter(chain.successors[0][first])]
+    while stack:
+        k = len(path)
+        for j in stack[-1]:
+            if not counts[k][j]:
+                continue
+            path.append(j)
+            if k == last:
+                yield list(path)
+                path.pop()
+                continue
+            stack.append(iter(chain.successors[k][j]))
+            break
+        else:
+            stack.pop()
+            path.pop()
+
+def _count_step(counts, successors, size):
+    """ Pushes the COUNTS of a time step along SUCCESSORS. """
+    new_counts = [0] * size
+    for count, valid in zip(counts, successors):
+        if count:
+            for j in valid:
+                new_counts[j] += count
+    return new_counts
+
+def count_solutions(problem):
+    """ Counts the solutions of a harmony problem without listing them,
+    by passing the counts of forward_counts() along the chain. Python
+    ints don't overflow, so the count is exact.
+    Input:
+        Problem PROBLEM: Or its VoicingChain.
+    Output:
+        int COUNT.
+    """
+    if isinstance(problem, VoicingChain):
+        chain = problem
+    else:
+        chain = VoicingChain(problem)
+    if not len(chain):
+        return 0
+    counts = [1] * len(chain.voicings[0])
+    for k, successors in enumerate(chain.successors):
+        counts = _count_step(counts, successors, len(chain.voicings[k + 1]))
+    return sum(counts)
+
+def solution_marginals(problem):
+    """ Counts, for every CSP var and pitch, the solutions of a harmony
+    problem where the var takes the pitch, without listing them: the
+    solutions through a voicing are the harmonizations ending on it (see
+    forward_counts()) times the ones starting on it (see
+    backward_counts()). An IncrementalChain resumes from the counts it
+    keeps, so that after an edit (e.g. a figure, see
+    add_figure_constraints()) only the counts it changes are computed
+    again.
+    Input:
+        Problem PROBLEM: Or its VoicingChain.
+    Output:
+        dict MARGINALS: Maps CSP vars to dicts mapping pitches to their
+            number of solutions. The pitches of the voicings no solution
+            goes through map to 0.
+    """
+    if isinstance(problem, VoicingChain):
+        chain = problem
+    else:
+        chain = VoicingChain(problem)
+    if isinstance(chain, IncrementalChain):
+        forward, backward = chain.forward_counts(), chain.backward_counts()
+    else:
+        forward, backward = forward_counts(chain), backward_counts(chain)
+    marginals = {}
+    for vars_, voicings, counts_1, counts_2 in zip(chain.variables,
+                                                   chain.voicings,
+                                                   forward, backward):
+        step = [{} for var in vars_]
+        for voicing, count_1, count_2 in zip(voicings, counts_1, counts_2):
+            through = count_1 * count_2
+            for pitches, pitch in zip(step, voicing):
+                pitches[pitch] = pitches.get(pitch, 0) + through
+        marginals.update(zip(vars_, step))
+    return marginals
+
+def feasible_pitches(problem):
+    """ Returns the pitches each CSP var of a harmony problem takes in some
+    solution (see solution_marginals()).
+    Output:
+        dict PITCHES: Maps CSP vars to sorted lists of pitches.
+    """
+    return dict((var, sorted(pitch for pitch, count in counts.iteritems()
+                             if count))
+                for var, counts in solution_marginals(problem).iteritems())
+
+class ChainSampler(object):
+    """ Draws harmonizations of a VoicingChain uniformly at random. The
+    first voicing is drawn in proportion to the number of harmonizations
+    starting on it, and each next one in proportion to the number of
+    harmonizations it continues with (see backward_counts()), so that
+    every harmonization is drawn with probability 1 / TOTAL. The counts
+    are exact, and so are the draws. A draw then costs O(T log V), for T
+    time steps of at most V voicings.
+
+    Attributes:
+        VoicingChain CHAIN:
+        int TOTAL: Number of harmonizations of CHAIN.
+        Random RANDOM: The source of the draws.
+    """
+    def __init__(self, chain, counts=None, seed=None):
+        """
+        Input:
+            VoicingChain CHAIN:
+            list COUNTS: backward_counts() of CHAIN, if already known.
+            SEED: Seed of RANDOM (see random.seed()). The same SEED draws
+                the same harmonizations.
+        """
+        if counts is None:
+            counts = backward_counts(chain)
+        self.chain = chain
+        self.random = random.Random(seed)
+        self.total = sum(counts[0]) if counts else 0
+        self._first = _cumulative(counts[0]) if counts else []
+        # _next[k][i]: cumulative counts of CHAIN.SUCCESSORS[k][i]
+        self._next = []
+        for k, successors in enumerate(chain.successors):
+            following = counts[k + 1]
+            self._next.append([_cumulative([following[j] for j in valid])
+                               if counts[k][i] else None
+                               for i, valid in enumerate(successors)])
+
+    def sample_path(self):
+        """ Returns the path (see VoicingChain.solution()) of a random
+        harmonization, or None if there is none.
+        """
+        if not self.total:
+            return None
+        i = bisect_right(self._first, self.random.randrange(self.total))
+        path = [i]
+        for k, cumulative in enumerate(self._next):
+            n = bisect_right(cumulative[i],
+                             self.random.randrange(cumulative[i][-1]))
+            i = self.chain.successors[k][i][n]
+            path.append(i)
+        return path
+
+    def sample(self):
+        """ Returns a random harmonization as a CSP solution, or None if
+        there is none.
+        """
+        path = self.sample_path()
+        return path and self.chain.solution(path)
+
+def _cumulative(counts):
+    """ Returns the running sums of COUNTS. """
+    total = 0
+    sums = []
+    for count in counts:
+        total += count
+        sums.append(total)
+    return sums
+
+def sample_solutions(problem, n, seed=None, chain=None):
+    """ Draws N solutions of a harmony problem uniformly at random, with
+    replacement (see ChainSampler).
+    Input:
+        Problem PROBLEM:
+        int N:
+        SEED: The same SEED draws the same solutions.
+        VoicingChain CHAIN: The chain of PROBLEM, if already built. The
+            backward counts an IncrementalChain keeps are reused.
+    Output:
+        list SOLUTIONS: N dicts mapping vars to pitches, or [] if PROBLEM
+            has no solution.
+    """
+    if chain is None:
+        chain = VoicingChain(problem)
+    counts = None
+    if isinstance(chain, IncrementalChain):
+        counts = chain.backward_counts()
+    sampler = ChainSampler(chain, counts, seed)
+    if not sampler.total:
+        return []
+    return [sampler.sample() for i in xrange(n)]
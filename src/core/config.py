@@ -16,8 +16,147 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+
 debugging_options = {"show_features" : 0, "show_results" : 0, "write_file" : 0, "track_grade" : 0, \
                      "old_constraint" : 0}
 debug = 0
 
 test_name = None
+
+# Replace the harmony rules of a problem by constraint.TableConstraint's
+# (see harmony_rules.tabulate_constraints()). Rules whose domains have
+# more than table_max_tuples combinations keep calling their function.
+table_constraints = False
+table_max_tuples = 10000
+
+# Prune the voice domains of a problem with constraint.doArc2001() before
+# searching: pitches that can't be part of any solution are dropped once
+# instead of being rediscovered at every node.
+arc_consistency = False
+
+# Search the voice domains as constraint.BitsetDomain's: hiding, restoring
+# and counting pitches take constant time. The solutions are the same,
+# but they aren't found in the same order, so the "csp" engine may grade
+# other ones among its first num_solutions.
+bitset_domains = False
+
+# Let the harmony rules prune all of their unassigned voices during the
+# search (see harmony_rules.propagate_constraints()). Each pruning pass
+# stops after gac_max_checks calls to the rule.
+gac_constraints = False
+gac_max_checks = 1000
+
+# Search engine used by HarmonySolver.solveProblem() and the CLI:
+#   "csp": enumerate solutions with constraint.py, then grade them.
+#   "parallel": split the "csp" search across parallel_workers processes
+#          by the voicing of the first chord (see parallel.py). Each
+#          voicing contributes its first solutions: they aren't the
+#          ones "csp" finds first.
+#   "dp":  find the best graded solution by dynamic programming over the
+#          chain of time steps (see chain.viterbi()).
+#   "bnb": find the bnb_solutions best graded solutions by branch and
+#          bound (see constraint.BranchAndBoundSolver). The search stops
+#          after bnb_max_nodes values were tried; the solutions are then
+#          the best found so far.
+#   "beam": keep the beam_width best graded harmonizations from one time
+#          step to the next (see beam.py): approximate, for progressions
+#          too long for the other engines. The gap to the best grade is
+#          reported when the "dp" engine checks at most
+#          beam_exact_max_pairs pairs of voicings.
+engine = "csp"
+# The "csp" engine grades the first num_solutions solutions it finds, in
+# HarmonySolver and in --batch mode: enumerating them all takes too long.
+num_solutions = 200
+ENGINES = ("csp", "parallel", "dp", "beam", "bnb")
+bnb_solutions = 10
+bnb_max_nodes = 200000
+beam_width = 64
+beam_exact_max_pairs = 2000000
+
+# Voicings (s, a, t, b) of a chord allowed by the rules of its time step
+# are enumerated once and cached (see voicings.VoicingCache), keeping
+# the voicing_cache_size most recently used chords. With voicing_tables,
+# init_problem() also replaces those rules by a single table constraint
+# per time step (see voicings.tabulate_voicings()). With
+# voicing_transpositions, the voicings of a chord are transposed from the
+# ones of a transposition of it already cached, instead of enumerated
+# (see voicings.transpose_voicings()).
+voicing_cache_size = 256
+voicing_tables = False
+voicing_transpositions = True
+
+# Check the rules between consecutive time steps on all pairs of voicings
+# at once with NumPy (see transitions.transition_matrix()), when NumPy is
+# installed.
+vectorized_transitions = True
+
+# The "parallel" engine splits its search across parallel_workers
+# processes (0: one per CPU), by the voicing of the first chord (see
+# parallel.solve_parallel()). Each task searches the subtrees of
+# parallel_chunksize voicings.
+parallel_workers = 0
+parallel_chunksize = 4
+
+# With diverse_solutions, HarmonySolver.solveProblem() returns diverse_k
+# high graded solutions, any two of which differ in at least
+# diverse_distance time steps: in their voicing, or with diverse_metric
+# "soprano", in their soprano (see diverse.py). The search for each
+# solution gives up after diverse_max_rounds rounds.
+diverse_solutions = False
+diverse_k = 10
+diverse_distance = 2
+diverse_metric = "voicing"
+DIVERSE_METRICS = ("voicing", "soprano")
+diverse_max_rounds = 64
+
+# With ranked_solutions, the "Next solution..." and "Previous solution..."
+# buttons of the GUI browse all the solutions, from the best graded to
+# the worst, each ranked once asked for (see kbest.py and
+# HarmonySolver.ranked_solution()).
+ranked_solutions = False
+
+# With incremental_resolve, the GUI solves a problem it already solved
+# with the "csp" engine again with "dp" after an edit: the voicings and
+# transitions of HarmonySolver.chain are only rebuilt for the time steps
+# edited, where "csp" searches the whole problem again (see
+# HarmonySolver.resolveEngine()).
+incremental_resolve = True
+
+# Batch mode of the CLI (--batch, see batch.py): problem files are solved
+# by batch_workers processes (0: one per CPU), each within batch_timeout
+# seconds (0: no limit), keeping its batch_solutions best graded
+# solutions.
+batch_workers = 0
+batch_timeout = 60
+batch_solutions = 5
+
+# Budgets of the searches (see constraint.Budget), None for no limit:
+# wall-clock seconds, values tried, and megabytes the resident memory of
+# the process may grow by. Once one is spent, the search stops with the
+# solutions found so far, flagged with the budget spent (see
+# HarmonySolver.spent and anytime.solve_within()). The "csp" and "bnb"
+# engines check them at every value tried, the "dp" and "beam" engines
+# once per time step, counting its voicings, the "parallel" engine once
+# per subtree, counting its solutions, and diverse solutions once per
+# round. The "dp" and "beam" engines have no solution until their last
+# time step.
+time_budget = None
+node_budget = None
+memory_budget = None
+
+# With solution_cache, the ranked solutions and solution counts of the
+# problems solved are kept in an SQLite database under cache_dir (see
+# solution_cache.py), whose least recently used entries are evicted once
+# they take more than cache_max_size megabytes. Entries are dropped when
+# the rules or the grader change.
+solution_cache = False
+cache_dir = os.path.join(os.path.expanduser("~"), ".fourvoices")
+cache_max_size = 64
+
+# Online mode of the CLI (--online, see online.py): the alto, tenor and
+# bass of a time step are decided once online_lookahead more time steps
+# of the soprano line were received. The soprano is read from MIDI
+# channel online_soprano_channel.
+online_lookahead = 2
+online_soprano_channel = 0
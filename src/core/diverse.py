@@ -0,0 +1,162 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/diverse.py
+
+Finds K high graded solutions, any two of which differ in at least
+DISTANCE time steps: in their voicing (metric "voicing"), or in their
+soprano (metric "soprano"). Solutions listed by the search differ in
+their last time steps only, and the best graded ones are often as
+close: diverse solutions are found on the chain of time steps (see
+chain.py) instead.
+
+Solutions are found one after the other, each by dynamic programming
+over the chain, where the voicings shared with a solution found before
+are penalized (the Lagrangian relaxation of "diverse M-best"). The
+penalty of a solution doubles until the best penalized harmonization
+is at least DISTANCE time steps away from it. The grades of the
+voicings and transitions are computed once (see chain.GradedChain), so
+that each round is a pass of additions over the chain.
+
+The solutions found are each the best graded one for the penalties
+they were found with, but may not be the best graded diverse ones: the
+search stops after config.diverse_max_rounds rounds without a solution
+far enough from all the others.
+
+Main functions:
+  solution_distance()
+  diverse_solutions()
+'''
+
+import config
+from chain import VoicingChain, GradedChain
+
+def _voicing_key(voicing):
+    return voicing
+
+def _soprano_key(voicing):
+    return voicing[0]
+
+METRIC_KEYS = {"voicing": _voicing_key, "soprano": _soprano_key}
+
+def solution_distance(solution_1, solution_2, metric=None):
+    """ Returns the number of time steps where two solutions differ, in
+    their voicing or their soprano.
+    Input:
+        dict SOLUTION_1, SOLUTION_2: Solutions of the same problem.
+        str METRIC: "voicing" or "soprano". Defaults to
+            config.diverse_metric.
+    """
+    voices = "satb" if (metric or config.diverse_metric) == "voicing" else "s"
+    times = set(var[1:] for var in solution_1)
+    return len([1 for t in times
+                if [1 for voice in voices
+                    if solution_1[voice + t] != solution_2[voice + t]]])
+
+def diverse_solutions(problem, chords, harmonies, k=None, distance=None,
+                      metric=None, chain=None, halted=None, budget=None):
+    """ Finds K high graded solutions of PROBLEM, any two of which differ
+    in at least DISTANCE time steps (see the documentation of this
+    module).
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        int K: Defaults to config.diverse_k.
+        int DISTANCE: At least 1. Defaults to config.diverse_distance.
+        str METRIC: "voicing" or "soprano". Defaults to
+            config.diverse_metric.
+        VoicingChain CHAIN: The chain of PROBLEM, if already built.
+        function HALTED: Called between rounds. If it returns True, the
+            solutions found so far are returned.
+        Budget BUDGET: Checked once per round, counting the voicings of
+            the chain, and once per time step while CHAIN is built (see
+            constraint.Budget). If it runs out, the solutions found so far
+            are returned.
+    Output:
+        list SOLUTIONS: [(float grade, dict solution), ...], best first.
+            The first one is the best graded solution of PROBLEM. Fewer
+            than K if no more were found.
+    """
+    k = config.diverse_k if k is None else k
+    distance = max(1, config.diverse_distance if distance is None
+                   else distance)
+    key = METRIC_KEYS[metric or config.diverse_metric]
+    if chain is None:
+        chain = VoicingChain(problem, linked=False)
+        chain.link(budget)
+        if budget is not None and budget.spent:
+            return []
+    graded = GradedChain(chain, chords, harmonies)
+    result = graded.best()
+    if result is None or k < 1:
+        return []
+    # Voicings of each time step, by key
+    by_key = []
+    for voicings in chain.voicings:
+        indices = {}
+        for j, voicing in enumerate(voicings):
+            indices.setdefault(key(voicing), []).append(j)
+        by_key.append(indices)
+    # Starting penalty: a small share of the mean grade of a time step,
+    # so that the solutions found are barely DISTANCE apart
+    start = (abs(result[0]) + 1.0) / len(chain) / 64
+    size = sum(len(voicings) for voicings in chain.voicings)
+    found = [result]
+    found_keys = [_path_keys(chain, result[1], key)]
+    while len(found) < k:
+        lambdas = [0.0] * len(found)
+        for round_ in range(config.diverse_max_rounds):
+            if halted and halted():
+                return _solutions(chain, found)
+            if budget is not None and budget.check(size):
+                return _solutions(chain, found)
+            penalties = [{} for voicings in chain.voicings]
+            for lambda_, keys in zip(lambdas, found_keys):
+                if not lambda_:
+                    continue
+                for t, step_key in enumerate(keys):
+                    for j in by_key[t][step_key]:
+                        penalties[t][j] = penalties[t].get(j, 0.0) + lambda_
+            result = graded.best(penalties)
+            keys = _path_keys(chain, result[1], key)
+            close = [f for f, other in enumerate(found_keys)
+                     if _distance(keys, other) < distance]
+            if not close:
+                found.append(result)
+                found_keys.append(keys)
+                break
+            for f in close:
+                lambdas[f] = lambdas[f] * 2 or start
+        else:
+            break
+    return _solutions(chain, found)
+
+def _path_keys(chain, path, key):
+    return [key(chain.voicings[t][j]) for t, j in enumerate(path)]
+
+def _distance(keys_1, keys_2):
+    return len([1 for key_1, key_2 in zip(keys_1, keys_2) if key_1 != key_2])
+
+def _solutions(chain, found):
+    """ Returns the (grade, path) of FOUND as solutions, best first. """
+    solutions = [(sol_grade, chain.solution(path))
+                 for sol_grade, path in found]
+    solutions.sort(key=lambda pair: -pair[0])
+    return solutions
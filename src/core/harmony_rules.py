@@ -39,16 +39,67 @@ class HarmonyConstraint(constraint.FunctionConstraint):
     def __repr__(self):
         return self.name
 
+class HarmonyTableConstraint(constraint.TableConstraint):
+    """ A HarmonyConstraint answered from its table of allowed pitch
+    tuples, built when the problem is preprocessed.
+    """
+    def __init__(self, harmony_constraint, maxtuples):
+        self.name = harmony_constraint.name
+        self.rule = harmony_constraint
+        constraint.TableConstraint.__init__(self, harmony_constraint._func,
+                                            maxtuples)
+    def __str__(self):
+        return self.name
+    def __repr__(self):
+        return self.name
+
+def tabulate_constraints(problem, maxtuples):
+    """ Replaces every HarmonyConstraint of PROBLEM by the equivalent
+    HarmonyTableConstraint. Harmony rules only look at the pitches they
+    are given (chords are bound when the rule is created), so their
+    tables can be enumerated once over the domains.
+    Input:
+        Problem PROBLEM:
+        int MAXTUPLES: Rules with more pitch combinations than this
+            keep calling their function.
+    Output:
+        Problem PROBLEM.
+    """
+    constraints = problem._constraints
+    for i, (constraint_, variables) in enumerate(constraints):
+        if isinstance(constraint_, HarmonyConstraint):
+            constraints[i] = (HarmonyTableConstraint(constraint_, maxtuples),
+                              variables)
+    return problem
+
+def propagate_constraints(problem, maxchecks):
+    """ Turns on generalized arc consistency for every HarmonyConstraint
+    of PROBLEM: forward checking then prunes the other voices of a rule
+    as soon as one of them is assigned, instead of waiting for a single
+    unassigned voice.
+    Input:
+        Problem PROBLEM:
+        int MAXCHECKS: Support checks allowed to each pruning pass.
+    Output:
+        Problem PROBLEM.
+    """
+    for constraint_, variables in problem._constraints:
+        if isinstance(constraint_, HarmonyConstraint):
+            constraint_.setGAC(True, maxchecks)
+    return problem
+
 class SpecifyChordConstraint(HarmonyConstraint):
     def __init__(self, chord):
         name = "specifyChord_" + str(chord.time)
         func = specifyChord(chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, func, name)
 
 class SetBassConstraint(HarmonyConstraint):
     def __init__(self, chord):
         name = "setBass_" + str(chord.time)
         func = setBass(chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, func, name)
 
 class ParallelFifthConstraint(HarmonyConstraint):
@@ -79,18 +130,21 @@ class SeventhConstraint(HarmonyConstraint):
     def __init__(self, chord):
         name = "seventh_" + str(chord.time)
         func = handleSevenths(chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, func, name)
 
 class LeadingToneConstraint(HarmonyConstraint):
     def __init__(self, chord):
         name = "leadingTone_" + str(chord.time)
         func = handleLeadingTone(chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, func, name)
 
 class DiminishedFifthConstraint(HarmonyConstraint):
     def __init__(self, chord):
         name = "diminishedFifth_" + str(chord.time)
         func = handleDiminishedFifths(chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, func, name)
 
 class SpacingConstraint(HarmonyConstraint):
@@ -114,6 +168,7 @@ class TemporalOverlapConstraint(HarmonyConstraint):
 class FullDiminishedRootConstraint(HarmonyConstraint):
     def __init__(self, chord):
         f = lambda v0, v1: handle_fulldimroot(v0, v1, chord)
+        self.chord = chord
         HarmonyConstraint.__init__(self, f, "fulldimroot")
 
 # Need to make sure that the correct notes of the chord are hit.
@@ -0,0 +1,185 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/kbest.py
+
+Ranks the solutions of a harmony problem by grade, best first, each
+computed only once asked for (the --ranked option of the CLI, and the
+"Next solution..." button of the GUI with config.ranked_solutions).
+
+The solutions are the paths of the chain of time steps (see chain.py),
+ranked by the recursive enumeration algorithm (REA) of Jimenez and
+Marzal. Each voicing keeps the ranked harmonizations ending on it,
+starting with the best one, found by viterbi(). The next one of a
+voicing is the best of its candidates: the best harmonization ending
+on each other voicing before it, and the next one ending on the voicing
+before it its last harmonization comes from, computed the same way.
+The n-th solution then costs O(T log(V + n)) past the first, for T time
+steps of at most V voicings.
+
+Main functions:
+  KBestPaths()
+  iter_ranked()
+'''
+
+from heapq import heappush, heappop
+from itertools import count
+
+from chain import VoicingChain, GradedChain
+
+class KBestPaths(object):
+    """ The paths (see VoicingChain.solution()) of a GradedChain, ranked
+    by grade.
+
+    The harmonizations ending on each voicing are kept as (float score,
+    int i, int r, float edge): the r-th harmonization ending on voicing i
+    of the time step before, followed along a transition graded EDGE. A
+    last time step, whose only voicing follows all the voicings of the
+    last time step of the chain, ends the solutions.
+    """
+    def __init__(self, graded):
+        self.graded = graded
+        chain = graded.chain
+        size = len(chain)
+        # _preds[k][j]: [(int i, float edge), ...], for k >= 1
+        self._preds = [None]
+        for k in range(1, size):
+            preds = [[] for voicing in chain.voicings[k]]
+            for i, successors in enumerate(chain.successors[k - 1]):
+                for j, edge in zip(successors,
+                                   graded.transition_grades[k - 1][i]):
+                    preds[j].append((i, edge))
+            self._preds.append(preds)
+        self._grades = list(graded.voicing_grades)
+        if size:
+            self._preds.append([[(i, 0.0) for i in
+                                 range(len(chain.voicings[-1]))]])
+            self._grades.append([0.0])
+        # The best harmonization ending on each voicing, as in viterbi()
+        self._paths = []
+        self._heaps = []
+        self._done = []
+        for k, grades in enumerate(self._grades):
+            paths = []
+            for j, grade in enumerate(grades):
+                if not k:
+                    paths.append([(grade, None, None, None)])
+                    continue
+                best = None
+                for i, edge in self._preds[k][j]:
+                    before = self._paths[k - 1][i]
+                    if before:
+                        s = before[0][0] + edge
+                        if best is None or s > best[0]:
+                            best = (s, i, 0, edge)
+                paths.append([] if best is None else
+                             [(best[0] + grade,) + best[1:]])
+            self._paths.append(paths)
+            self._heaps.append([None] * len(grades))
+            self._done.append([not k or not ranked for ranked in paths])
+
+    def __len__(self):
+        """ Returns the number of paths ranked so far. """
+        return len(self._paths[-1][0]) if self._paths else 0
+
+    def get(self, n):
+        """ Returns the N-th best path (from 0), ranking the paths up to it
+        if they aren't yet.
+        Output:
+            (float GRADE, list PATH), or None if there are N paths or less.
+        """
+        if not self._paths:
+            return None
+        last = len(self._paths) - 1
+        self._rank(last, 0, n)
+        ranked = self._paths[last][0]
+        if len(ranked) <= n:
+            return None
+        entry = ranked[n]
+        path = []
+        for k in range(last, 0, -1):
+            i, r = entry[1], entry[2]
+            path.append(i)
+            entry = self._paths[k - 1][i][r]
+        path.reverse()
+        return ranked[n][0], path
+
+    def _rank(self, k, j, n):
+        """ Ranks the harmonizations ending on voicing J of time step K up
+        to the N-th one. The next harmonization of a voicing waits on the
+        next one of the voicing before it, and so on: the chain of
+        voicings waiting is ranked from its first one, without recursion.
+        """
+        ranked = self._paths[k][j]
+        while len(ranked) <= n and not self._done[k][j]:
+            waiting = [(k, j)]
+            while True:
+                kk, jj = waiting[-1]
+                score, i, r, edge = self._paths[kk][jj][-1]
+                if len(self._paths[kk - 1][i]) > r + 1 or \
+                   self._done[kk - 1][i]:
+                    break
+                waiting.append((kk - 1, i))
+            for kk, jj in reversed(waiting):
+                self._next(kk, jj)
+
+    def _next(self, k, j):
+        """ Ranks the next harmonization ending on voicing J of time step
+        K, once the one its last harmonization waits on is ranked.
+        """
+        ranked = self._paths[k][j]
+        before = self._paths[k - 1]
+        grade = self._grades[k][j]
+        heap = self._heaps[k][j]
+        if heap is None:
+            heap = self._heaps[k][j] = []
+            first = ranked[0][1]
+            for i, edge in self._preds[k][j]:
+                if i != first and before[i]:
+                    heappush(heap, (-(before[i][0][0] + edge + grade),
+                                    i, 0, edge))
+        score, i, r, edge = ranked[-1]
+        if len(before[i]) > r + 1:
+            heappush(heap, (-(before[i][r + 1][0] + edge + grade),
+                            i, r + 1, edge))
+        if not heap:
+            self._done[k][j] = True
+            return
+        score, i, r, edge = heappop(heap)
+        ranked.append((-score, i, r, edge))
+
+def iter_ranked(problem, chords, harmonies, chain=None):
+    """ Yields the solutions of PROBLEM, best graded first, each computed
+    once the one before it was yielded.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        VoicingChain CHAIN: The chain of PROBLEM, if already built.
+    Output:
+        Yields (float GRADE, dict SOLUTION).
+    """
+    if chain is None:
+        chain = VoicingChain(problem)
+    ranking = KBestPaths(GradedChain(chain, chords, harmonies))
+    for n in count():
+        result = ranking.get(n)
+        if result is None:
+            return
+        yield result[0], chain.solution(result[1])
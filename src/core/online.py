@@ -0,0 +1,387 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/online.py
+
+Harmonizes a soprano line while it is played (the --online option of
+the CLI). Chords and soprano notes arrive one time step at a time, and
+the alto, tenor and bass of a time step are decided once LOOKAHEAD more
+time steps arrived.
+
+The harmonizer only keeps the forward scores (see chain.viterbi()) of
+the time steps not decided yet, and the voicing of the last one
+decided: each time step costs the same, however long the line. When a
+time step is decided, its best voicing given the ones after it is
+kept, and the time steps after it are scored again from it alone. With
+a LOOKAHEAD as long as the line, the harmonization is the one of
+viterbi().
+
+The front end is a MidiOutStream event handler (HarmonizerStream),
+under any source of MIDI events: an EventDispatcher reading a MIDI port
+(MidiInStream), or MidiFileInStream, which stands in for a port by
+reading a MIDI file. The tracks of a type 1 file, e.g. chord symbols in
+one and the soprano in another, are merged by time as a port would
+deliver them.
+  - Chord symbols are text events (text, marker or lyric), written as
+    the lines of the [Chords] section of problem files without their
+    time: "<root>, <role>, <bass>, <modifiers>", e.g. "G, V, B, 7".
+  - Each note on the soprano channel is the soprano of a new time step,
+    on the last chord symbol received.
+
+Main functions:
+  OnlineHarmonizer()
+  HarmonizerStream()
+  MidiFileInStream()
+  harmonize_midifile()
+'''
+
+import sys, time
+
+import config
+from solver import link_rules, make_var, parse_chord
+from chain import link_successors, forward_scores
+from voicings import VOICE_RANGES, chord_voicings
+
+sys.path.append("..")
+from Grader.grader import voicing_grader
+from util.constants import *
+from mxm_Python_MIDI.MidiOutStream import MidiOutStream
+from mxm_Python_MIDI.MidiInStream import MidiInStream
+from mxm_Python_MIDI.MidiInFile import MidiInFile
+
+VARS_1 = tuple(make_var(voice, 0) for voice in VOICE_PREFIXES)
+VARS_2 = tuple(make_var(voice, 1) for voice in VOICE_PREFIXES)
+
+def soprano_voicings(chord, soprano):
+    """ Returns the voicings of CHORD singing SOPRANO, which may be out of
+    the soprano range.
+    Output:
+        list VOICINGS: Sorted (int s, int a, int t, int b) tuples.
+    """
+    if soprano in VOICE_RANGES["s"]:
+        return [voicing for voicing in chord_voicings(chord)
+                if voicing[0] == soprano]
+    ranges = dict(VOICE_RANGES)
+    ranges["s"] = [soprano]
+    return list(chord_voicings(chord, ranges))
+
+class _Step(object):
+    """ A time step of an OnlineHarmonizer: its VOICINGS, the SUCCESSORS
+    leading to them from the time step before, and the best SCORES of
+    the harmonizations ending on each, with the POINTERS to the voicings
+    of the time step before they come from.
+    """
+    def __init__(self, time, chord, harmony, voicings):
+        self.time = time
+        self.chord = chord
+        self.harmony = harmony
+        self.voicings = voicings
+        self.successors = None
+        self.scores = None
+        self.pointers = None
+
+class OnlineHarmonizer(object):
+    """ Decides the voicing of each time step of a soprano line LOOKAHEAD
+    time steps after it was received (see the documentation of this
+    module).
+
+    Attributes:
+        function CALLBACK: Called as CALLBACK(int time, Chord chord, tuple
+            voicing) for each time step decided, in order. VOICING is
+            (s, a, t, b), or None if no voicing of the chord sings the
+            soprano.
+        int LOOKAHEAD:
+        float GRADE: Grade of the time steps decided so far.
+        int BREAKS: Time steps from which the harmonization started over,
+            none of their voicings following the ones decided before.
+        float LATENCY: Longest time push() took, in seconds.
+    """
+    def __init__(self, callback, lookahead=None):
+        self.callback = callback
+        if lookahead is None:
+            lookahead = config.online_lookahead
+        self.lookahead = lookahead
+        self.reset()
+
+    def reset(self):
+        """ Forgets the line received so far, without deciding it. """
+        self.time = 0
+        self.grade = 0.0
+        self.breaks = 0
+        self.latency = 0.0
+        self._decided = None    # _Step of the last voicing decided
+        self._window = []       # _Step's not decided yet
+
+    def push(self, chord, soprano, harmony=None):
+        """ Adds the next time step of the line, and decides the ones
+        LOOKAHEAD time steps before it.
+        Input:
+            Chord CHORD:
+            int SOPRANO: Pitch of the soprano.
+            str HARMONY: Defaults to the role of CHORD.
+        """
+        start = time.time()
+        if harmony is None:
+            harmony = chord.role
+        step = _Step(self.time, chord, harmony,
+                     soprano_voicings(chord, soprano))
+        self.time += 1
+        if not step.voicings:
+            self.flush()
+            self._decided = None
+            self.callback(step.time, chord, None)
+        else:
+            before = self._window[-1] if self._window else self._decided
+            if before is not None:
+                step.successors = link_successors(
+                    VARS_1, VARS_2, before.voicings, step.voicings,
+                    link_rules(before.chord, 0),
+                    _domains(before.voicings, step.voicings))
+                step.scores, step.pointers = forward_scores(
+                    before.scores, before.voicings, step.voicings,
+                    step.successors, chord, harmony)
+                if not [1 for score in step.scores if score is not None]:
+                    self.breaks += 1
+                    self.flush()
+                    before = None
+            if before is None:
+                grade_voicing = voicing_grader(chord)
+                step.successors = step.pointers = None
+                step.scores = [self.grade + grade_voicing(voicing)
+                               for voicing in step.voicings]
+            self._window.append(step)
+            while len(self._window) > self.lookahead:
+                self._decide()
+        self.latency = max(self.latency, time.time() - start)
+
+    def flush(self):
+        """ Decides all the time steps received, e.g. at the end of the
+        line.
+        """
+        while self._window:
+            self._decide()
+
+    def _decide(self):
+        """ Decides the first time step of the window, from the best
+        harmonization of the window, and scores the others again from
+        the voicing decided.
+        """
+        window = self._window
+        scores = window[-1].scores
+        j = max([j for j, score in enumerate(scores) if score is not None],
+                key=lambda j: scores[j])
+        for step in reversed(window[1:]):
+            j = step.pointers[j]
+        first = window.pop(0)
+        decided = _Step(first.time, first.chord, first.harmony,
+                        [first.voicings[j]])
+        decided.scores = [first.scores[j]]
+        self._decided = decided
+        self.grade = decided.scores[0]
+        before = decided
+        for k, step in enumerate(window):
+            if k == 0:
+                step.successors = [step.successors[j]]
+            step.scores, step.pointers = forward_scores(
+                before.scores, before.voicings, step.voicings,
+                step.successors, step.chord, step.harmony)
+            before = step
+        self.callback(first.time, first.chord, first.voicings[j])
+
+def _domains(voicings_1, voicings_2):
+    """ Returns the domains of VARS_1 and VARS_2 holding VOICINGS_1 and
+    VOICINGS_2, for the rules called pair by pair.
+    """
+    domains = {}
+    for vars_, voicings in ((VARS_1, voicings_1), (VARS_2, voicings_2)):
+        for i, var in enumerate(vars_):
+            domains[var] = sorted(set(voicing[i] for voicing in voicings))
+    return domains
+
+class HarmonizerStream(MidiOutStream):
+    """ Feeds the chord symbols and soprano notes of a stream of MIDI
+    events to an OnlineHarmonizer (see the documentation of this
+    module).
+
+    Attributes:
+        OnlineHarmonizer HARMONIZER:
+        int CHANNEL: MIDI channel of the soprano.
+        Chord CHORD: The last chord symbol received.
+        int SKIPPED: Soprano notes received before any chord symbol.
+    """
+    def __init__(self, harmonizer, channel=None):
+        MidiOutStream.__init__(self)
+        self.harmonizer = harmonizer
+        if channel is None:
+            channel = config.online_soprano_channel
+        self.channel = channel
+        self.chord = None
+        self.skipped = 0
+
+    def chord_symbol(self, text):
+        chord = parse_chord("0, " + text)
+        if chord == None:
+            print "(Warning) Not a chord symbol: {0}".format(text)
+            return
+        self.chord = chord
+
+    def text(self, text):
+        self.chord_symbol(text)
+
+    def marker(self, text):
+        self.chord_symbol(text)
+
+    def lyric(self, text):
+        self.chord_symbol(text)
+
+    def note_on(self, channel=0, note=0x40, velocity=0x40):
+        if channel != self.channel or not velocity:
+            return
+        if self.chord == None:
+            self.skipped += 1
+            return
+        self.harmonizer.push(self.chord, note)
+
+    def end_of_track(self):
+        self.harmonizer.flush()
+
+    def eof(self):
+        self.harmonizer.flush()
+
+class _PacedStream(object):
+    """ Passes MIDI events on to OUTSTREAM at the pace of their times. """
+    def __init__(self, outstream):
+        self._outstream = outstream
+        self._division = 96
+        self._tempo = 500000    # microseconds per quarter note
+
+    def header(self, format=0, nTracks=1, division=96):
+        self._division = division
+        self._outstream.header(format, nTracks, division)
+
+    def tempo(self, value):
+        self._tempo = value
+        self._outstream.tempo(value)
+
+    def update_time(self, new_time=0, relative=1):
+        if relative and new_time:
+            time.sleep(new_time * self._tempo / 1e6 / self._division)
+        self._outstream.update_time(new_time, relative)
+
+    def __getattr__(self, name):
+        return getattr(self._outstream, name)
+
+class _MergedStream(object):
+    """ Passes the MIDI events of a type 1 file on to OUTSTREAM as one
+    track, in the order of their times, once the whole file is read.
+    Events of the same time come track by track. The events of other
+    files are passed on as they come.
+    """
+    def __init__(self, outstream):
+        self._outstream = outstream
+        self._events = None     # [(time, track, n, name, args, kwargs)]
+        self._time = 0
+        self._track = 0
+
+    def header(self, format=0, nTracks=1, division=96):
+        if format == 1 and nTracks > 1:
+            self._events = []
+        self._outstream.header(format, nTracks, division)
+
+    def set_current_track(self, new_track):
+        self._track = new_track
+        if self._events is None:
+            self._outstream.set_current_track(new_track)
+
+    def start_of_track(self, n_track=0):
+        if self._events is None:
+            self._outstream.start_of_track(n_track)
+
+    def reset_time(self):
+        self._time = 0
+        if self._events is None:
+            self._outstream.reset_time()
+
+    def update_time(self, new_time=0, relative=1):
+        self._time = self._time + new_time if relative else new_time
+        if self._events is None:
+            self._outstream.update_time(new_time, relative)
+
+    def end_of_track(self):
+        if self._events is None:
+            self._outstream.end_of_track()
+
+    def eof(self):
+        if self._events is not None:
+            self._outstream.set_current_track(0)
+            self._outstream.start_of_track(0)
+            self._outstream.reset_time()
+            last = 0
+            for time, track, n, name, args, kwargs in sorted(self._events):
+                self._outstream.update_time(time - last)
+                last = time
+                getattr(self._outstream, name)(*args, **kwargs)
+            self._outstream.end_of_track()
+        self._outstream.eof()
+
+    def __getattr__(self, name):
+        if self._events is None:
+            return getattr(self._outstream, name)
+        def record(*args, **kwargs):
+            self._events.append((self._time, self._track, len(self._events),
+                                 name, args, kwargs))
+        return record
+
+class MidiFileInStream(MidiInStream):
+    """ Stands in for a MIDI input port: read() passes the events of the
+    MIDI file DEVICE to the event handler, through the EventDispatcher of
+    a MidiFileParser. The tracks of a type 1 file are merged into one
+    (see _MergedStream). With REALTIME, events come at the pace of the
+    file, as from a port.
+    """
+    def __init__(self, midiOutStream, device, realtime=False):
+        MidiInStream.__init__(self, midiOutStream, device)
+        self.device = device
+        self.realtime = realtime
+
+    def read(self, time=0):
+        outstream = self.midiOutStream
+        if self.realtime:
+            outstream = _PacedStream(outstream)
+        MidiInFile(_MergedStream(outstream), self.device).read()
+
+def harmonize_midifile(path, callback, lookahead=None, channel=None,
+                       realtime=False):
+    """ Harmonizes the soprano line of the MIDI file PATH as if it was
+    played live (see MidiFileInStream).
+    Input:
+        str PATH:
+        function CALLBACK: See OnlineHarmonizer.
+        int LOOKAHEAD: Defaults to config.online_lookahead.
+        int CHANNEL: MIDI channel of the soprano. Defaults to
+            config.online_soprano_channel.
+        bool REALTIME:
+    Output:
+        (OnlineHarmonizer HARMONIZER, HarmonizerStream STREAM)
+    """
+    harmonizer = OnlineHarmonizer(callback, lookahead)
+    stream = HarmonizerStream(harmonizer, channel)
+    MidiFileInStream(stream, path, realtime).read()
+    harmonizer.flush()
+    return harmonizer, stream
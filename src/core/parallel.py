@@ -0,0 +1,235 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/parallel.py
+
+Splits the search of a harmony problem across processes (the
+"parallel" engine). Every voicing of the first chord roots a subtree of
+the search, and subtrees are searched by a multiprocessing.Pool, a
+chunk of them per task. The solutions asked for are shared evenly
+between the subtrees, each contributing the first ones it finds, so the
+merged solutions don't depend on the number of workers nor on the
+chunking. They aren't the first ones the serial "csp" engine finds,
+which all come from the first subtrees it searches.
+
+Harmony problems follow the chain of time steps (see chain.py): their
+subtrees are then walked along the chain of voicings, from which the
+voicings starting no solution are removed beforehand, so the search
+never backtracks. Other problems are searched with their solver.
+
+The rules of a problem are closures, which can't be pickled: workers
+inherit the problem by forking instead. Where processes can't fork
+(Windows), the subtrees are searched in this process.
+
+Main functions:
+  split_search()
+  solve_parallel()
+'''
+
+import sys, multiprocessing
+from itertools import islice
+
+import config
+from chain import VoicingChain, IncrementalChain, backward_counts, \
+     iter_paths, time_step_voicings, split_var
+
+sys.path.append("..")
+from Grader.grader import grade
+from util.constants import *
+
+canFork = sys.platform != "win32"
+
+# The (problem, chain, counts, chords, harmonies, vars, limit, budget)
+# searched by the workers, set before the pool forks.
+_job = None
+
+def split_search(problem, chain=None):
+    """ Splits the search of PROBLEM by the voicing of its first time
+    step.
+    Input:
+        Problem PROBLEM:
+        VoicingChain CHAIN: The chain of PROBLEM, if already built. The
+            backward counts an IncrementalChain keeps are reused.
+    Output:
+        (VoicingChain CHAIN, list COUNTS, tuple VARS, list ROOTS): If the
+            rules of PROBLEM follow the chain of time steps, CHAIN and
+            its backward_counts(), and the indices of the first voicings
+            starting some solution. Otherwise CHAIN and COUNTS are None,
+            and ROOTS are the voicings of the first time step. VARS are
+            the CSP vars of the first time step, in (s, a, t, b) order.
+    """
+    if chain is None:
+        try:
+            chain = VoicingChain(problem)
+        except ValueError:
+            chain = None
+    if chain is not None:
+        if not len(chain):
+            return chain, [], (), []
+        if isinstance(chain, IncrementalChain):
+            counts = chain.backward_counts()
+        else:
+            counts = backward_counts(chain)
+        return chain, counts, chain.variables[0], \
+               [i for i, count in enumerate(counts[0]) if count]
+    domains, constraints, vconstraints = problem._getArgs()
+    if not domains:
+        return None, None, (), []
+    first = min(split_var(var)[1] for var in domains)
+    vars_ = tuple(sorted([var for var in domains
+                          if split_var(var)[1] == first],
+                         key=lambda var: VOICE_PREFIXES.index(var[0])))
+    rules = [(constraint_, cvars) for constraint_, cvars in constraints
+             if not [1 for var in cvars if var not in vars_]]
+    return None, None, vars_, time_step_voicings(vars_, domains, rules)
+
+def _search_subtrees(roots):
+    """ Searches the subtree of each first voicing in ROOTS (see
+    split_search()): along the chain of voicings if there is one, with
+    the solver of the problem otherwise. The budget of the job is checked
+    once per subtree, counting the solutions found below it.
+    Output:
+        (list RESULTS, int NODES, str SPENT): RESULTS[i] is the list of
+            the (float grade, tuple items) of the solutions found below
+            ROOTS[i], for the subtrees searched before the budget ran
+            out. NODES is what the budget counted, and SPENT the budget
+            which ran out (see constraint.Budget), or None.
+    """
+    problem, chain, counts, chords, harmonies, vars_, limit, budget = _job
+    nodes = budget and budget.nodes
+    results = []
+    if chain is not None:
+        for first in roots:
+            results.append([(grade(solution, chords, harmonies),
+                             tuple(sorted(solution.items())))
+                            for solution in
+                            [chain.solution(path) for path in
+                             islice(iter_paths(chain, first, counts), limit)]])
+            if budget is not None and budget.check(len(results[-1]) or 1):
+                break
+        return _spent(results, budget, nodes)
+    saved = [(var, problem._variables[var]) for var in vars_]
+    try:
+        for voicing in roots:
+            for var, pitch in zip(vars_, voicing):
+                problem.replaceVariable(var, [pitch])
+            solutions = []
+            for solution in problem.getSolutionIter():
+                solutions.append((grade(solution, chords, harmonies),
+                                  tuple(sorted(solution.items()))))
+                if len(solutions) == limit:
+                    break
+            results.append(solutions)
+            if budget is not None and budget.check(len(solutions) or 1):
+                break
+    finally:
+        problem._variables.update(saved)
+    return _spent(results, budget, nodes)
+
+def _spent(results, budget, nodes):
+    """ Returns the output of _search_subtrees(), the BUDGET having
+    counted NODES before the search of its subtrees.
+    """
+    if budget is None:
+        return results, 0, None
+    return results, budget.nodes - nodes, budget.spent
+
+def merge_solutions(results, limit):
+    """ Merges the solutions of RESULTS (see _search_subtrees()) into the
+    LIMIT best graded distinct ones, ties broken by their pitches.
+    Output:
+        list SOLUTIONS: [(float grade, dict solution), ...], best first.
+    """
+    grades = {}
+    for solutions in results:
+        for sol_grade, items in solutions:
+            grades[items] = sol_grade
+    merged = sorted(grades.items(), key=lambda (items, g): (-g, items))
+    return [(sol_grade, dict(items)) for items, sol_grade in merged[:limit]]
+
+def solve_parallel(problem, chords, harmonies, limit, workers=None,
+                   chunksize=None, halted=None, chain=None, budget=None):
+    """ Searches PROBLEM across WORKERS processes for the LIMIT best
+    graded of the first LIMIT / V solutions (rounded up) below each of
+    the V voicings of its first time step.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        int LIMIT: Number of solutions returned. None searches all the
+            solutions.
+        int WORKERS: Number of processes. 0 uses one per CPU. Defaults to
+            config.parallel_workers.
+        int CHUNKSIZE: Voicings of the first time step searched per task.
+            Defaults to config.parallel_chunksize.
+        function HALTED: Called while waiting for the workers. If it
+            returns True, the workers are stopped and None is returned.
+        VoicingChain CHAIN: See split_search().
+        Budget BUDGET: Checked once per subtree, counting the solutions
+            found below it (see constraint.Budget). Each worker checks
+            its own copy of it, whose count is added to BUDGET once the
+            worker is done. If it runs out, the solutions of the subtrees
+            searched so far are returned.
+    Output:
+        list SOLUTIONS: [(float grade, dict solution), ...], best first.
+    """
+    global _job
+    if workers is None:
+        workers = config.parallel_workers
+    if chunksize is None:
+        chunksize = config.parallel_chunksize
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    chain, counts, vars_, roots = split_search(problem, chain)
+    if not roots:
+        return []
+    chunks = [roots[i:i + chunksize] for i in range(0, len(roots), chunksize)]
+    per_voicing = None if limit is None else -(-limit // len(roots))
+    _job = (problem, chain, counts, chords, harmonies, vars_, per_voicing,
+            budget)
+    try:
+        if workers <= 1 or len(chunks) <= 1 or not canFork:
+            results = []
+            for chunk in chunks:
+                if halted and halted():
+                    return None
+                results.extend(_search_subtrees(chunk)[0])
+                if budget is not None and budget.spent:
+                    break
+            return merge_solutions(results, limit)
+        pool = multiprocessing.Pool(min(workers, len(chunks)))
+        try:
+            pending = pool.map_async(_search_subtrees, chunks)
+            while not pending.ready():
+                pending.wait(0.1)
+                if halted and halted():
+                    pool.terminate()
+                    return None
+            results = []
+            for chunk_results, nodes, spent in pending.get():
+                results.extend(chunk_results)
+                if budget is not None:
+                    budget.spent = budget.spent or spent
+                    budget.nodes += nodes
+        finally:
+            pool.terminate()
+            pool.join()
+        return merge_solutions(results, limit)
+    finally:
+        _job = None
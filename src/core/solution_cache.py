@@ -0,0 +1,290 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/solution_cache.py
+
+Keeps the ranked solutions and solution counts of the problems solved,
+in an SQLite database under config.cache_dir, so that a progression
+solved before is answered without searching again.
+
+Entries are keyed by a canonical hash of a problem (see problem_key()):
+its chords sorted by time (root, modifiers, bass, role and harmony),
+the domains of its voices (the voice ranges, narrowed by the figures),
+the voice ranges themselves, the rules it enforces, the grader weights,
+and what was asked (engine, number of solutions, and the settings the
+order of the search depends on, see search_settings()). The database is
+stamped with a hash of the sources of the rules, the grader, the
+constraint solver and the engines (see rules_stamp()): entries written
+under another stamp are dropped when it is opened. Once the entries exceed config.cache_max_size megabytes, the
+least recently used ones are evicted.
+
+sqlite3 is optional: without it, open_cache() returns None, and
+problems are always solved.
+
+Main functions:
+  problem_key()
+  search_settings()
+  open_cache()
+'''
+
+import sys, os, time, json, hashlib
+
+import config
+import harmony_rules, voicings, transitions, chain, beam, parallel, \
+       diverse, kbest
+from chain import split_var
+from voicings import VOICE_RANGES, VoicingTableConstraint
+
+sys.path.append("..")
+from constraint import constraint
+from Grader import grader
+from util.constants import *
+
+try:
+    import sqlite3
+    canCache = True
+except ImportError:
+    sqlite3 = None
+    canCache = False
+
+# Bumped when the format of the entries changes.
+CACHE_VERSION = 1
+
+# Modules whose sources the stamp of the database hashes: editing the
+# rules, the grader, the constraint solver (its variable and value
+# orders) or an engine invalidates the entries. The modules themselves
+# are hashed, not their names, which differ between the CLI
+# ("harmony_rules") and the GUI ("core.harmony_rules").
+STAMPED_MODULES = (harmony_rules, grader, constraint, voicings, transitions,
+                   chain, beam, parallel, diverse, kbest)
+
+# Settings changing the order in which constraint.py finds the solutions
+# of a problem, hence which ones come first (see init_problem()).
+SEARCH_SETTINGS = ("arc_consistency", "bitset_domains", "table_constraints",
+                   "table_max_tuples", "gac_constraints", "gac_max_checks",
+                   "voicing_tables")
+
+def _source(module):
+    """ Returns the source of MODULE, or its compiled file if the source
+    isn't available.
+    """
+    path = module.__file__
+    paths = [path]
+    if path.endswith((".pyc", ".pyo")):
+        paths.insert(0, path[:-1])
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except IOError:
+            pass
+    return module.__name__.split(".")[-1]
+
+def rules_stamp():
+    """ Returns the version stamp of the entries: a hash of CACHE_VERSION
+    and of the sources of STAMPED_MODULES.
+    """
+    digest = hashlib.sha1(str(CACHE_VERSION))
+    for module in STAMPED_MODULES:
+        digest.update(_source(module))
+    return digest.hexdigest()
+
+def search_settings():
+    """ Returns the values of SEARCH_SETTINGS, for the ASKED of
+    problem_key() when the solutions cached are the first ones found.
+    """
+    return [getattr(config, name) for name in SEARCH_SETTINGS]
+
+def rule_names(problem):
+    """ Returns the sorted names of the kinds of rules of PROBLEM. """
+    names = set()
+    for constraint_, cvars in problem._constraints:
+        rule = constraint_
+        if not isinstance(rule, VoicingTableConstraint):
+            rule = getattr(rule, "rule", rule)
+        names.add(type(rule).__name__)
+    return sorted(names)
+
+def problem_key(problem, chords, harmonies, *asked):
+    """ Returns the canonical hash of PROBLEM, whose CSP vars may be named
+    either "s_0" or "s0".
+    Input:
+        Problem PROBLEM:
+        list CHORDS: Chords, or a TimeList of them.
+        TimeList HARMONIES:
+        ASKED: What is cached for PROBLEM (e.g. the engine and the number
+            of solutions), as JSON values.
+    Output:
+        str KEY:
+    """
+    steps = [[chord.time, chord.root, list(chord.modifiers), chord.bassNote,
+              chord.role, harmonies.get(chord.time)]
+             for chord in sorted(chords, key=lambda chord: chord.time)]
+    domains = sorted(list(split_var(var)) + [sorted(domain)]
+                     for var, domain in problem._variables.iteritems())
+    content = {"chords": steps,
+               "domains": domains,
+               "ranges": [VOICE_RANGES[voice] for voice in VOICE_PREFIXES],
+               "rules": rule_names(problem),
+               "weights": sorted(grader.feature_weights.items()),
+               "asked": asked}
+    return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+class SolutionCache(object):
+    """ The entries of an SQLite database, each holding the ranked
+    solutions of a problem and/or its number of solutions.
+
+    Attributes:
+        str PATH:
+        int MAXSIZE: Bytes the entries may take, 0 for no limit.
+        int HITS, MISSES: Lookups answered from the cache, or not.
+    """
+    def __init__(self, path, maxsize=0, stamp=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, timeout=30)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta "
+                             "(name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                             "(key TEXT PRIMARY KEY, solutions TEXT, "
+                             "count INTEGER, size INTEGER, used REAL)")
+            stamp = stamp or rules_stamp()
+            row = self._db.execute("SELECT value FROM meta WHERE "
+                                   "name = 'stamp'").fetchone()
+            if row is None or row[0] != stamp:
+                self._db.execute("DELETE FROM entries")
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                                 "('stamp', ?)", (stamp,))
+
+    def get(self, key, make_var=None):
+        """ Returns the ranked solutions cached under KEY.
+        Input:
+            str KEY: See problem_key().
+            function MAKE_VAR: Names the CSP var of a voice at a time, as
+                MAKE_VAR(str voice, int time). Defaults to "s_0" names.
+        Output:
+            list SOLUTIONS: [(float grade, dict solution), ...], best
+                first, or None on a miss.
+        """
+        make_var = make_var or "{0}_{1}".format
+        row = self._lookup(key, "solutions")
+        if row is None:
+            return None
+        return [(sol_grade, dict((make_var(voice, t), pitch)
+                                 for voice, t, pitch in pitches))
+                for sol_grade, pitches in json.loads(row)]
+
+    def get_count(self, key):
+        """ Returns the number of solutions cached under KEY, or None on a
+        miss.
+        """
+        return self._lookup(key, "count")
+
+    def _lookup(self, key, column):
+        with self._db:
+            row = self._db.execute("SELECT {0} FROM entries WHERE key = ?"
+                                   .format(column), (key,)).fetchone()
+            if row is None or row[0] is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE entries SET used = ? WHERE key = ?",
+                             (time.time(), key))
+        return row[0]
+
+    def put(self, key, solutions=None, count=None):
+        """ Caches the ranked SOLUTIONS ([(float grade, dict solution), ...],
+        best first) and/or the solution COUNT of a problem under KEY.
+        """
+        if solutions is not None:
+            solutions = json.dumps([(sol_grade,
+                                     sorted(split_var(var) + (pitch,)
+                                            for var, pitch in
+                                            solution.iteritems()))
+                                    for sol_grade, solution in solutions])
+        with self._db:
+            row = self._db.execute("SELECT solutions, count FROM entries "
+                                   "WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                if solutions is None:
+                    solutions = row[0]
+                if count is None:
+                    count = row[1]
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES "
+                             "(?, ?, ?, ?, ?)",
+                             (key, solutions, count,
+                              len(key) + len(solutions or ""), time.time()))
+            self._evict()
+
+    def _evict(self):
+        """ Drops the least recently used entries until they take at most
+        MAXSIZE bytes.
+        """
+        if not self.maxsize:
+            return
+        total = self.size()
+        if total <= self.maxsize:
+            return
+        dropped = []
+        for key, size in self._db.execute("SELECT key, size FROM entries "
+                                          "ORDER BY used"):
+            if total <= self.maxsize:
+                break
+            dropped.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", dropped)
+
+    def size(self):
+        """ Returns the bytes taken by the entries. """
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                                "entries").fetchone()[0]
+
+    def clear(self):
+        with self._db:
+            self._db.execute("DELETE FROM entries")
+        self.hits = self.misses = 0
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+def open_cache(directory=None, maxsize=None):
+    """ Opens the solution cache of DIRECTORY, creating it if needed.
+    Input:
+        str DIRECTORY: Defaults to config.cache_dir.
+        int MAXSIZE: Megabytes the entries may take, 0 for no limit.
+            Defaults to config.cache_max_size.
+    Output:
+        SolutionCache CACHE: None if config.solution_cache is False, or
+            sqlite3 isn't available.
+    """
+    if not (config.solution_cache and canCache):
+        return None
+    directory = directory or config.cache_dir
+    if maxsize is None:
+        maxsize = config.cache_max_size
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return SolutionCache(os.path.join(directory, "solutions.sqlite"),
+                         int(maxsize * 1024 * 1024))
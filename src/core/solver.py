@@ -31,14 +31,23 @@ Main functions:
 Also defines a command-line interface (CLI).
 '''
 
-import sys, os, time, pdb, traceback, argparse, itertools
+import sys, os, time, copy, pdb, traceback, argparse, itertools
 
 import config, Note
 from harmony_rules import *
+from chain import VoicingChain, IncrementalChain, GradedChain, viterbi, \
+     count_solutions, solution_marginals, feasible_pitches, sample_solutions, \
+     split_var
+from voicings import singer_domain, tabulate_voicings
+from parallel import solve_parallel
+from diverse import diverse_solutions
+from kbest import KBestPaths, iter_ranked
+from beam import beam_search
+import solution_cache
 
 sys.path.append("..")
 from constraint import constraint
-from Grader.grader import grade, grade_debug
+from Grader.grader import grade, grade_debug, voicing_terms, transition_terms
 from Data_Structures.dataStructs import TimeList
 from util.constants import *
 
@@ -52,7 +61,7 @@ def solve(problem):
     solutions_iter = problem.getSolutionIter()
     return solutions_iter
 
-def init_problem(problem, chords, figures):
+def init_problem(problem, chords, figures, tables=None):
     """ Initializes the CSP Problem by adding all constraints
     introduced by specified chords, harmonies, and optional provided
     lines.
@@ -60,6 +69,8 @@ def init_problem(problem, chords, figures):
         Problem PROBLEM:
         list CHORDS:
         list FIGURES:
+        bool TABLES: If True, the harmony rules are turned into table
+            constraints. Defaults to config.table_constraints.
     Output:
         Problem PROBLEM.
     """
@@ -99,68 +110,234 @@ def init_problem(problem, chords, figures):
         problem.addConstraint(CrossoverConstraint(),
                               [make_var(v, t) for v in VOICE_PREFIXES])
         if t < (num_time_steps - 1):    # Mainly, if t != numTimeSteps
-        # Check Leaps
-            for voice in VOICE_PREFIXES:
-                var0, var1 = make_var(voice, t), make_var(voice, t+1)
-                problem.addConstraint(LeapConstraint(), [var0, var1])
-            # Make sure that there are no temporal overlaps
-            problem.addConstraint(TemporalOverlapConstraint(),
-                                  [make_var("s", t), make_var("s", t+1),
-                                   make_var("a", t), make_var("a", t+1)])
-            problem.addConstraint(TemporalOverlapConstraint(),
-                                  [make_var("a", t), make_var("a", t+1),
-                                   make_var("t", t), make_var("t", t+1)])
-            problem.addConstraint(TemporalOverlapConstraint(),
-                                  [make_var("t", t), make_var("t", t+1),
-                                   make_var("b", t), make_var("b", t+1)])
-            # Add parallel fifth/octave handling
-            voice_pairs = []
-            singer_array = []
-            history = []
-            for v1 in VOICE_PREFIXES:
-                for v2 in VOICE_PREFIXES:
-                    if (v1 != v2) and ((v1, v2) not in history):
-                        singer_array.append(
-                            (make_var(v1,t),make_var(v1,t+1),
-                             make_var(v2,t),make_var(v2,t+1)))
-                        history.append((v2, v1))
-            for i in xrange(len(singer_array)):
-                problem.addConstraint(ParallelFifthConstraint(), singer_array[i])
-                problem.addConstraint(ParallelOctaveConstraint(), singer_array[i])
-            # Add behavior for soprano/bass relationship (i.e no hidden 5th, hidden octave)
-            problem.addConstraint(HiddenMotionOuterConstraint(),
-                                  (make_var("s", t), make_var("s", t+1),
-                                   make_var("b", t), make_var("b", t+1)))
-            # Add behavior for sevenths
-            if chord.getSeventh__() != None:
-                for voice in VOICE_PREFIXES:
-                    problem.addConstraint(SeventhConstraint(chord),
-                                          [make_var(voice, t), make_var(voice, t+1)])
-            # Add behavior for leading tones of dominant chords
-            if chord.is_dominant():
-                for voice in VOICE_PREFIXES:
-                    problem.addConstraint(LeadingToneConstraint(chord),
-                                          [make_var(voice, t), make_var(voice, t+1)])
-            # Add behavior for diminished fifths of diminished chords
-            if chord.is_dim():
-                for voice in VOICE_PREFIXES:
-                    problem.addConstraint(DiminishedFifthConstraint(chord),
-                                         [make_var(voice, t), make_var(voice, t+1)])
-            # For fully-dim chords, the root should always resolve upwards
-            if chord.is_dim_full():
-                for voice in VOICE_PREFIXES:
-                    problem.addConstraint(FullDiminishedRootConstraint(chord),
-                                          [make_var(voice, t), make_var(voice, t+1)])
+            for constraint_, vars_ in link_rules(chord, t):
+                problem.addConstraint(constraint_, vars_)
     # 3.) Add any specified notes
     problem = add_figure_constraints(problem, figures)
+    if config.voicing_tables:
+        problem = tabulate_voicings(problem)
+    if tables is None:
+        tables = config.table_constraints
+    if tables:
+        problem = tabulate_constraints(problem, config.table_max_tuples)
+    if config.gac_constraints:
+        problem = propagate_constraints(problem, config.gac_max_checks)
+    if config.arc_consistency:
+        problem.setArcConsistency(True)
+    if config.bitset_domains:
+        problem.setBitsets(True)
     return problem
 
-def add_figure_constraints(problem, figures):
+def link_rules(chord, t):
+    """ Returns the rules linking time step T, on CHORD, to time step T+1.
+    Output:
+        list RULES: [(Constraint constraint, list variables), ...]
+    """
+    rules = []
+    # Check Leaps
+    for voice in VOICE_PREFIXES:
+        var0, var1 = make_var(voice, t), make_var(voice, t+1)
+        rules.append((LeapConstraint(), [var0, var1]))
+    # Make sure that there are no temporal overlaps
+    rules.append((TemporalOverlapConstraint(),
+                  [make_var("s", t), make_var("s", t+1),
+                   make_var("a", t), make_var("a", t+1)]))
+    rules.append((TemporalOverlapConstraint(),
+                  [make_var("a", t), make_var("a", t+1),
+                   make_var("t", t), make_var("t", t+1)]))
+    rules.append((TemporalOverlapConstraint(),
+                  [make_var("t", t), make_var("t", t+1),
+                   make_var("b", t), make_var("b", t+1)]))
+    # Add parallel fifth/octave handling
+    singer_array = []
+    history = []
+    for v1 in VOICE_PREFIXES:
+        for v2 in VOICE_PREFIXES:
+            if (v1 != v2) and ((v1, v2) not in history):
+                singer_array.append(
+                    (make_var(v1,t),make_var(v1,t+1),
+                     make_var(v2,t),make_var(v2,t+1)))
+                history.append((v2, v1))
+    for i in xrange(len(singer_array)):
+        rules.append((ParallelFifthConstraint(), singer_array[i]))
+        rules.append((ParallelOctaveConstraint(), singer_array[i]))
+    # Add behavior for soprano/bass relationship (i.e no hidden 5th, hidden octave)
+    rules.append((HiddenMotionOuterConstraint(),
+                  (make_var("s", t), make_var("s", t+1),
+                   make_var("b", t), make_var("b", t+1))))
+    # Add behavior for sevenths
+    if chord.getSeventh__() != None:
+        for voice in VOICE_PREFIXES:
+            rules.append((SeventhConstraint(chord),
+                          [make_var(voice, t), make_var(voice, t+1)]))
+    # Add behavior for leading tones of dominant chords
+    if chord.is_dominant():
+        for voice in VOICE_PREFIXES:
+            rules.append((LeadingToneConstraint(chord),
+                          [make_var(voice, t), make_var(voice, t+1)]))
+    # Add behavior for diminished fifths of diminished chords
+    if chord.is_dim():
+        for voice in VOICE_PREFIXES:
+            rules.append((DiminishedFifthConstraint(chord),
+                          [make_var(voice, t), make_var(voice, t+1)]))
+    # For fully-dim chords, the root should always resolve upwards
+    if chord.is_dim_full():
+        for voice in VOICE_PREFIXES:
+            rules.append((FullDiminishedRootConstraint(chord),
+                          [make_var(voice, t), make_var(voice, t+1)]))
+    return rules
+
+def make_budget(halted=None, seconds=None, nodes=None, memory=None):
+    """ Returns the constraint.Budget of a search.
+    Input:
+        function HALTED: Stops the search by returning True.
+        float SECONDS: Defaults to config.time_budget.
+        int NODES: Defaults to config.node_budget.
+        int MEMORY: Megabytes. Defaults to config.memory_budget.
+    Output:
+        Budget BUDGET, or None if there are no limits nor HALTED.
+    """
+    if seconds is None:
+        seconds = config.time_budget
+    if nodes is None:
+        nodes = config.node_budget
+    if memory is None:
+        memory = config.memory_budget
+    if seconds is None and nodes is None and memory is None and \
+            halted is None:
+        return None
+    if memory is not None:
+        memory = memory * 1024 * 1024
+    return constraint.Budget(seconds, nodes, memory, halted)
+
+def set_budget(problem, budget):
+    """ Makes the solver of PROBLEM spend BUDGET, by replacing it with a
+    copy given BUDGET, if it takes one.
+    Output:
+        Solver SOLVER: The solver replaced, to set back once done.
+    """
+    solver = problem.getSolver()
+    if budget is not None and hasattr(solver, "budget"):
+        budgeted = copy.copy(solver)
+        budgeted.budget = budget
+        problem.setSolver(budgeted)
+    return solver
+
+def solve_bnb(problem, chords, harmonies, k=None, maxnodes=None, budget=None):
+    """ Finds the K best graded solutions of PROBLEM by branch and bound.
+    The solver of PROBLEM is left unchanged.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        int K: Defaults to config.bnb_solutions.
+        int MAXNODES: Defaults to config.bnb_max_nodes.
+        Budget BUDGET: See make_budget().
+    Output:
+        (list SOLUTIONS, list GRADES, bool OPTIMAL)
+    SOLUTIONS are sorted from the best one. OPTIMAL is False if the node
+    limit or BUDGET ran out before the search could prove them to be the
+    best.
+    """
+    if k is None:
+        k = config.bnb_solutions
+    if maxnodes is None:
+        maxnodes = config.bnb_max_nodes
+    add_grade_objectives(problem, chords, harmonies)
+    solver = problem.getSolver()
+    bnb = constraint.BranchAndBoundSolver(k=k, maxnodes=maxnodes,
+                                          budget=budget)
+    problem.setSolver(bnb)
+    try:
+        solutions = problem.getSolutions()
+    finally:
+        problem.setSolver(solver)
+    if not solutions:
+        # Proven unless the search started and was stopped
+        return [], [], bnb.optimal or not bnb.nodes
+    return solutions, [-cost for cost in bnb.costs], bnb.optimal
+
+def solve_cached(problem, chords, harmonies, asked, solve_func, count=False):
+    """ Returns the solutions of PROBLEM from the solution cache if they
+    were cached before (see solution_cache.py), solving it otherwise.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+        tuple ASKED: What the solutions depend on, besides PROBLEM (see
+            solution_cache.problem_key()).
+        function SOLVE_FUNC: Returns (RESULT, bool KEEP): the solutions
+            [(float grade, dict solution), ...] of PROBLEM, best first, or
+            with COUNT its number of solutions, and whether to cache them.
+        bool COUNT:
+    Output:
+        (RESULT, bool CACHED)
+    """
+    cache = solution_cache.open_cache()
+    if cache == None:
+        return solve_func()[0], False
+    try:
+        key = solution_cache.problem_key(problem, chords, harmonies, *asked)
+        if count:
+            result = cache.get_count(key)
+        else:
+            result = cache.get(key)
+        if result != None:
+            return result, True
+        result, keep = solve_func()
+        if keep:
+            if count:
+                cache.put(key, count=result)
+            else:
+                cache.put(key, result)
+        return result, False
+    finally:
+        cache.close()
+
+def add_grade_objectives(problem, chords, harmonies):
+    """ Makes the cost of the solutions of PROBLEM the opposite of their
+    grade, as a sum of objective terms on a few voices each (see
+    Grader.grader.voicing_terms()), replacing any previous objective.
+    Input:
+        Problem PROBLEM:
+        TimeList CHORDS:
+        TimeList HARMONIES:
+    Output:
+        Problem PROBLEM.
+    """
+    def negate(func):
+        return lambda *pitches: -func(*pitches)
+    del problem._objectives[:]
+    bytime = {}
+    for var in problem._variables:
+        voice, t = split_var(var)
+        bytime.setdefault(t, {})[VOICE_PREFIXES.index(voice)] = var
+    times = sorted(bytime)
+    for k, t in enumerate(times):
+        vars_ = bytime[t]
+        for func, voices, best in voicing_terms(chords.get(t)):
+            problem.addObjective(negate(func), [vars_[i] for i in voices],
+                                 -best)
+        if k == 0:
+            continue
+        vars_0 = bytime[times[k - 1]]
+        for func, voices, best in transition_terms(chords.get(t),
+                                                   harmonies.get(t)):
+            ovars = []
+            for i in voices:
+                ovars.extend([vars_0[i], vars_[i]])
+            problem.addObjective(negate(func), ovars, -best)
+    return problem
+
+def add_figure_constraints(problem, figures, chain=None):
     """ Adds CSP constraints to the Problem instance to handle any
     specified notes.
     Input:
         Problem PROBLEM:
         list FIGURES: [(int time, str voice, str note, int octave/None), ...]
+        IncrementalChain CHAIN: If given, the time steps of FIGURES are
+            invalidated in it, so that CHAIN.update() only computes again
+            what they change (e.g. for chain.solution_marginals()).
     Output:
         Problem PROBLEM.
     """
@@ -182,6 +359,8 @@ def add_figure_constraints(problem, figures):
         else:
             domain_new.append(note_num * octave)
         problem.replaceVariable(var, domain_new)
+        if chain != None:
+            chain.invalidate(time)
     return problem
 
 def make_var(voice, time):
@@ -200,17 +379,7 @@ def get_singer_domain(voice, chord):
     Output:
         list PITCHES: [int pitch0, ...]
     """
-    domain = []
-    voice_range = {"s": soprano_range,
-                   "a": alto_range,
-                   "t": tenor_range,
-                   "b": bass_range}[voice]
-    chordTones__= chord.getChordTones_nums()
-    for note in chordTones__:
-        for note2 in voice_range:
-            if (note2 % 12) == note:
-                domain.append(note2)
-    return domain
+    return singer_domain(voice, chord)
 
 class HarmonySolver():
     """
@@ -231,11 +400,12 @@ class HarmonySolver():
           This calls init_problem() and solve().
     """
     def __init__(self):
-        self.problem = constraint.Problem()
+        self.problem = constraint.Problem(arcconsistency=config.arc_consistency,
+                                          bitsets=config.bitset_domains)
         self._halt = 0
         self.chords = TimeList()
         self.harmonies = TimeList()
-        self.num_solutions = 200 # max nb solutions consider (if too big, then solver takes too long)
+        self.num_solutions = config.num_solutions # max nb solutions consider (if too big, then solver takes too long)
         # list solutions:
         #   solutions[i] -> ["<singer><time>", int pitchnum]
         #   will be sorted in the following way:
@@ -244,6 +414,21 @@ class HarmonySolver():
         #      ['t0',int],['t1',int],...,['tN',int],
         #      ['b0',int],['b1',int],...,['bN',int]]
         self.solutions = []
+        self.engine = config.engine   # One of config.ENGINES
+        # Budget (see make_budget()) which stopped the last solve: "time",
+        # "nodes", "memory", "halted", or None if it ran to its end.
+        self.spent = None
+        # Voicings and transitions kept between solves (see
+        # chain.IncrementalChain). Edits invalidate the time steps they
+        # touch.
+        self.chain = IncrementalChain()
+        # Solutions ranked by grade so far (see ranked_solution()), with the
+        # voicings and transitions of self.chain they were ranked on.
+        self._ranking = None
+        # Time steps whose rules, and whose rules with the next time step,
+        # addHarmonyRules() already added.
+        self._ruled = set()
+        self._linked = set()
 
     # x = "S, A, T, B"
     # y = "S, A, T, B"
@@ -278,22 +463,46 @@ class HarmonySolver():
     # In an attempt to prune the domain-space of each variable, I will do preprocessing to
     # decrease the domain, rather than enforcing it with constraints.
     def getSingerDomain(self, voice, chord):
-        domain = []
-        voice_range = {"s": soprano_range,
-                       "a": alto_range,
-                       "t": tenor_range,
-                       "b": bass_range}[voice]
-        chordTones__= chord.getChordTones_nums()
-        for note in chordTones__:
-            for note2 in voice_range:
-                if (note2 % 12) == note:
-                    domain.append(note2)
-        return domain
+        return singer_domain(voice, chord)
+
+    def resolveEngine(self):
+        """ Returns the engine to solve the problem with: config.engine,
+        or "dp" instead of "csp" with config.incremental_resolve once the
+        problem has solutions. Solving it again after an edit then only
+        rebuilds the voicings and transitions of self.chain of the time
+        steps edited, which the "csp" solves keep up to date.
+        """
+        if config.incremental_resolve and config.engine == "csp" and \
+           self.solutions:
+            return "dp"
+        return config.engine
 
     def createNewProblem(self):
         """ Reset chords/harmonies database """
-        self.problem = constraint.Problem()
+        self.problem = constraint.Problem(arcconsistency=config.arc_consistency,
+                                          bitsets=config.bitset_domains)
         self._halt = 0
+        self.chain.clear()
+        self._ruled.clear()
+        self._linked.clear()
+
+    # Sets the domain of VAR to PITCHES, invalidating its time step if they changed.
+    def _setDomain(self, var, pitches):
+        domain = self.problem._variables[var]
+        domain.resetState()
+        if list(domain) != list(pitches):
+            self.problem.replaceVariable(var, pitches)
+            self.chain.invalidate(split_var(var)[1])
+
+    # Removes the rules linking time step TIME to the next one, for
+    # addHarmonyRules() to add them again.
+    def _unlink(self, time):
+        vars_1 = set(voice+str(time) for voice in VOICE_PREFIXES)
+        vars_2 = set(voice+str(time+1) for voice in VOICE_PREFIXES)
+        self.problem._constraints = [(rule, variables) for rule, variables in self.problem._constraints
+                                     if not (vars_1.intersection(variables) and vars_2.intersection(variables))]
+        self._linked.discard(time)
+        self.chain.invalidate_link(time)
 
     # If the user wishes to specify any voice, then he/she can do so here. Should overwrite any previous
     # specified notes (for the specified voice).
@@ -307,7 +516,7 @@ class HarmonySolver():
                 chord = self.chords[t]
                 var = voice+str(t)
                 if var in self.problem._variables:
-                    self.problem.replaceVariable(var, self.getSingerDomain(voice, chord))
+                    self._setDomain(var, self.getSingerDomain(voice, chord))
                 else:
                     raise RuntimeError, "Error in HarmonySolver.specify_voice() - var wasn't in self.problem._variables, \
                                             , where var is: %s" % var
@@ -316,7 +525,7 @@ class HarmonySolver():
                 if notes[t] != None:
                     var = voice+str(t)
                     if var in self.problem._variables:
-                        self.problem.replaceVariable(var, (notes[t],))
+                        self._setDomain(var, (notes[t],))
                     else:
                         raise RuntimeError, "Error in HarmonySolver.specify_voice() - var wasn't in self.problem._variables, \
                                               , where var is: %s" % var
@@ -329,6 +538,7 @@ class HarmonySolver():
     def addChord(self, chord, time):
         problem = self.problem
         self.chords.add(time, chord)  # Update our chord database
+        self.chain.invalidate(time)
         # Now let's update our Problem() instance's variable list
         singers = ("s"+str(time), "a"+str(time), "t"+str(time), "b"+str(time))
         problem.addVariable(singers[0], self.getSingerDomain("s", chord))
@@ -347,14 +557,24 @@ class HarmonySolver():
         self.chords.remove(time)
         singers = ("s"+str(time), "a"+str(time), "t"+str(time), "b"+str(time))
         for var in singers:
-            self.problem.removeVariable(var)
+            self.problem.removeVariable(var)   # Also removes their rules
+        self.chain.invalidate(time)
+        self._ruled.discard(time)
+        self._linked.discard(time - 1)
+        self._linked.discard(time)
 
     def addHarmony(self, harmony, time):
+        self.harmonies.remove(time)   # TimeList.add() doesn't replace
         self.harmonies.add(time, harmony)
         self.chords[time].role = harmony
+        # The rules to the next chord depend on the harmony (leading tones)
+        self._unlink(time)
+        self.chain.invalidate(time)
 
     def removeHarmony(self, time):
         self.harmonies.remove(time)
+        self._unlink(time)
+        self.chain.invalidate(time)
 
     def removeAll(self):
         times = self.chords.get_times()
@@ -366,55 +586,71 @@ class HarmonySolver():
             exit(1)
         self.solutions = []
 
+    # Only adds the rules of the time steps (and pairs of them) that don't have them yet,
+    # so that calling it before every solve doesn't duplicate them.
     def addHarmonyRules(self):
-        problem = self.problem
         numTimeSteps = len(self.chords.get_times())
         for t in range(numTimeSteps):
-            # Make sure that voices are at most an octave away from each other
-            problem.addConstraint(SpacingConstraint(), ["s"+str(t), "a"+str(t)])
-            problem.addConstraint(SpacingConstraint(), ["a"+str(t), "t"+str(t)])
-            problem.addConstraint(SpacingConstraint(), ["t"+str(t), "b"+str(t)])
-            # Make sure that voices don't cross each other
-            problem.addConstraint(CrossoverConstraint(), ["s"+str(t), "a"+str(t), "t"+str(t), "b"+str(t)])
-            if t < (numTimeSteps - 1):    # Mainly, if t != numTimeSteps
-                # Check Leaps
-                for singer in ("s", "a", "t", "b"):
-                    singer2 = singer+str(t+1)
-                    problem.addConstraint(LeapConstraint(), [singer+str(t), singer2])
-                # Make sure that there are no temporal overlaps
-                problem.addConstraint(TemporalOverlapConstraint(), \
-                                   ["s"+str(t), "s"+str(t+1), "a"+str(t), "a"+str(t+1)])
-                problem.addConstraint(TemporalOverlapConstraint(), \
-                                   ["a"+str(t), "a"+str(t+1), "t"+str(t), "t"+str(t+1)])
-                problem.addConstraint(TemporalOverlapConstraint(), \
-                                   ["t"+str(t), "t"+str(t+1), "b"+str(t), "b"+str(t+1)])
-                chord = self.chords.get(t)
-                # Add parallel fifth/octave handling
-                singer_array = []
-                history = []
-                for singer in ("s", "a", "t", "b"):
-                    for singer2 in ("s", "a", "t", "b"):
-                        if (singer != singer2) and ((singer, singer2) not in history):
-                            singer_array.append((singer+str(t), singer+str(t+1), singer2+str(t), singer2+str(t+1)))
-                            history.append((singer2, singer))
-                for i in range(len(singer_array)):
-                    problem.addConstraint(ParallelFifthConstraint(), singer_array[i])
-                    problem.addConstraint(ParallelOctaveConstraint(), singer_array[i])
-                # Add behavior for soprano/bass relationship (i.e no hidden 5th, hidden octave)
-                ### Note: singer_array[2] contains the tuple ( <s0>, <s1>, <b0>, <b1> ), which is what we want
-                problem.addConstraint(HiddenMotionOuterConstraint(), singer_array[2])
-                # Add behavior for sevenths
-                if chord.getSeventh__() != None:
-                    for singer in ("s", "a", "t", "b"):
-                        problem.addConstraint(SeventhConstraint(chord), [singer+str(t), singer+str(t+1)])
-                # Add behavior for leading tones of dominant chords)
-                if self.isDominant(t):
-                    for singer in ("s", "a", "t", "b"):
-                        problem.addConstraint(LeadingToneConstraint(chord), [singer+str(t), singer+str(t+1)])
-                # Add behavior for diminished fifths of diminished chords
-                if ("dim" in chord.modifiers) or ("dim7" in chord.modifiers):
-                    for singer in ("s", "a", "t", "b"):
-                        problem.addConstraint(DiminishedFifthConstraint(chord), [singer+str(t), singer+str(t+1)])
+            if t not in self._ruled:
+                self._addStepRules(t)
+            if t < (numTimeSteps - 1) and t not in self._linked:    # Mainly, if t != numTimeSteps
+                self._addLinkRules(t)
+
+    # Adds the rules of time step T alone.
+    def _addStepRules(self, t):
+        problem = self.problem
+        # Make sure that voices are at most an octave away from each other
+        problem.addConstraint(SpacingConstraint(), ["s"+str(t), "a"+str(t)])
+        problem.addConstraint(SpacingConstraint(), ["a"+str(t), "t"+str(t)])
+        problem.addConstraint(SpacingConstraint(), ["t"+str(t), "b"+str(t)])
+        # Make sure that voices don't cross each other
+        problem.addConstraint(CrossoverConstraint(), ["s"+str(t), "a"+str(t), "t"+str(t), "b"+str(t)])
+        self._ruled.add(t)
+        self.chain.invalidate(t)
+
+    # Adds the rules between time steps T and T+1.
+    def _addLinkRules(self, t):
+        problem = self.problem
+        # Check Leaps
+        for singer in ("s", "a", "t", "b"):
+            singer2 = singer+str(t+1)
+            problem.addConstraint(LeapConstraint(), [singer+str(t), singer2])
+        # Make sure that there are no temporal overlaps
+        problem.addConstraint(TemporalOverlapConstraint(), \
+                           ["s"+str(t), "s"+str(t+1), "a"+str(t), "a"+str(t+1)])
+        problem.addConstraint(TemporalOverlapConstraint(), \
+                           ["a"+str(t), "a"+str(t+1), "t"+str(t), "t"+str(t+1)])
+        problem.addConstraint(TemporalOverlapConstraint(), \
+                           ["t"+str(t), "t"+str(t+1), "b"+str(t), "b"+str(t+1)])
+        chord = self.chords.get(t)
+        # Add parallel fifth/octave handling
+        singer_array = []
+        history = []
+        for singer in ("s", "a", "t", "b"):
+            for singer2 in ("s", "a", "t", "b"):
+                if (singer != singer2) and ((singer, singer2) not in history):
+                    singer_array.append((singer+str(t), singer+str(t+1), singer2+str(t), singer2+str(t+1)))
+                    history.append((singer2, singer))
+        for i in range(len(singer_array)):
+            problem.addConstraint(ParallelFifthConstraint(), singer_array[i])
+            problem.addConstraint(ParallelOctaveConstraint(), singer_array[i])
+        # Add behavior for soprano/bass relationship (i.e no hidden 5th, hidden octave)
+        ### Note: singer_array[2] contains the tuple ( <s0>, <s1>, <b0>, <b1> ), which is what we want
+        problem.addConstraint(HiddenMotionOuterConstraint(), singer_array[2])
+        # Add behavior for sevenths
+        if chord.getSeventh__() != None:
+            for singer in ("s", "a", "t", "b"):
+                problem.addConstraint(SeventhConstraint(chord), [singer+str(t), singer+str(t+1)])
+        # Add behavior for leading tones of dominant chords)
+        if self.isDominant(t):
+            for singer in ("s", "a", "t", "b"):
+                problem.addConstraint(LeadingToneConstraint(chord), [singer+str(t), singer+str(t+1)])
+        # Add behavior for diminished fifths of diminished chords
+        if ("dim" in chord.modifiers) or ("dim7" in chord.modifiers):
+            for singer in ("s", "a", "t", "b"):
+                problem.addConstraint(DiminishedFifthConstraint(chord), [singer+str(t), singer+str(t+1)])
+        self._linked.add(t)
+        self.chain.invalidate_link(t)
 
     """
     Returns n solutions, where n = core.config.num_solutions
@@ -425,8 +661,116 @@ class HarmonySolver():
     def isHalt(self):
         return self._halt == 1
 
+    """
+    Solves the problem with self.engine, returning the graded solutions
+    [(grade, ordered_solution), ...], best first, or None. With
+    config.solution_cache, the solutions of a problem solved before come
+    from the cache (see solution_cache.py).
+    """
     def solveProblem(self):
+        looked_up = self._cacheLookup()
+        if looked_up == None:
+            return self._solveProblem()
+        key, solutions = looked_up
+        if solutions == None:
+            solutions = self._solveProblem()
+            self._cacheStore(key, solutions)
+            return solutions
+        return self._cachedSolutions(solutions)
+
+    # Returns (key, solutions) of the problem in the solution cache, solutions
+    # being None if they aren't cached, or None without config.solution_cache.
+    def _cacheLookup(self):
+        cache = solution_cache.open_cache()
+        if cache == None:
+            return None
+        try:
+            key = solution_cache.problem_key(self.problem, self.chords,
+                                             self.harmonies,
+                                             *self._cacheAsked())
+            return key, cache.get(key, lambda voice, t: voice+str(t))
+        finally:
+            cache.close()
+
+    # Keeps SOLUTIONS (in the format of solveProblem()) under KEY, unless they
+    # were cut short by a budget or halt().
+    def _cacheStore(self, key, solutions):
+        if self.spent != None or self.isHalt():
+            return
+        cache = solution_cache.open_cache()
+        if cache == None:
+            return
+        try:
+            cache.put(key, [(sol_grade, dict(solution))
+                            for sol_grade, solution in solutions or ()])
+        finally:
+            cache.close()
+
+    # Returns the cached SOLUTIONS in the format of solveProblem().
+    def _cachedSolutions(self, solutions):
         self.unhalt()
+        self.spent = None
+        print "Number of solutions (cached): ", len(solutions)
+        if not solutions:
+            print "No solution reported."
+            return None
+        self.solutions = [(sol_grade, self._order_solution(solution))
+                          for sol_grade, solution in solutions]
+        return self.solutions
+
+    # What the solutions of solveProblem() depend on, besides the problem.
+    def _cacheAsked(self):
+        if config.diverse_solutions:
+            return ("diverse", config.diverse_k, config.diverse_distance,
+                    config.diverse_metric, config.diverse_max_rounds)
+        if self.engine == "dp":
+            return ("dp",)
+        if self.engine == "bnb":
+            return ("bnb", config.bnb_solutions, config.bnb_max_nodes,
+                    solution_cache.search_settings())
+        if self.engine == "beam":
+            return ("beam", config.beam_width)
+        if self.engine == "parallel":
+            return ("parallel", self.num_solutions,
+                    solution_cache.search_settings())
+        return ("csp", self.num_solutions, solution_cache.search_settings())
+
+    def _solveProblem(self):
+        if config.diverse_solutions:
+            return self.solveProblem_diverse()
+        if self.engine == "dp":
+            return self.solveProblem_dp()
+        if self.engine == "bnb":
+            return self.solveProblem_bnb()
+        if self.engine == "beam":
+            return self.solveProblem_beam()
+        if self.engine == "parallel":
+            return self.solveProblem_parallel()
+        self.unhalt()
+        if config.incremental_resolve:
+            self.chain.update(self.problem)
+        # The budget also checks for halt() while no solution is found
+        budget = make_budget(self.isHalt)
+        solver = set_budget(self.problem, budget)
+        try:
+            solutions_graded = self._gradeSolutions()
+        finally:
+            self.problem.setSolver(solver)
+        self.spent = budget.spent
+        if budget.spent not in (None, "halted"):
+            print "The {0} budget ran out: solutions are the ones found so far.".format(budget.spent)
+        numberSolutions = len(solutions_graded)
+        print "Number of solutions: ", numberSolutions
+        if numberSolutions == 0:
+            print "No solution reported."
+            return None
+        # Now to choose the solution from solutions_graded with the highest grade
+        solutions_graded.sort(lambda x, y : self._solution_cmp(x, y))
+        self.solutions = solutions_graded
+        return solutions_graded
+
+    # Grades the first self.num_solutions solutions of the problem.
+    def _gradeSolutions(self):
         solutionIter = self.problem.getSolutionIter()
         numberSolutions = 0
         solutions_graded = []
@@ -438,11 +782,8 @@ class HarmonySolver():
                 break
 
             if solution != None:
-                orderedSol = list()
                 numberSolutions += 1
-                for key in solution.keys():
-                    orderedSol.append([key, solution[key]])
-                orderedSol.sort(lambda x, y: self.myComparator(x[0], y[0]))
+                orderedSol = self._order_solution(solution)
                 sol_grade = grade(solution, self.chords, self.harmonies)
     #      if (bestGradeSoFar > sol_grade) and (core.config.debugging_options["old_constraint"] == 0):
     #        print "Uh oh, there seems to be a problem in my understanding of what grade_debug() does."
@@ -451,21 +792,240 @@ class HarmonySolver():
                 bestGradeSoFar = sol_grade
                 solutions_graded.append( (sol_grade, orderedSol) )
             else:
-                print "No solution reported."
-                return None
-        print "Number of solutions: ", numberSolutions
-        if numberSolutions == 0:
+                break
+        return solutions_graded
+
+
+    """
+    Returns the best graded solution, found by dynamic programming over the
+    time steps (see chain.viterbi()), in the format of solveProblem(). The
+    voicings, transitions and scores of the time steps left untouched since
+    the last solve are reused. The budget is checked once per time step: the
+    search has no solution until its last one.
+    """
+    def solveProblem_dp(self):
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        result = None
+        if self.chain.update(self.problem, budget):
+            result = self.chain.best(self.chords, self.harmonies, budget)
+        self.spent = budget.spent
+        if self.spent not in (None, "halted"):
+            print "The {0} budget ran out before the last time step.".format(self.spent)
+        if result == None:
             print "No solution reported."
             return None
-        # Now to choose the solution from solutions_graded with the highest grade
+        sol_grade, solution = result
+        self.solutions = [(sol_grade, self._order_solution(solution))]
+        return self.solutions
+
+    """
+    Returns the config.bnb_solutions best graded solutions, found by branch
+    and bound, in the format of solveProblem().
+    """
+    def solveProblem_bnb(self):
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        solutions, grades, optimal = solve_bnb(self.problem, self.chords, self.harmonies,
+                                               budget=budget)
+        self.spent = budget.spent
+        if self.spent not in (None, "halted"):
+            print "The {0} budget ran out: solutions are the best found so far.".format(self.spent)
+        elif not optimal:
+            print "Node budget reached: solutions are the best found so far."
+        if not solutions:
+            print "No solution reported."
+            return None
+        self.solutions = [(sol_grade, self._order_solution(solution))
+                          for sol_grade, solution in zip(grades, solutions)]
+        return self.solutions
+
+    """
+    Returns the solutions of the last beam of a beam search of width
+    config.beam_width (see beam.beam_search()), best first, in the format of
+    solveProblem(). The budget is checked once per time step: the search has no
+    solution until its last one.
+    """
+    def solveProblem_beam(self):
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        solutions, stats = beam_search(self.problem, self.chords, self.harmonies,
+                                       halted=self.isHalt, budget=budget)
+        self.spent = budget.spent or ("halted" if self.isHalt() else None)
+        if self.spent not in (None, "halted"):
+            print "The {0} budget ran out.".format(self.spent)
+        print "Beam search: {0}".format(stats)
+        if not solutions:
+            print "No solution reported."
+            return None
+        self.solutions = [(sol_grade, self._order_solution(solution))
+                          for sol_grade, solution in solutions]
+        return self.solutions
+
+    """
+    Returns config.diverse_k high graded solutions, any two of which differ in
+    at least config.diverse_distance time steps (see diverse.diverse_solutions()),
+    in the format of solveProblem(), whatever self.engine. The budget is checked
+    once per time step of the chain, then once per round.
+    """
+    def solveProblem_diverse(self):
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        solutions = None
+        if self.chain.update(self.problem, budget):
+            solutions = diverse_solutions(self.problem, self.chords,
+                                          self.harmonies, chain=self.chain,
+                                          halted=self.isHalt, budget=budget)
+        self.spent = budget.spent or ("halted" if self.isHalt() else None)
+        if self.spent not in (None, "halted"):
+            print "The {0} budget ran out: solutions are the ones found so far.".format(self.spent)
+        if not solutions:
+            print "No solution reported."
+            return None
+        print "Number of solutions: ", len(solutions)
+        self.solutions = [(sol_grade, self._order_solution(solution))
+                          for sol_grade, solution in solutions]
+        return self.solutions
+
+    """
+    Returns self.num_solutions solutions, shared between the voicings of the
+    first chord and searched across config.parallel_workers processes (see
+    parallel.solve_parallel()), in the format of solveProblem(). The budget is
+    checked once per time step of the chain, then once per subtree.
+    """
+    def solveProblem_parallel(self):
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        try:
+            updated = self.chain.update(self.problem, budget)
+            chain = self.chain
+        except ValueError:
+            updated, chain = True, None
+        solutions = None
+        if updated:
+            solutions = solve_parallel(self.problem, self.chords,
+                                       self.harmonies, self.num_solutions,
+                                       halted=self.isHalt, chain=chain,
+                                       budget=budget)
+        self.spent = budget.spent or ("halted" if self.isHalt() else None)
+        if self.spent not in (None, "halted"):
+            print "The {0} budget ran out: solutions are the ones found so far.".format(self.spent)
+        if not solutions:
+            print "No solution reported."
+            return None
+        print "Number of solutions: ", len(solutions)
+        self.solutions = [(sol_grade, self._order_solution(solution))
+                          for sol_grade, solution in solutions]
+        return self.solutions
+
+    """
+    Returns the number of solutions where each var takes each pitch, as
+    {var: {pitch: count}} (see chain.solution_marginals()), without solving. Only
+    the counts the edits since the last call change are computed again.
+    """
+    def solution_marginals(self):
+        self.chain.update(self.problem)
+        return solution_marginals(self.chain)
+
+    """
+    Returns the pitches each var takes in some solution, as {var: [pitch, ...]}
+    (see solution_marginals()), e.g. the notes the alto can still sing once the
+    soprano is specified.
+    """
+    def feasible_pitches(self):
+        self.chain.update(self.problem)
+        return feasible_pitches(self.chain)
+
+    """
+    Returns the n-th best graded solution (from 0), as an item of solveProblem(),
+    or None if there are n solutions or less. Solutions are ranked once asked for
+    (see kbest.KBestPaths()), and the ranking is kept until an edit changes the
+    voicings or transitions of self.chain.
+    """
+    def ranked_solution(self, n):
+        self.chain.update(self.problem)
+        steps = self.chain.voicings + self.chain.successors
+        if self._ranking == None or len(self._ranking[0]) != len(steps) or \
+           [1 for old, new in zip(self._ranking[0], steps) if old is not new]:
+            self._ranking = (steps, KBestPaths(GradedChain(self.chain, self.chords,
+                                                           self.harmonies)))
+        result = self._ranking[1].get(n)
+        if result == None:
+            return None
+        sol_grade, path = result
+        return sol_grade, self._order_solution(self.chain.solution(path))
+
+    """
+    Yields (grade, solution, stats) each time the search finds a solution graded
+    better than the ones before it (see anytime.iter_improving()), solution being
+    in the format of solveProblem(). Stops when halted, or after self.num_solutions
+    solutions with the "csp" engine. self.solutions then holds all the solutions
+    found, best first. A search split across processes (the "parallel" engine,
+    see solveProblem_parallel()), or a search for diverse solutions (see
+    solveProblem_diverse()), only yields its best solution, once it's over.
+    With config.solution_cache, the solutions of a problem solved before come
+    from the cache, and only their best one is yielded. The solutions of a
+    complete search are cached as solveProblem() would, except with the "bnb"
+    engine: its improving solutions aren't the best graded ones solveProblem()
+    caches.
+    """
+    def solveProblem_anytime(self):
+        import anytime   # anytime imports this module
+        start = time.time()
+        looked_up = self._cacheLookup()
+        if looked_up != None and looked_up[1] != None:
+            solutions = self._cachedSolutions(looked_up[1])
+            if solutions:
+                stats = anytime.SearchStats(self.engine)
+                stats.elapsed = time.time() - start
+                stats.solutions = len(solutions)
+                stats.improvements = 1
+                yield solutions[0][0], solutions[0][1], stats
+            return
+        if config.diverse_solutions or self.engine == "parallel":
+            if config.diverse_solutions:
+                solutions = self.solveProblem_diverse()
+            else:
+                solutions = self.solveProblem_parallel()
+            if looked_up != None:
+                self._cacheStore(looked_up[0], solutions)
+            if solutions:
+                stats = anytime.SearchStats(self.engine)
+                stats.elapsed = time.time() - start
+                stats.solutions = len(solutions)
+                stats.improvements = 1
+                yield solutions[0][0], solutions[0][1], stats
+            return
+        self.unhalt()
+        budget = make_budget(self.isHalt)
+        chain = None
+        if self.engine == "dp":
+            self.chain.update(self.problem, budget)
+            chain = self.chain
+        elif self.engine == "csp" and config.incremental_resolve:
+            self.chain.update(self.problem)
+        seen = []
+        stats = None
+        for sol_grade, solution, stats in anytime.iter_improving(
+                self.problem, self.chords, self.harmonies, self.engine,
+                halted=self.isHalt, limit=self.num_solutions, seen=seen,
+                chain=chain, budget=budget):
+            yield sol_grade, self._order_solution(solution), stats
+        self.spent = (stats and stats.spent) or budget.spent
+        solutions_graded = [(sol_grade, self._order_solution(solution))
+                            for sol_grade, solution in seen]
         solutions_graded.sort(lambda x, y : self._solution_cmp(x, y))
-        best_sol = solutions_graded[0]
-        worst_sol = solutions_graded[len(solutions_graded) - 1]
-        #print "Best solution: ", best_sol
-        #print "Worst solution: ", worst_sol
         self.solutions = solutions_graded
-        return solutions_graded
+        if looked_up != None and self.engine != "bnb":
+            self._cacheStore(looked_up[0], solutions_graded)
 
+    # Returns SOLUTION (a dict) as a list of [var, pitch], sorted by myComparator().
+    def _order_solution(self, solution):
+        orderedSol = list()
+        for key in solution.keys():
+            orderedSol.append([key, solution[key]])
+        orderedSol.sort(lambda x, y: self.myComparator(x[0], y[0]))
+        return orderedSol
 
     """
     Returns n solutions, where n = core.config.num_solutions. NOTE: Not used at the moment....
@@ -641,16 +1201,134 @@ def run_tests():
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("problem", help="Path to problem instance.")
+    parser.add_argument("problem", nargs="?", help="Path to problem instance.")
     parser.add_argument("--run_tests", action="store_true",
                         help="Runs the solver on a suite of built-in \
 problem instances.")
-    return parser.parse_args()
+    parser.add_argument("--engine", choices=config.ENGINES,
+                        default=config.engine,
+                        help="csp lists every solution, parallel the best \
+graded ones of a search split across processes, dp only shows the \
+best graded one, bnb the config.bnb_solutions best graded ones, beam \
+a high graded one of a beam search, for long progressions \
+(default: %(default)s).")
+    parser.add_argument("--beam-width", type=int, metavar="B",
+                        default=config.beam_width,
+                        help="Harmonizations kept by the beam engine at each \
+time step (default: %(default)s).")
+    parser.add_argument("--anytime", action="store_true",
+                        help="Prints each solution graded better than the \
+ones before it as soon as it is found, until the search is over or \
+interrupted (Ctrl-C), then shows the best one.")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        default=config.time_budget,
+                        help="Stops the search after SECONDS, with the \
+solutions found so far (default: %(default)s).")
+    parser.add_argument("--node-budget", type=int, metavar="N",
+                        default=config.node_budget,
+                        help="Stops the search after N values tried, or \
+voicings of the time steps with the dp and beam engines, or solutions with \
+the parallel engine (default: %(default)s).")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        default=config.memory_budget,
+                        help="Stops the search once the process \
+grew by MB megabytes while searching (default: %(default)s).")
+    parser.add_argument("--cache", action="store_true",
+                        default=config.solution_cache,
+                        help="Answers the problems solved before from the \
+solution cache, and caches the others (see core/solution_cache.py).")
+    parser.add_argument("--cache-dir", metavar="DIR", default=config.cache_dir,
+                        help="Directory of the solution cache \
+(default: %(default)s).")
+    parser.add_argument("--diverse", type=int, metavar="K",
+                        help="Shows K high graded solutions, any two of \
+which differ in at least --distance time steps (see core/diverse.py).")
+    parser.add_argument("--distance", type=int,
+                        default=config.diverse_distance,
+                        help="With --diverse, time steps where any two \
+solutions differ (default: %(default)s).")
+    parser.add_argument("--metric", choices=config.DIVERSE_METRICS,
+                        default=config.diverse_metric,
+                        help="With --diverse, what differs between \
+solutions: the voicing or the soprano of a time step \
+(default: %(default)s).")
+    parser.add_argument("--ranked", action="store_true",
+                        help="Pages through the solutions from the best \
+graded to the worst, each computed once asked for (see core/kbest.py).")
+    parser.add_argument("--sample", type=int, metavar="N",
+                        help="Shows N solutions drawn uniformly at random \
+(see chain.sample_solutions()).")
+    parser.add_argument("--seed", type=int,
+                        help="With --sample, seed of the draws: the same \
+seed draws the same solutions.")
+    parser.add_argument("--marginals", action="store_true",
+                        help="Only prints the number of solutions where each \
+voice sings each pitch, at each time, computed without listing them.")
+    parser.add_argument("--count", action="store_true",
+                        help="Only prints the number of solutions, \
+computed without listing them.")
+    parser.add_argument("--batch", metavar="DIR|GLOB",
+                        help="Solves every problem file of a directory, or \
+matching a glob pattern, without prompting. Prints one JSON record per file \
+(see core/batch.py).")
+    parser.add_argument("--output", metavar="FILE",
+                        help="With --batch, writes the records to FILE \
+instead of stdout.")
+    parser.add_argument("--workers", type=int, default=config.batch_workers,
+                        help="With --batch, number of processes, 0 for one \
+per CPU (default: %(default)s).")
+    parser.add_argument("--timeout", type=int, default=config.batch_timeout,
+                        help="With --batch, seconds allowed to each file, 0 \
+for no limit (default: %(default)s).")
+    parser.add_argument("--solutions", type=int,
+                        default=config.batch_solutions,
+                        help="With --batch, number of best graded solutions \
+kept per file (default: %(default)s).")
+    parser.add_argument("--online", metavar="MIDIFILE",
+                        help="Harmonizes the soprano line of a MIDI file as \
+if it was played live, chord symbols being its text events (see \
+core/online.py).")
+    parser.add_argument("--lookahead", type=int,
+                        default=config.online_lookahead,
+                        help="With --online, time steps received after one \
+before its voicing is decided (default: %(default)s).")
+    parser.add_argument("--realtime", action="store_true",
+                        help="With --online, reads the MIDI file at its \
+pace.")
+    args = parser.parse_args()
+    if not (args.problem or args.batch or args.online or args.run_tests):
+        parser.error("A problem file, --batch or --online is required.")
+    return args
+
+def make_timelists(chords):
+    """ Returns (TimeList CHORDS, TimeList HARMONIES) for the grader. """
+    chords_tl, harmonies_tl = TimeList(), TimeList()
+    for chord in chords:
+        chords_tl.add(chord.time, chord)
+        harmonies_tl.add(chord.time, chord.role)
+    return chords_tl, harmonies_tl
+
+def show_solution(solution, chords):
+    """ Prints the pitches of each voice of SOLUTION at each time. """
+    tmax = len(solution) / 4
+    for t in xrange(tmax):
+        print "Time={0}:    [{1}]".format(t, chords[t])
+        for voice in VOICE_PREFIXES:
+            var = make_var(voice, t)
+            pitchnum = solution[var]
+            print "    {0}: {1}".format(voice, Note.numToPitch_absolute(pitchnum))
 
 def main():
     args = parse_args()
     if args.run_tests:
         return run_tests()
+    # Set in config, so that the batch workers see them
+    config.solution_cache = args.cache
+    config.cache_dir = args.cache_dir
+    if args.batch:
+        return main_batch(args)
+    if args.online:
+        return main_online(args)
     # list FIGURES: [(str voice, [(str note, int octave/None)/None, ...]), ...]
     pair = parse_problemfile(args.problem)
     if not pair:
@@ -662,32 +1340,323 @@ def main():
     t = time.time()
     problem = init_problem(constraint.Problem(), chords, figures)
     print "(Info) Finished initialization ({0:.4f}s)".format(time.time() - t)
+    if args.count:
+        t = time.time()
+        chords_tl, harmonies_tl = make_timelists(chords)
+        count, cached = solve_cached(problem, chords_tl, harmonies_tl,
+                                     ("count",),
+                                     lambda: (count_solutions(problem), True),
+                                     count=True)
+        print "(Info) Done Counting ({0:.4f}s{1})".format(time.time() - t,
+                                                          cached and ", cached" or "")
+        print "    {0} Solutions Total.".format(count)
+        return
+    if args.marginals:
+        return main_marginals(problem, chords)
+    if args.sample:
+        t = time.time()
+        solutions = sample_solutions(problem, args.sample, args.seed)
+        print "(Info) Done Sampling ({0:.4f}s)".format(time.time() - t)
+        if not solutions:
+            print "    No solution."
+            return 1
+        for i, solution in enumerate(solutions):
+            print "  Sample {0}:".format(i)
+            show_solution(solution, chords)
+        return
+    budget = make_budget(seconds=args.time_budget, nodes=args.node_budget,
+                         memory=args.memory_budget)
+    if args.ranked:
+        return main_ranked(problem, chords)
+    if args.diverse:
+        return main_diverse(problem, chords, args.diverse, args.distance,
+                            args.metric, budget)
+    if args.anytime:
+        return main_anytime(problem, chords, args.engine, budget)
+    if args.engine == "dp":
+        return main_dp(problem, chords, budget)
+    if args.engine == "bnb":
+        return main_bnb(problem, chords, budget)
+    if args.engine == "beam":
+        return main_beam(problem, chords, args.beam_width, budget)
+    if args.engine == "parallel":
+        return main_parallel(problem, chords, budget)
     print "(Info) Solving Harmony Problem"
     t = time.time()
-    solutions_iter = solve(problem)
+    solver = set_budget(problem, budget)
+    try:
+        solutions = list(solve(problem))
+    finally:
+        problem.setSolver(solver)
     dur = time.time() - t
     print "(Info) Done Solving ({0:.4f}s)".format(dur)
+    if budget and budget.spent:
+        print "    The {0} budget ran out: solutions are the ones found so far.".format(budget.spent)
     print "  Displaying solutions:"
     flag_continue = False
-    solutions = []
-    for sol in solutions_iter:
-        solutions.append(sol)
     print "    {0} Solutions Total.".format(len(solutions))
     for i, solution in enumerate(solutions):
         if flag_continue:
             continue
-        tmax = len(solution) / 4
-        for t in xrange(tmax):
-            print "Time={0}:    [{1}]".format(t, chords[t])
-            for voice in VOICE_PREFIXES:
-                var = make_var(voice, t)
-                pitchnum = solution[var]
-                print "    {0}: {1}".format(voice, Note.numToPitch_absolute(pitchnum))
+        show_solution(solution, chords)
         s = raw_input("({0}/{1}) Press enter to continue, 'c' to skip, or 'q' to exit.".format(i, len(solutions) - 1))
         if s == 'c':
             flag_continue = True
         elif s == 'q':
             break
 
+def main_dp(problem, chords, budget=None):
+    """ Shows the best graded solution of PROBLEM (see chain.viterbi()). """
+    print "(Info) Solving Harmony Problem (dynamic programming)"
+    t = time.time()
+    chords_tl, harmonies_tl = make_timelists(chords)
+    def search():
+        chain = VoicingChain(problem, linked=False)
+        chain.link(budget)
+        result = None
+        if not (budget and budget.spent):
+            result = viterbi(chain, chords_tl, harmonies_tl, budget)
+        return [result] if result != None else [], not (budget and budget.spent)
+    solutions, cached = solve_cached(problem, chords_tl, harmonies_tl,
+                                     ("dp",), search)
+    print "(Info) Done Solving ({0:.4f}s{1})".format(time.time() - t,
+                                                     cached and ", cached" or "")
+    if budget and budget.spent:
+        print "    The {0} budget ran out before the last time step.".format(budget.spent)
+    if not solutions:
+        print "    No solution."
+        return 1
+    sol_grade, solution = solutions[0]
+    print "  Best solution (grade {0}):".format(sol_grade)
+    show_solution(solution, chords)
+
+def main_bnb(problem, chords, budget=None):
+    """ Shows the best graded solutions of PROBLEM (see solve_bnb()). """
+    print "(Info) Solving Harmony Problem (branch and bound)"
+    t = time.time()
+    chords_tl, harmonies_tl = make_timelists(chords)
+    # Only the solutions known to be the best are cached
+    optimal = [True]
+    def search():
+        solutions, grades, optimal[0] = solve_bnb(problem, chords_tl,
+                                                  harmonies_tl, budget=budget)
+        return zip(grades, solutions), optimal[0]
+    solutions, cached = solve_cached(problem, chords_tl, harmonies_tl,
+                                     ("bnb", config.bnb_solutions,
+                                      config.bnb_max_nodes,
+                                      solution_cache.search_settings()),
+                                     search)
+    print "(Info) Done Solving ({0:.4f}s{1})".format(time.time() - t,
+                                                     cached and ", cached" or "")
+    if budget and budget.spent:
+        print "    The {0} budget ran out: solutions are the best found so far.".format(budget.spent)
+    elif not optimal[0]:
+        print "    Node budget reached: solutions are the best found so far."
+    if not solutions:
+        print "    No solution."
+        return 1
+    for i, (sol_grade, solution) in enumerate(solutions):
+        print "  Solution {0} (grade {1}):".format(i, sol_grade)
+        show_solution(solution, chords)
+
+def main_parallel(problem, chords, budget=None):
+    """ Shows the best graded solutions of a search of PROBLEM split across
+    config.parallel_workers processes (see parallel.solve_parallel()).
+    """
+    print "(Info) Solving Harmony Problem (parallel)"
+    t = time.time()
+    chords_tl, harmonies_tl = make_timelists(chords)
+    def search():
+        solutions = solve_parallel(problem, chords_tl, harmonies_tl,
+                                   config.num_solutions, budget=budget)
+        return solutions, not (budget and budget.spent)
+    solutions, cached = solve_cached(
+        problem, chords_tl, harmonies_tl,
+        ("parallel", config.num_solutions, solution_cache.search_settings()),
+        search)
+    print "(Info) Done Solving ({0:.4f}s{1})".format(time.time() - t,
+                                                     cached and ", cached" or "")
+    if budget and budget.spent:
+        print "    The {0} budget ran out: solutions are the ones found so far.".format(budget.spent)
+    if not solutions:
+        print "    No solution."
+        return 1
+    for i, (sol_grade, solution) in enumerate(solutions[:config.bnb_solutions]):
+        print "  Solution {0} (grade {1}):".format(i, sol_grade)
+        show_solution(solution, chords)
+
+def main_beam(problem, chords, width, budget=None):
+    """ Shows the best solution of a beam search of WIDTH over PROBLEM, and
+    how far it is from the best graded one (see beam.beam_search()).
+    """
+    print "(Info) Solving Harmony Problem (beam search)"
+    t = time.time()
+    chords_tl, harmonies_tl = make_timelists(chords)
+    solutions, stats = beam_search(problem, chords_tl, harmonies_tl, width,
+                                   budget=budget)
+    print "(Info) Done Solving ({0:.4f}s)".format(time.time() - t)
+    print "    {0}".format(stats)
+    if budget and budget.spent:
+        print "    The {0} budget ran out.".format(budget.spent)
+    if not solutions:
+        print "    No solution{0}.".format(stats.pruned and
+                                           " (try a wider beam)" or "")
+        return 1
+    sol_grade, solution = solutions[0]
+    if stats.optimal():
+        print "  Best solution (grade {0}):".format(sol_grade)
+    else:
+        print "  Best solution found (grade {0}):".format(sol_grade)
+    show_solution(solution, chords)
+
+def main_marginals(problem, chords):
+    """ Prints the number of solutions of PROBLEM where each voice sings
+    each pitch (see chain.solution_marginals()).
+    """
+    t = time.time()
+    marginals = solution_marginals(problem)
+    print "(Info) Done Counting ({0:.4f}s)".format(time.time() - t)
+    if not [1 for counts in marginals.values() if sum(counts.values())]:
+        print "    No solution."
+        return 1
+    for t in sorted(set(split_var(var)[1] for var in marginals)):
+        print "Time={0}:    [{1}]".format(t, chords[t])
+        for voice in VOICE_PREFIXES:
+            counts = marginals[make_var(voice, t)]
+            print "    {0}: {1}".format(voice, ", ".join(
+                "{0} ({1})".format(Note.numToPitch_absolute(pitch), count)
+                for pitch, count in sorted(counts.items()) if count))
+
+def main_ranked(problem, chords):
+    """ Pages through the solutions of PROBLEM, best graded first (see
+    kbest.iter_ranked()).
+    """
+    print "(Info) Ranking the solutions by grade"
+    chords_tl, harmonies_tl = make_timelists(chords)
+    t = time.time()
+    found = False
+    for i, (sol_grade, solution) in enumerate(iter_ranked(problem, chords_tl,
+                                                          harmonies_tl)):
+        found = True
+        print "  Solution {0} (grade {1}, {2:.4f}s):".format(i, sol_grade,
+                                                            time.time() - t)
+        show_solution(solution, chords)
+        s = raw_input("Press enter for the next best solution, or 'q' to exit.")
+        if s == 'q':
+            return
+        t = time.time()
+    if not found:
+        print "    No solution."
+        return 1
+    print "    No more solutions."
+
+def main_diverse(problem, chords, k, distance, metric, budget=None):
+    """ Shows K diverse high graded solutions of PROBLEM (see
+    diverse.diverse_solutions()).
+    """
+    print "(Info) Solving Harmony Problem ({0} diverse solutions)".format(k)
+    t = time.time()
+    chords_tl, harmonies_tl = make_timelists(chords)
+    def search():
+        solutions = diverse_solutions(problem, chords_tl, harmonies_tl, k,
+                                      distance, metric, budget=budget)
+        return solutions, not (budget and budget.spent)
+    solutions, cached = solve_cached(
+        problem, chords_tl, harmonies_tl,
+        ("diverse", k, distance, metric, config.diverse_max_rounds),
+        search)
+    print "(Info) Done Solving ({0:.4f}s{1})".format(time.time() - t,
+                                                     cached and ", cached" or "")
+    if budget and budget.spent:
+        print "    The {0} budget ran out: solutions are the ones found so far.".format(budget.spent)
+    if not solutions:
+        print "    No solution."
+        return 1
+    if len(solutions) < k:
+        print "    Only {0} solutions found {1} time steps apart.".format(
+            len(solutions), distance)
+    for i, (sol_grade, solution) in enumerate(solutions):
+        print "  Solution {0} (grade {1}):".format(i, sol_grade)
+        show_solution(solution, chords)
+
+def main_anytime(problem, chords, engine, budget=None):
+    """ Prints the improving solutions of PROBLEM as they are found (see
+    anytime.iter_improving()), and shows the best one.
+    """
+    import anytime   # anytime imports this module
+    print "(Info) Solving Harmony Problem (anytime, {0})".format(engine)
+    chords_tl, harmonies_tl = make_timelists(chords)
+    best = None
+    stats = None
+    try:
+        for sol_grade, solution, stats in anytime.iter_improving(
+                problem, chords_tl, harmonies_tl, engine, budget=budget):
+            best = (sol_grade, solution)
+            print "    Grade {0} ({1})".format(sol_grade, stats)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print "(Info) Interrupted."
+    if best is None:
+        print "    No solution."
+        return 1
+    if stats.spent:
+        print "(Info) The {0} budget ran out.".format(stats.spent)
+    if stats.optimal:
+        print "  Best solution (grade {0}):".format(best[0])
+    else:
+        print "  Best solution found (grade {0}):".format(best[0])
+    show_solution(best[1], chords)
+
+def main_batch(args):
+    """ Solves the problem files of ARGS.BATCH (see batch.run_batch()). """
+    # batch imports this module
+    import batch
+    out = open(args.output, "w") if args.output else sys.stdout
+    t = time.time()
+    try:
+        statuses = batch.run_batch(args.batch, out, args.engine,
+                                   args.solutions, args.workers, args.timeout)
+    finally:
+        if args.output:
+            out.close()
+    # stdout may carry the records: report on stderr
+    if not statuses:
+        print >>sys.stderr, "(Warning) No problem files in {0}".format(args.batch)
+        return 1
+    print >>sys.stderr, "(Info) Solved {0} files ({1:.4f}s): {2}".format(
+        sum(statuses.values()), time.time() - t,
+        ", ".join("{0} {1}".format(n, status)
+                  for status, n in sorted(statuses.items())))
+    if statuses.get("error") or statuses.get("timeout"):
+        return 1
+
+def main_online(args):
+    """ Prints the voicings of the soprano line of ARGS.ONLINE as they are
+    decided (see online.harmonize_midifile()).
+    """
+    import online   # online imports this module
+    print "(Info) Harmonizing {0} (lookahead {1})".format(args.online,
+                                                         args.lookahead)
+    def decided(t, chord, voicing):
+        if voicing is None:
+            print "Time={0}:    [{1}]    No voicing sings the soprano.".format(t, chord)
+        else:
+            print "Time={0}:    [{1}]    {2}".format(
+                t, chord, " ".join(Note.numToPitch_absolute(pitch)
+                                   for pitch in voicing))
+        sys.stdout.flush()
+    try:
+        harmonizer, stream = online.harmonize_midifile(
+            args.online, decided, args.lookahead, realtime=args.realtime)
+    except KeyboardInterrupt:
+        print "(Info) Interrupted."
+        return 1
+    print "(Info) Done: grade {0}, {1} time steps started over, \
+longest step {2:.4f}s".format(harmonizer.grade, harmonizer.breaks,
+                              harmonizer.latency)
+    if stream.skipped:
+        print "(Warning) {0} soprano notes came before any chord \
+symbol.".format(stream.skipped)
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
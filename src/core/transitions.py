@@ -0,0 +1,161 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/transitions.py
+
+Evaluates the rules linking two consecutive time steps (parallel
+fifths/octaves, leaps, temporal overlaps, hidden fifths/octaves,
+resolution of sevenths, leading tones, diminished fifths and
+fully-diminished roots) on every pair of voicings at once. Given the
+V1 voicings of a time step and the V2 voicings of the next one, each
+rule is a NumPy expression broadcast over a V1 x V2 grid, and the
+grids are and-ed into the compatibility matrix of the two time steps.
+
+NumPy is optional: without it, transition_matrix() returns None, and
+callers check the rules pair by pair instead.
+
+Main functions:
+  transition_matrix()
+  csr_adjacency()
+'''
+
+import sys
+
+from harmony_rules import *
+
+sys.path.append("..")
+from util.constants import *
+
+try:
+    import numpy
+    canVectorize = True
+except ImportError:
+    numpy = None
+    canVectorize = False
+
+def _steps(diff, steps):
+    """ Returns the grid of DIFF in STEPS. """
+    result = diff == steps[0]
+    for step in steps[1:]:
+        result |= diff == step
+    return result
+
+def _parallel(interval):
+    def kernel(x0, x1, y0, y1):
+        return ~((x0 != x1) & (y0 != y1) & ((x0 - y0) % 12 == interval) &
+                 ((x1 - y1) % 12 == interval))
+    return kernel
+
+def _hidden_outer(s0, s1, b0, b1):
+    dist_s, dist_b = s0 - s1, b0 - b1
+    similar = ((dist_s < 0) & (dist_b < 0)) | ((dist_s > 0) & (dist_b > 0))
+    dist = (s1 - b1) % 12
+    return ~similar | ((dist != 7) & (dist != 0))
+
+def _seventh(chord):
+    seventh = chord.getSeventh__()
+    return lambda x, y: (x % 12 != seventh) | _steps(x - y, (0, 1, 2))
+
+def _leading_tone(chord):
+    leading_tone = chord.getThird__()
+    return lambda x, y: (x % 12 != leading_tone) | _steps(y - x, (0, 1, 2))
+
+def _flat_fifth(chord):
+    flat_fifth = chord.getFifth__()
+    return lambda x, y: (x % 12 != flat_fifth) | _steps(x - y, (0, 1))
+
+def _fulldim_root(chord):
+    root = chord.getChordTones_nums()[0]
+    return lambda v0, v1: (v0 % 12 != root) | (v1 - v0 == 1)
+
+# Maps each rule between time steps to a function returning, for a rule
+# instance, the NumPy version of its function.
+KERNELS = {
+    ParallelFifthConstraint: lambda rule: _parallel(7),
+    ParallelOctaveConstraint: lambda rule: _parallel(0),
+    LeapConstraint: lambda rule: lambda x0, x1: abs(x0 - x1) <= 11,
+    TemporalOverlapConstraint:
+        lambda rule: lambda x0, x1, y0, y1: (x0 >= y1) & (x1 >= y0),
+    HiddenMotionOuterConstraint: lambda rule: _hidden_outer,
+    SeventhConstraint: lambda rule: _seventh(rule.chord),
+    LeadingToneConstraint: lambda rule: _leading_tone(rule.chord),
+    DiminishedFifthConstraint: lambda rule: _flat_fifth(rule.chord),
+    FullDiminishedRootConstraint: lambda rule: _fulldim_root(rule.chord),
+}
+
+def transition_matrix(vars_1, vars_2, voicings_1, voicings_2, rules,
+                      domains=None):
+    """ Checks RULES on every pair of a voicing of VOICINGS_1 followed by
+    a voicing of VOICINGS_2.
+    Input:
+        tuple VARS_1, VARS_2: The CSP vars of both time steps, in the
+            order of the pitches of their voicings.
+        list VOICINGS_1, VOICINGS_2: Lists of pitch tuples.
+        list RULES: [(Constraint constraint, list variables), ...], each
+            on vars of VARS_1 and VARS_2.
+        dict DOMAINS: Maps CSP vars to their domains, for the rules
+            without a NumPy version, which are called pair by pair.
+    Output:
+        numpy.ndarray MATRIX: V1 x V2 array of bools, MATRIX[i, j] being
+            True iff VOICINGS_2[j] may follow VOICINGS_1[i]. None if
+            NumPy isn't available.
+    """
+    if not canVectorize:
+        return None
+    shape = (len(voicings_1), len(voicings_2))
+    matrix = numpy.ones(shape, dtype=bool)
+    if not shape[0] or not shape[1]:
+        return matrix
+    array_1 = numpy.array(voicings_1, dtype=numpy.int16)
+    array_2 = numpy.array(voicings_2, dtype=numpy.int16)
+    columns = {}
+    for i, var in enumerate(vars_1):
+        columns[var] = array_1[:, i][:, None]
+    for j, var in enumerate(vars_2):
+        columns[var] = array_2[:, j][None, :]
+    others = []
+    for constraint_, cvars in rules:
+        rule = getattr(constraint_, "rule", constraint_)
+        kernel = KERNELS.get(type(rule))
+        if kernel is None:
+            others.append((constraint_, cvars))
+            continue
+        matrix &= kernel(rule)(*[columns[var] for var in cvars])
+    if others:
+        assignments = {}
+        for i, j in zip(*numpy.nonzero(matrix)):
+            assignments.update(zip(vars_1, voicings_1[i]))
+            assignments.update(zip(vars_2, voicings_2[j]))
+            for constraint_, cvars in others:
+                if not constraint_(cvars, domains, assignments):
+                    matrix[i, j] = False
+                    break
+    return matrix
+
+def csr_adjacency(matrix):
+    """ Returns the compressed sparse rows of MATRIX.
+    Output:
+        (numpy.ndarray INDPTR, numpy.ndarray INDICES): The columns of
+            the True entries of row i are INDICES[INDPTR[i]:INDPTR[i+1]].
+    """
+    rows, indices = numpy.nonzero(matrix)
+    indptr = numpy.zeros(matrix.shape[0] + 1, dtype=numpy.intp)
+    numpy.cumsum(numpy.bincount(rows, minlength=matrix.shape[0]),
+                 out=indptr[1:])
+    return indptr, indices
@@ -0,0 +1,400 @@
+"""
+FourVoices -- A music generator.
+Copyright (C) 2012 Eric Kim <erickim555@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+  ./src/core/voicings.py
+
+The rules of a single time step (SpecifyChordConstraint,
+SetBassConstraint, SpacingConstraint and CrossoverConstraint) only
+depend on the chord, its role and the ranges of the singers. The
+voicings (s, a, t, b) they allow are enumerated once per distinct chord
+and kept in a VoicingCache, so that repeated chords of a progression,
+and every engine solving it, reuse them.
+
+The rules only look at the chord tones relative to the root, and at
+intervals between voices: the voicings of a chord transposed by a few
+semitones are the cached ones shifted by as many, except near the ends
+of the voice ranges. Those are the only voicings enumerated again (see
+transpose_voicings()), so that a progression costs little more in all
+twelve keys than in one.
+
+Main functions:
+  singer_domain()
+  chord_voicings()
+  transpose_voicings()
+  step_voicings()
+  tabulate_voicings()
+'''
+
+import sys
+from collections import OrderedDict
+
+import config
+from harmony_rules import *
+
+sys.path.append("..")
+from constraint import constraint
+from util.constants import *
+
+VOICE_RANGES = {"s": soprano_range,
+                "a": alto_range,
+                "t": tenor_range,
+                "b": bass_range}
+
+def singer_domain(voice, chord, ranges=None):
+    """ Returns a list of valid possible pitches for VOICE to sing on
+    CHORD: the pitches of its range on a chord tone, grouped by chord
+    tone.
+    Input:
+        str VOICE: "s", "a", "t", or "b"
+        Chord CHORD:
+        dict RANGES: Maps voices to their list of pitches. Defaults to
+            VOICE_RANGES.
+    Output:
+        list PITCHES: [int pitch0, ...]
+    """
+    voice_range = (ranges or VOICE_RANGES)[voice]
+    by_class = {}
+    for pitch in voice_range:
+        by_class.setdefault(pitch % 12, []).append(pitch)
+    domain = []
+    for note in chord.getChordTones_nums():
+        domain.extend(by_class.get(note, ()))
+    return domain
+
+def voicing_key(chord, ranges=None):
+    """ Returns the key of the voicings of CHORD in a VoicingCache: all
+    the rules of a time step look at are the chord tones (its root and
+    modifiers), the bass note, the role and the singer ranges. The
+    modifiers themselves aren't part of the key, since
+    Chord.getChordTones() rewrites them ("dim", "7" -> "dim7").
+    """
+    ranges = ranges or VOICE_RANGES
+    return (tuple(chord.getChordTones_nums()), chord.bassNote, chord.role,
+            tuple(tuple(ranges[voice]) for voice in VOICE_PREFIXES))
+
+def transposition_key(chord, ranges=None):
+    """ Returns (KEY, ROOT): the voicing_key() of CHORD transposed to a
+    root on C, and the pitch class of its root. The voicings of chords
+    of the same KEY are the same up to a transposition, but for the ends
+    of the voice ranges.
+    """
+    ranges = ranges or VOICE_RANGES
+    tones = chord.getChordTones_nums()
+    root = tones[0]
+    bass = None
+    if chord.bassNote != None:
+        bass = (chord.bassNum - root) % 12
+    return (tuple((tone - root) % 12 for tone in tones), bass, chord.role,
+            tuple(tuple(ranges[voice]) for voice in VOICE_PREFIXES)), root
+
+def _interval(root_1, root_2):
+    """ Returns the shift from pitch class ROOT_1 to ROOT_2, between -5
+    and 6 semitones.
+    """
+    return (root_2 - root_1 + 5) % 12 - 5
+
+def enumerate_voicings(chord, ranges=None, edges=None):
+    """ Lists the voicings of CHORD allowed by the rules of a time step.
+    Spacing and crossing are checked voice by voice, from the bass up,
+    so that only chord spellings within them are ever completed.
+    Input:
+        Chord CHORD:
+        dict RANGES: See singer_domain().
+        list EDGES: If given, the sets of pitches of each voice, in (s, a,
+            t, b) order, one of which the voicings listed must sing.
+    Output:
+        tuple VOICINGS: Sorted (int s, int a, int t, int b) tuples.
+    """
+    domains = [sorted(singer_domain(voice, chord, ranges))
+               for voice in VOICE_PREFIXES]
+    sopranos, altos, tenors, basses = domains
+    covers_chord = specifyChord(chord)
+    if chord.bassNote != None:
+        basses = filter(setBass(chord), basses)
+    everywhere = edges is None
+    if everywhere:
+        edges = [()] * len(VOICE_PREFIXES)
+    edge_s, edge_a, edge_t, edge_b = edges
+    edge_sopranos = [s for s in sopranos if s in edge_s]
+    voicings = []
+    for b in basses:
+        on_b = everywhere or b in edge_b
+        for t in tenors:
+            if t < b or t - b > 12:
+                continue
+            on_t = on_b or t in edge_t
+            for a in altos:
+                if a < t or a - t > 12:
+                    continue
+                # Unless a lower voice is on an edge, the soprano must be
+                for s in (sopranos if on_t or a in edge_a else edge_sopranos):
+                    if s < a or s - a > 12:
+                        continue
+                    if covers_chord(s, a, t, b):
+                        voicings.append((s, a, t, b))
+    voicings.sort()
+    return tuple(voicings)
+
+def transpose_voicings(chord, voicings, shift, ranges=None):
+    """ Returns the voicings of CHORD, given the VOICINGS of the same chord
+    SHIFT semitones lower (see transposition_key()): the ones still
+    within the voice ranges once shifted, and the ones enumerated among
+    the pitches that shifting back takes out of them.
+    Output:
+        tuple VOICINGS: Sorted (int s, int a, int t, int b) tuples.
+    """
+    ranges = ranges or VOICE_RANGES
+    allowed = [set(ranges[voice]) for voice in VOICE_PREFIXES]
+    shifted = []
+    for voicing in voicings:
+        voicing = tuple(pitch + shift for pitch in voicing)
+        if not [1 for pitch, pitches in zip(voicing, allowed)
+                if pitch not in pitches]:
+            shifted.append(voicing)
+    edges = [set(pitch for pitch in pitches if pitch - shift not in pitches)
+             for pitches in allowed]
+    return tuple(sorted(shifted + list(enumerate_voicings(chord, ranges,
+                                                          edges))))
+
+class VoicingCache(object):
+    """ Maps chords to their voicings (see enumerate_voicings()),
+    keeping the MAXSIZE most recently used ones. On a miss, the voicings
+    of the nearest transposition of the chord cached, if any, are
+    transposed (see transpose_voicings()) when TRANSPOSE is True.
+
+    Attributes:
+        int MAXSIZE:
+        bool TRANSPOSE:
+        int HITS, MISSES: Lookups answered from the cache, or not.
+        int TRANSPOSED: Misses answered by transposing cached voicings.
+    """
+    def __init__(self, maxsize, transpose=True):
+        self.maxsize = maxsize
+        self.transpose = transpose
+        self.hits = 0
+        self.misses = 0
+        self.transposed = 0
+        self._entries = OrderedDict()  # key -> (voicings, transposition key, root)
+        self._roots = {}               # transposition key -> {root: key}
+
+    def get(self, chord, ranges=None):
+        """ Returns the voicings of CHORD, enumerating them on a miss.
+        Output:
+            tuple VOICINGS: Sorted (int s, int a, int t, int b) tuples.
+        """
+        key = voicing_key(chord, ranges)
+        entries = self._entries
+        entry = entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            tkey, root = transposition_key(chord, ranges)
+            roots = self._roots.setdefault(tkey, {})
+            if self.transpose and roots:
+                nearest = min(roots, key=lambda other:
+                              abs(_interval(other, root)))
+                voicings = transpose_voicings(chord,
+                                              entries[roots[nearest]][0],
+                                              _interval(nearest, root),
+                                              ranges)
+                self.transposed += 1
+            else:
+                voicings = enumerate_voicings(chord, ranges)
+            entry = (voicings, tkey, root)
+        else:
+            self.hits += 1
+        if self.maxsize > 0:
+            if len(entries) >= self.maxsize:
+                old, (voicings_, tkey, root) = entries.popitem(last=False)
+                if self._roots[tkey].get(root) == old:
+                    del self._roots[tkey][root]
+            entries[key] = entry
+            self._roots.setdefault(entry[1], {})[entry[2]] = key
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self._roots.clear()
+        self.hits = self.misses = self.transposed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+cache = VoicingCache(config.voicing_cache_size, config.voicing_transpositions)
+
+def chord_voicings(chord, ranges=None):
+    """ Returns the voicings of CHORD from the shared cache. """
+    return cache.get(chord, ranges)
+
+def within_ranges(chord, variables, domains, ranges=None):
+    """ Returns True if the DOMAINS of VARIABLES (in (s, a, t, b) order)
+    only hold pitches the voicings of CHORD are enumerated from. Voices
+    specified by the user may sing outside their range.
+    """
+    for voice, var in zip(VOICE_PREFIXES, variables):
+        pitches = set(singer_domain(voice, chord, ranges))
+        if [1 for pitch in domains[var] if pitch not in pitches]:
+            return False
+    return True
+
+class VoicingTableConstraint(HarmonyTableConstraint):
+    """ All the rules of a time step on (s, a, t, b), answered from the
+    cached voicings of its chord.
+    """
+    def __init__(self, chord):
+        rules = [SpecifyChordConstraint(chord)._func,
+                 lambda s, a, t, b: checkCrossOver(s, a, t, b) and
+                     handleSpacing(s, a) and handleSpacing(a, t) and
+                     handleSpacing(t, b)]
+        if chord.bassNote != None:
+            covers_bass = setBass(chord)
+            rules.append(lambda s, a, t, b: covers_bass(b))
+        func = lambda s, a, t, b: not [1 for rule in rules
+                                       if not rule(s, a, t, b)]
+        HarmonyTableConstraint.__init__(self, HarmonyConstraint(func,
+                                        "voicing_" + str(chord.time)), 0)
+        self.chord = chord
+
+    def preProcess(self, variables, domains, constraints, vconstraints):
+        constraint.Constraint.preProcess(self, variables, domains,
+                                         constraints, vconstraints)
+        if not within_ranges(self.chord, variables, domains):
+            # Specified pitches out of the cached voicings: keep calling
+            # the function.
+            self._tuples = None
+            return
+        known = [domains[variable][:] for variable in variables]
+        allowed = [set(values) for values in known]
+        self.setTable(variables, domains, known,
+                      [voicing for voicing in chord_voicings(self.chord)
+                       if not [1 for pitch, values in zip(voicing, allowed)
+                               if pitch not in values]])
+
+def _step_rules(variables, rules, domains=None):
+    """ Splits the RULES of the time step of VARIABLES (in (s, a, t, b)
+    order) into the chord whose cached voicings enforce some of them,
+    and the others. The SetBassConstraint of a chord may be missing when
+    DOMAINS, once preprocessed, only keep bass pitches on the bass note.
+    Output:
+        (Chord CHORD, list OTHERS), or (None, RULES) if the voicings of
+        the chord don't match the rules.
+    """
+    s, a, t, b = variables
+    chord, bass = None, None
+    spacings, crossover = set(), False
+    others = []
+    for item in rules:
+        constraint_, cvars = item
+        rule = getattr(constraint_, "rule", constraint_)
+        cvars = tuple(cvars)
+        if isinstance(constraint_, VoicingTableConstraint) and \
+                cvars == variables:
+            if chord is not None:
+                return None, rules
+            chord = constraint_.chord
+            if chord.bassNote != None:
+                bass = chord
+            spacings, crossover = set([(s, a), (a, t), (t, b)]), True
+        elif isinstance(rule, SpecifyChordConstraint) and cvars == variables:
+            if chord is not None:
+                return None, rules
+            chord = rule.chord
+        elif isinstance(rule, SetBassConstraint) and cvars == (b,):
+            bass = rule.chord
+        elif isinstance(rule, SpacingConstraint):
+            spacings.add(cvars)
+        elif isinstance(rule, CrossoverConstraint) and cvars == variables:
+            crossover = True
+        else:
+            others.append(item)
+    if chord is None or not crossover or \
+            spacings != set([(s, a), (a, t), (t, b)]) or \
+            (bass is not None and bass is not chord):
+        return None, rules
+    if bass is None and chord.bassNote != None:
+        if domains is None or \
+                [1 for pitch in domains[b] if not setBass(chord)(pitch)]:
+            return None, rules
+    return chord, others
+
+def step_voicings(variables, domains, rules):
+    """ Returns the voicings of the time step of VARIABLES (in (s, a, t,
+    b) order) allowed by its RULES, from the cached voicings of its
+    chord, or None if the rules aren't the ones of a chord or the domains
+    reach outside its voicings.
+    Input:
+        tuple VARIABLES:
+        dict DOMAINS: Maps CSP vars to their domains.
+        list RULES: [(Constraint constraint, list variables), ...]
+    Output:
+        list VOICINGS: Sorted (int s, int a, int t, int b) tuples.
+    """
+    chord, others = _step_rules(variables, rules, domains)
+    if chord is None or not within_ranges(chord, variables, domains):
+        return None
+    allowed = [set(domains[var]) for var in variables]
+    voicings = []
+    assignments = {}
+    for voicing in chord_voicings(chord):
+        if [1 for pitch, values in zip(voicing, allowed)
+            if pitch not in values]:
+            continue
+        if others:
+            assignments.update(zip(variables, voicing))
+            if [1 for constraint_, cvars in others
+                if not constraint_(cvars, domains, assignments)]:
+                continue
+        voicings.append(voicing)
+    return voicings
+
+def tabulate_voicings(problem):
+    """ Replaces the rules of each time step of PROBLEM enforced by the
+    voicings of its chord by a single VoicingTableConstraint.
+    Input:
+        Problem PROBLEM: A harmony problem.
+    Output:
+        Problem PROBLEM.
+    """
+    from chain import split_var
+    bytime = {}
+    for var in problem._variables:
+        voice, t = split_var(var)
+        bytime.setdefault(t, {})[voice] = var
+    steps = {}
+    for i, (constraint_, cvars) in enumerate(problem._constraints):
+        ts = set(split_var(var)[1] for var in cvars)
+        if len(ts) == 1:
+            steps.setdefault(ts.pop(), []).append(i)
+    dropped = set()
+    added = []
+    for t, indices in steps.items():
+        if len(bytime[t]) != len(VOICE_PREFIXES):
+            continue
+        variables = tuple(bytime[t][voice] for voice in VOICE_PREFIXES)
+        rules = [problem._constraints[i] for i in indices]
+        chord, others = _step_rules(variables, rules, problem._variables)
+        if chord is None:
+            continue
+        kept = set(id(rule) for rule in others)
+        dropped.update(i for i, rule in zip(indices, rules)
+                       if id(rule) not in kept)
+        added.append((VoicingTableConstraint(chord), variables))
+    problem._constraints = [rule for i, rule in
+                            enumerate(problem._constraints)
+                            if i not in dropped] + added
+    return problem
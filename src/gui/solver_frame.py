@@ -10,6 +10,7 @@ import tkFont
 import tkMessageBox
 import tkSimpleDialog
 import core.solver
+import core.config
 import gui.config
 import playback.playSolution
 import util.constants
@@ -26,20 +27,23 @@ class SolveThread(threading.Thread):
     def run(self):
         solverframe = self.solverframe
         solverframe.haltButton.flash()
-        solutions = self.harmonySolver.solveProblem()
-        if solutions == None:
+        """
+        Display each solution better than the ones before as soon as it's found
+        """
+        found = False
+        for grade, solution, stats in self.harmonySolver.solveProblem_anytime():
+            found = True
+            print "Grade {0} ({1})".format(grade, stats)
+            solverframe.display_solution(solution, grade)
+        solutions = self.harmonySolver.solutions
+        if not found:
             tkMessageBox.showwarning("No solutions", \
                                      "The solver didn't find any solutions! Try rechecking your harmony \
                                      or make sure your specified lines aren't wrong.")
             solverframe.haltButton.config(state=DISABLED)
             return
         print "Number sol's: ", len(solutions)
-        """
-        Retrieve first solution from solutions and display it
-        """
-        firstSolution_tuple = solutions[0]
-        firstSolution_grade, firstSolution = firstSolution_tuple
-        solverframe.display_solution(firstSolution, firstSolution_grade)
+        solverframe.sol_index = 0
         solverframe.openSolutionsResultWindow()
         solverframe.haltButton.config(state=DISABLED)
 
@@ -100,6 +104,8 @@ class SolverFrame(Frame):
         specified_notes = self.staff.notes
         for i in ("soprano" , "alto" , "tenor" , "bass"):
             harmonySolver.specify_voice(i, specified_notes[i])
+        """ Solve again along the voicings kept from the last solve """
+        harmonySolver.engine = harmonySolver.resolveEngine()
         solveThread = SolveThread(harmonySolver, self)
         solveThread.start()
 
@@ -144,6 +150,8 @@ class SolutionsResultWindow(Toplevel):
 
 
     def next_solution(self):
+        if core.config.ranked_solutions:
+            return self.show_ranked(self.solverFrame.sol_index + 1)
         harmonySolver = self.solverFrame.harmonySolver
         if len(harmonySolver.solutions) == 0:
             return
@@ -159,6 +167,8 @@ class SolutionsResultWindow(Toplevel):
         self.solverFrame.display_solution(next_sol, next_grade)
 
     def prev_solution(self):
+        if core.config.ranked_solutions:
+            return self.show_ranked(max(self.solverFrame.sol_index - 1, 0))
         harmonySolver = self.solverFrame.harmonySolver
         if len(harmonySolver.solutions) == 0:
             return
@@ -173,11 +183,32 @@ class SolutionsResultWindow(Toplevel):
         next_sol = next_sol_tuple[1]
         self.solverFrame.display_solution(next_sol, next_grade)
 
+    def show_ranked(self, index):
+        """ Shows the solution ranked INDEX by grade, from 0 for the best
+        one (see HarmonySolver.ranked_solution()).
+        """
+        harmonySolver = self.solverFrame.harmonySolver
+        sol_tuple = harmonySolver.ranked_solution(index)
+        if sol_tuple == None:
+            print "==== Looping in the ranked solutions"
+            index = 0
+            sol_tuple = harmonySolver.ranked_solution(index)
+            if sol_tuple == None:
+                return
+        self.solverFrame.sol_index = index
+        self.solverFrame.display_solution(sol_tuple[1], sol_tuple[0])
+
     def playSolution(self):
         harmonySolver = self.solverFrame.harmonySolver
-        if len(harmonySolver.solutions) == 0:
+        if core.config.ranked_solutions:
+            sol_tuple = harmonySolver.ranked_solution(self.solverFrame.sol_index)
+            if sol_tuple == None:
+                return
+            grade, solution = sol_tuple
+        elif len(harmonySolver.solutions) == 0:
             return
-        grade, solution = harmonySolver.solutions[self.solverFrame.sol_index]
+        else:
+            grade, solution = harmonySolver.solutions[self.solverFrame.sol_index]
         # solution is a list: list notes
         #   where notes[i] is: ["<singer><time>", int pitchnum]
         display_solution(solution)